@@ -0,0 +1,5 @@
+"""PaintStock Bot: учет порошковой краски в Telegram.
+
+Запуск: python -m paintstock (см. __main__.py). Импорт пакета ничего не
+загружает - тяжелые модули подтягиваются при старте бота.
+"""
@@ -0,0 +1,60 @@
+"""Точка входа: python -m paintstock [run | import-simple ПУТЬ [--effect ЭФФЕКТ]]
+
+Быстрый старт: HTTP-сервер на $PORT поднимается до импорта telebot,
+обработчиков и прогрева базы, так что health check отвечает через
+миллисекунды после запуска контейнера. /health сразу отвечает 200,
+/ready - 503, пока бот не готов.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+logger = logging.getLogger('paintstock')
+
+
+def run():
+    started = time.perf_counter()
+    from .webhook import BotServer  # только стандартная библиотека
+
+    server = BotServer()
+    server.start_in_thread()
+    server.started.wait()
+    logger.info(f"⚡ Health check отвечает через {(time.perf_counter() - started) * 1000:.0f} мс после старта")
+
+    from . import app  # telebot, обработчики, пул базы
+    logger.info(f"📦 Модули загружены за {(time.perf_counter() - started) * 1000:.0f} мс")
+    app.run(server)
+
+
+def import_simple(path, effect):
+    from . import app, legacy
+
+    app.init_db()  # сам переносит SIMPLE_DB_PATH, если это тот же файл
+    if app.backend.ledger is not app.db:
+        logger.error("❌ Перенос простого бота - только в SQLite-склад (STORAGE_DSN задает сервер БД)")
+        return
+    if os.path.exists(path):
+        legacy.import_simple_db(app.db, path, effect=effect or legacy.DEFAULT_EFFECT)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(prog='python -m paintstock', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help='запустить бота (по умолчанию)')
+    simple = commands.add_parser('import-simple', help='перенести склад простого бота (paints.db)')
+    simple.add_argument('path')
+    simple.add_argument('--effect', help='эффект для перенесенных красок (по умолчанию Матовый)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'import-simple':
+        import_simple(args.path, args.effect)
+    else:
+        run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
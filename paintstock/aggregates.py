@@ -0,0 +1,218 @@
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Таблицы агрегатов и триггеры, которые ведут их в той же транзакции, что и
+# запись в paints/transactions - так агрегаты не зависят от того, каким путем
+# (мастер, списание, пакет, импорт) пришла операция. Это схема v4; после
+# перехода на журнал (ledger.migrate_to_ledger) триггеры на paints заменены,
+# а с ledger.migrate_to_grams количества - целые граммы вместо REAL
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS effect_totals (
+        effect TEXT PRIMARY KEY,
+        positions INTEGER NOT NULL,
+        quantity REAL NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS code_totals (
+        color_code TEXT PRIMARY KEY,
+        positions INTEGER NOT NULL,
+        quantity REAL NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        day TEXT PRIMARY KEY,
+        added REAL NOT NULL,
+        used REAL NOT NULL,
+        operations INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS daily_consumption (
+        day TEXT NOT NULL,
+        paint_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        PRIMARY KEY (day, paint_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS paints_totals_insert AFTER INSERT ON paints
+    BEGIN
+        INSERT INTO effect_totals (effect, positions, quantity) VALUES (NEW.effect, 1, NEW.quantity)
+        ON CONFLICT (effect) DO UPDATE
+        SET positions = positions + 1, quantity = quantity + excluded.quantity;
+        INSERT INTO code_totals (color_code, positions, quantity) VALUES (NEW.color_code, 1, NEW.quantity)
+        ON CONFLICT (color_code) DO UPDATE
+        SET positions = positions + 1, quantity = quantity + excluded.quantity;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS paints_totals_update AFTER UPDATE OF color_code, effect, quantity ON paints
+    BEGIN
+        UPDATE effect_totals SET positions = positions - 1, quantity = quantity - OLD.quantity
+        WHERE effect = OLD.effect;
+        UPDATE code_totals SET positions = positions - 1, quantity = quantity - OLD.quantity
+        WHERE color_code = OLD.color_code;
+        INSERT INTO effect_totals (effect, positions, quantity) VALUES (NEW.effect, 1, NEW.quantity)
+        ON CONFLICT (effect) DO UPDATE
+        SET positions = positions + 1, quantity = quantity + excluded.quantity;
+        INSERT INTO code_totals (color_code, positions, quantity) VALUES (NEW.color_code, 1, NEW.quantity)
+        ON CONFLICT (color_code) DO UPDATE
+        SET positions = positions + 1, quantity = quantity + excluded.quantity;
+        DELETE FROM code_totals WHERE color_code = OLD.color_code AND positions = 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS paints_totals_delete AFTER DELETE ON paints
+    BEGIN
+        UPDATE effect_totals SET positions = positions - 1, quantity = quantity - OLD.quantity
+        WHERE effect = OLD.effect;
+        UPDATE code_totals SET positions = positions - 1, quantity = quantity - OLD.quantity
+        WHERE color_code = OLD.color_code;
+        DELETE FROM code_totals WHERE color_code = OLD.color_code AND positions = 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS transactions_daily_insert AFTER INSERT ON transactions
+    BEGIN
+        INSERT INTO daily_totals (day, added, used, operations)
+        VALUES (date(NEW.date),
+                CASE WHEN NEW.type = 'add' THEN NEW.amount ELSE 0 END,
+                CASE WHEN NEW.type = 'use' THEN NEW.amount ELSE 0 END,
+                1)
+        ON CONFLICT (day) DO UPDATE
+        SET added = added + excluded.added, used = used + excluded.used, operations = operations + 1;
+        INSERT INTO daily_consumption (day, paint_id, amount)
+        SELECT date(NEW.date), NEW.paint_id, NEW.amount WHERE NEW.type = 'use'
+        ON CONFLICT (day, paint_id) DO UPDATE SET amount = amount + excluded.amount;
+    END
+    ''',
+]
+
+# Пересчет агрегатов с нуля по остаткам (paint_stock) и журналу transactions
+REBUILD_SQL = [
+    'DELETE FROM effect_totals',
+    'DELETE FROM code_totals',
+    'DELETE FROM daily_totals',
+    'DELETE FROM daily_consumption',
+    '''
+    INSERT INTO effect_totals (effect, positions, quantity)
+    SELECT effect, COUNT(*), SUM(quantity) FROM paint_stock GROUP BY effect
+    ''',
+    '''
+    INSERT INTO code_totals (color_code, positions, quantity)
+    SELECT color_code, COUNT(*), SUM(quantity) FROM paint_stock GROUP BY color_code
+    ''',
+    '''
+    INSERT INTO daily_totals (day, added, used, operations)
+    SELECT date(date),
+           SUM(CASE WHEN type = 'add' THEN amount ELSE 0 END),
+           SUM(CASE WHEN type = 'use' THEN amount ELSE 0 END),
+           COUNT(*)
+    FROM transactions GROUP BY date(date)
+    ''',
+    '''
+    INSERT INTO daily_consumption (day, paint_id, amount)
+    SELECT date(date), paint_id, SUM(amount) FROM transactions
+    WHERE type = 'use' GROUP BY date(date), paint_id
+    ''',
+]
+
+# Те же агрегаты, посчитанные заново, - для сверки: (таблица, ключи, текущие, эталон)
+VERIFY_QUERIES = [
+    ('effect_totals', 1,
+     'SELECT effect, positions, quantity FROM effect_totals',
+     'SELECT effect, COUNT(*), SUM(quantity) FROM paint_stock GROUP BY effect'),
+    ('code_totals', 1,
+     'SELECT color_code, positions, quantity FROM code_totals',
+     'SELECT color_code, COUNT(*), SUM(quantity) FROM paint_stock GROUP BY color_code'),
+    ('daily_totals', 1,
+     'SELECT day, added, used, operations FROM daily_totals',
+     '''SELECT date(date), SUM(CASE WHEN type = 'add' THEN amount ELSE 0 END),
+               SUM(CASE WHEN type = 'use' THEN amount ELSE 0 END), COUNT(*)
+        FROM transactions GROUP BY date(date)'''),
+    ('daily_consumption', 2,
+     'SELECT day, paint_id, amount FROM daily_consumption',
+     "SELECT date(date), paint_id, SUM(amount) FROM transactions WHERE type = 'use' "
+     "GROUP BY date(date), paint_id"),
+]
+
+EFFECT_TOTALS_SQL = 'SELECT effect, positions, quantity FROM effect_totals WHERE positions > 0 ORDER BY quantity DESC'
+DAILY_SQL = 'SELECT day, added, used, operations FROM daily_totals WHERE day >= ? ORDER BY day DESC'
+# Ключ недели - дата ее понедельника (week_key); так же считает PG_WEEKLY_SQL.
+# Неделя на стыке лет не делится надвое, как у strftime('%W')
+WEEKLY_SQL = '''
+    SELECT date(day, 'weekday 0', '-6 days') AS week, MIN(day), SUM(added), SUM(used), SUM(operations)
+    FROM daily_totals WHERE day >= ?
+    GROUP BY week ORDER BY week DESC
+'''
+TOP_CONSUMERS_SQL = '''
+    SELECT p.color_code, SUM(d.amount) AS used
+    FROM daily_consumption d
+    JOIN paints p ON p.id = d.paint_id
+    WHERE d.day >= ?
+    GROUP BY p.color_code
+    ORDER BY used DESC
+    LIMIT ?
+'''
+
+
+def since(days):
+    """Первый день окна из days последних дней (UTC), как в колонке day"""
+    return (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+
+
+def week_key(day):
+    """Ключ недели дня (date): дата понедельника, 'YYYY-MM-DD'"""
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def effect_breakdown(db):
+    return db.fetchall(EFFECT_TOTALS_SQL)
+
+
+def daily(db, days=14):
+    """[(день, приход, расход, операций)] за последние дни, новые первыми"""
+    return db.fetchall(DAILY_SQL, (since(days),))
+
+
+def weekly(db, weeks=8):
+    """[(неделя, первый день, приход, расход, операций)] по неделям, новые первыми"""
+    return db.fetchall(WEEKLY_SQL, (since(weeks * 7),))
+
+
+def top_consumers(db, days=30, limit=10):
+    """Коды с наибольшим расходом за последние дни: [(код, расход)]"""
+    return db.fetchall(TOP_CONSUMERS_SQL, (since(days), limit))
+
+
+def rebuild(db):
+    """Пересчитывает все агрегаты из paints и transactions одной транзакцией"""
+    with db.transaction() as conn:
+        for sql in REBUILD_SQL:
+            conn.execute(sql)
+    logger.info("📊 Агрегаты статистики пересчитаны")
+
+
+def verify(db):
+    """Сверяет агрегаты с пересчетом по журналу: [(таблица, ключ, сейчас, должно быть)]"""
+    mismatches = []
+    with db.transaction(immediate=False) as conn:
+        for table, key_size, current_sql, expected_sql in VERIFY_QUERIES:
+            current = {row[:key_size]: row[key_size:] for row in conn.execute(current_sql)}
+            expected = {row[:key_size]: row[key_size:] for row in conn.execute(expected_sql)}
+            for key in current.keys() | expected.keys():
+                have = current.get(key)
+                want = expected.get(key)
+                if have is None and want is not None and not any(want):
+                    continue
+                if have is not None and want is None and not any(have):
+                    continue  # нулевая строка эффекта, у которого не осталось позиций
+                # Граммы - целые числа, сверка точная
+                if have is None or want is None or any((a or 0) != (b or 0) for a, b in zip(have, want)):
+                    mismatches.append((table, key, have, want))
+    return mismatches
@@ -0,0 +1,1455 @@
+import telebot
+import os
+import logging
+import html
+import io
+from datetime import datetime
+import time
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from .storage import get_pool, migrate, check_query_plans
+from .dispatcher import UpdateDispatcher
+from .sender import Sender, configure_transport
+from .stock_pages import FIRST_PAGE_SQL, NEXT_PAGE_SQL, PREV_PAGE_SQL
+from .search_index import SearchIndex, EXACT_SCORE, code_digest
+from .state_store import MemoryStateStore, make_state_store
+from .parsing import ParseError, parse_writeoff_words, iter_text_lines, iter_csv_rows
+from .grams import to_grams, format_kg
+from .inventory import WriteOffError, PaintNotFound, InsufficientStock
+from .importer import ImportErrors, Progress, download_file, iter_file_rows, import_stock
+from .render import Markup, Template, freeze
+from . import aggregates
+from . import ledger
+from . import forecasting
+from . import warehouses as warehouses_module
+from . import replicas
+from .warehouses import Warehouses, transfer
+from .backends import SQLiteBackend, open_backend
+from .registry import HandlerRegistry, load_handlers, install_handlers
+from .webhook import BotServer, run_bot
+from . import metrics
+from . import legacy
+from .exporter import (ExportRequest, EXPORT_PAINTS_SQL, EXPORT_TRANSACTIONS_SQL, MAX_DOCUMENT_SIZE,
+                      export, spool_size)
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Токен из переменных окружения
+TOKEN = os.environ.get('BOT_TOKEN')
+if not TOKEN:
+    logger.error("❌ BOT_TOKEN не установлен!")
+    exit(1)
+
+bot = telebot.TeleBot(TOKEN)
+logger.info("🎨 Бот для учета краски запускается...")
+
+# Обработчики этого модуля; к боту подключаются в run() вместе с модулями из HANDLER_MODULES
+handlers = HandlerRegistry()
+HANDLER_MODULES = [name for name in os.environ.get('HANDLER_MODULES', __name__).split(',') if name.strip()]
+
+# Исходящие сообщения: очередь с лимитами Telegram и повтором на 429
+sender = Sender(bot, workers=int(os.environ.get('SEND_WORKERS', 8)))
+
+# Основная база: склад по умолчанию, справочник складов, состояния диалогов
+DB_PATH = os.environ.get('DB_PATH', 'paint_db.sqlite')
+db = get_pool(DB_PATH)
+
+# Префиксный и нечеткий поиск по кодам (общий для всех складов)
+index = SearchIndex()
+# Inline-режим (@bot код...): сколько секунд Telegram может кэшировать ответ
+INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', 10))
+
+# Миграции схемы: номер шага = версия схемы (PRAGMA user_version)
+MIGRATIONS = [
+    # 1: исходные таблицы
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS paints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            color_code TEXT NOT NULL,
+            effect TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            unit TEXT DEFAULT 'kg',
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            paint_id INTEGER,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (paint_id) REFERENCES paints (id)
+        )
+        ''',
+    ],
+    # 2: склейка дублей и индексы под горячие запросы
+    [
+        # Переносим операции дублей на самую раннюю запись
+        '''
+        UPDATE transactions SET paint_id = (
+            SELECT MIN(d.id) FROM paints p JOIN paints d
+              ON d.color_code = p.color_code AND d.effect = p.effect
+            WHERE p.id = transactions.paint_id
+        )
+        WHERE paint_id IN (
+            SELECT p.id FROM paints p JOIN paints d
+              ON d.color_code = p.color_code AND d.effect = p.effect AND d.id < p.id
+        )
+        ''',
+        '''
+        UPDATE paints SET quantity = (
+            SELECT SUM(d.quantity) FROM paints d
+            WHERE d.color_code = paints.color_code AND d.effect = paints.effect
+        )
+        WHERE id IN (SELECT MIN(id) FROM paints GROUP BY color_code, effect HAVING COUNT(*) > 1)
+        ''',
+        'DELETE FROM paints WHERE id NOT IN (SELECT MIN(id) FROM paints GROUP BY color_code, effect)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_paints_code_effect ON paints (color_code, effect)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_paint_date ON transactions (paint_id, date)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)',
+    ],
+    # 3: состояния диалогов (SQLiteStateStore)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            chat_id INTEGER PRIMARY KEY,
+            step TEXT NOT NULL,
+            data TEXT NOT NULL DEFAULT '',
+            expires_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states (expires_at)',
+    ],
+    # 4: агрегаты статистики, которые ведут триггеры (заполняются пересчетом в шаге 6)
+    aggregates.SCHEMA,
+    # 5: подписки на оповещения и последний прогноз по каждой краске
+    forecasting.SCHEMA,
+    # 6: журнал операций - источник истины: paints без quantity, снимки остатков
+    ledger.migrate_to_ledger,
+    # 7: количества - целые граммы вместо REAL кг (журнал, снимки, агрегаты)
+    ledger.migrate_to_grams,
+    # 8: склады, привязки чатов и переводы между складами
+    warehouses_module.migrate_to_warehouses,
+    # 9: аренда лидера и живые реплики (BOT_MODE=replicas)
+    replicas.SCHEMA,
+    # 10: владелец склада и код приглашения
+    warehouses_module.migrate_warehouse_access,
+    # 11: счетчик изменений справочника складов и привязок чатов
+    warehouses_module.REGISTRY_VERSION_SCHEMA,
+]
+
+# Миграции файлов складов (кроме основной базы): номера шагов те же, что в
+# MIGRATIONS, чтобы PRAGMA user_version файлов была сравнима, но таблицы,
+# которые ведутся один раз на бота, - состояния диалогов, справочник
+# складов, аренда реплик - сюда не входят (пустой шаг). Новый шаг
+# добавляется в оба списка. В файлах, заведенных до разделения списков,
+# эти таблицы остались пустыми и не читаются
+WAREHOUSE_MIGRATIONS = [
+    MIGRATIONS[0],                              # 1: исходные таблицы
+    MIGRATIONS[1],                              # 2: склейка дублей и индексы
+    [],                                         # 3: состояния диалогов - только DB_PATH
+    aggregates.SCHEMA,                          # 4: агрегаты статистики
+    forecasting.SCHEMA,                         # 5: подписки и прогноз - у каждого склада свои
+    ledger.migrate_to_ledger,                   # 6: журнал операций
+    ledger.migrate_to_grams,                    # 7: целые граммы
+    warehouses_module.migrate_warehouse_file,   # 8: переводы, без справочника складов
+    [],                                         # 9: аренда реплик - только DB_PATH
+    [],                                         # 10: коды приглашений - в справочнике
+    [],                                         # 11: счетчик справочника - в справочнике
+]
+if len(WAREHOUSE_MIGRATIONS) != len(MIGRATIONS):
+    raise RuntimeError('WAREHOUSE_MIGRATIONS отстает от MIGRATIONS: шаг нужно добавить в оба списка')
+
+def notify_low_stock(warehouse, chat_id, text):
+    """Оповещение о заканчивающейся краске; у кого складов несколько - с именем склада"""
+    if len(warehouses.for_chat(chat_id)) > 1:
+        text = f"🏬 <b>{html.escape(warehouse.name)}</b>\n{text}"
+    sender.send_message(chat_id, text, parse_mode='HTML')
+
+# Хранилище склада по умолчанию: без STORAGE_DSN - журнал в DB_PATH,
+# postgresql://... - сервер БД (см. backends). Состояния диалогов и
+# справочник складов остаются в DB_PATH
+STORAGE_DSN = os.environ.get('STORAGE_DSN', '')
+backend = (open_backend(STORAGE_DSN, WAREHOUSE_MIGRATIONS) if STORAGE_DSN
+           else SQLiteBackend(db, MIGRATIONS, sibling_migrations=WAREHOUSE_MIGRATIONS))
+
+# Склады: у каждого свое хранилище (файл или схема рядом со складом по
+# умолчанию), остатки в памяти, страницы списка, inline-кэш, прогноз
+# расхода и снимки остатков
+warehouses = Warehouses(
+    db, backend, index,
+    notify=notify_low_stock,
+    page_size=int(os.environ.get('LIST_PAGE_SIZE', 25)),
+    forecast_interval=int(os.environ.get('FORECAST_INTERVAL', 300)),
+    snapshot_interval=int(os.environ.get('SNAPSHOT_INTERVAL', 3600)),
+)
+
+# Горячие запросы, планы которых проверяются при старте
+HOT_QUERIES = {
+    'find_paint': 'SELECT id, quantity FROM paint_stock WHERE color_code = ? AND effect = ?',
+    'list_first_page': FIRST_PAGE_SQL,
+    'list_next_page': NEXT_PAGE_SQL,
+    'list_prev_page': PREV_PAGE_SQL,
+    'search_code': 'SELECT effect, quantity FROM paint_stock WHERE color_code = ? ORDER BY effect',
+    'recent_transactions': '''
+        SELECT p.color_code, p.effect, t.amount, t.date
+        FROM transactions t
+        JOIN paints p ON t.paint_id = p.id
+        ORDER BY t.date DESC
+        LIMIT 5
+    ''',
+    'paint_history': 'SELECT amount, date FROM transactions WHERE paint_id = ? ORDER BY date DESC',
+    'export_paints': EXPORT_PAINTS_SQL,
+    'export_transactions': EXPORT_TRANSACTIONS_SQL,
+    'stats_daily': aggregates.DAILY_SQL,
+    'forecast_at_risk': forecasting.AT_RISK_SQL,
+}
+
+# Склад простого бота (name/color), который переносится в эту базу при первом старте
+SIMPLE_DB_PATH = os.environ.get('SIMPLE_DB_PATH', 'paints.db')
+
+# Инициализация базы данных
+def init_db():
+    try:
+        version = migrate(db, MIGRATIONS)
+        logger.info(f"✅ База данных инициализирована (схема v{version})")
+        if (backend.ledger is db and os.path.exists(SIMPLE_DB_PATH)
+                and os.path.abspath(SIMPLE_DB_PATH) != os.path.abspath(DB_PATH)):
+            legacy.import_simple_db(db, SIMPLE_DB_PATH,
+                                    effect=os.environ.get('SIMPLE_DB_EFFECT', legacy.DEFAULT_EFFECT))
+        check_query_plans(db, HOT_QUERIES)
+        warehouses.load()
+        index.build({color_code for warehouse in warehouses.all()
+                     for color_code, _, _ in warehouse.stock.items()})
+        states.purge()
+    except Exception as e:
+        logger.error(f"❌ Ошибка инициализации БД: {e}")
+
+# Доступные эффекты
+EFFECTS = {
+    'matt': '🟢 Матовый',
+    'gloss': '🔵 Глянец', 
+    'moire': '🟣 Муар',
+    'texture': '🟠 Шагрень',
+    'varnish': '⚪ Лак'
+}
+
+def now():
+    """Текущее время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+def stock_changed(warehouse, color_code, effect, new_quantity, amount, txn_id):
+    """Обновляет кэши склада после успешной записи операции в его базу"""
+    warehouse.stock.update(color_code, effect, new_quantity, txn_id)
+    warehouse.stock.record(color_code, effect, amount, now(), txn_id)
+    position_changed(warehouse, color_code, effect)
+
+def stock_synced(warehouse, rows):
+    """Кэши склада после операций, записанных другими репликами (см. Warehouses.sync)"""
+    latest = {}
+    for txn_id, color_code, effect, amount, date, quantity in rows:
+        warehouse.stock.record(color_code, effect, amount, date, txn_id)
+        latest[(color_code, effect)] = (quantity, txn_id)
+    # Остаток в строках - текущий, поэтому версия - последняя операция позиции
+    for (color_code, effect), (quantity, txn_id) in latest.items():
+        if warehouse.stock.update(color_code, effect, quantity, txn_id):
+            position_changed(warehouse, color_code, effect)
+
+def position_changed(warehouse, color_code, effect):
+    """Страницы списка, поиск и прогноз, которые зависят от остатка позиции"""
+    warehouse.pages.invalidate(color_code, effect)
+    new_code = index.code_id(color_code) is None
+    index.add(color_code)
+    # Новый код появляется в поиске всех складов
+    for other in (warehouses.all() if new_code else [warehouse]):
+        other.inline.invalidate(color_code, new_code)
+    if warehouse.forecaster:
+        warehouse.forecaster.touch(color_code, effect)
+
+def ledger_db(chat_id):
+    """SQLite-журнал активного склада чата; для склада на сервере БД - None и ответ в чат"""
+    warehouse = warehouses.active(chat_id)
+    if warehouse.db is None:
+        sender.send_message(chat_id, "⚠️ Для склада на сервере БД эта команда недоступна")
+    return warehouse.db
+
+def warehouse_line(chat_id, warehouse):
+    """Строка с именем склада - только для чатов, у которых складов несколько"""
+    if len(warehouses.for_chat(chat_id)) < 2:
+        return ""
+    return Markup(f"🏬 Склад: <b>{html.escape(warehouse.name)}</b>\n")
+
+# Состояния диалогов: TTL, ограничение размера, по умолчанию в SQLite,
+# чтобы незаконченные диалоги переживали перезапуск
+states = make_state_store(
+    db,
+    kind=os.environ.get('STATE_STORE', 'sqlite'),
+    ttl=int(os.environ.get('STATE_TTL', 30 * 60)),
+    max_size=int(os.environ.get('STATE_MAX_SIZE', 10000)),
+)
+
+def get_state(user_id):
+    return states.get(user_id)
+
+def set_state(user_id, state):
+    states.set(user_id, state)
+
+def clear_state(user_id):
+    states.clear(user_id)
+
+# Создание главного меню
+MENU_BUTTONS = ('🎨 Добавить краску', '📋 Список красок', '📤 Списать краску',
+                '🔍 Поиск по коду', '📊 Статистика', 'ℹ️ Помощь')
+
+def build_main_keyboard():
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    buttons = [KeyboardButton(text) for text in MENU_BUTTONS]
+    keyboard.add(*buttons)
+    return keyboard
+
+# Создание клавиатуры для выбора эффекта
+def build_effect_keyboard():
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    for effect_key, effect_name in EFFECTS.items():
+        buttons.append(InlineKeyboardButton(effect_name, callback_data=f"effect_{effect_key}"))
+    keyboard.add(*buttons)
+    return keyboard
+
+# Статичные клавиатуры собираются и сериализуются в JSON один раз при
+# импорте: ответ не строит объекты кнопок и не вызывает json.dumps
+MAIN_KEYBOARD = freeze(build_main_keyboard())
+EFFECT_KEYBOARD = freeze(build_effect_keyboard())
+
+def create_main_keyboard():
+    return MAIN_KEYBOARD
+
+def create_effect_keyboard():
+    return EFFECT_KEYBOARD
+
+WELCOME_TEXT = """
+🎨 <b>Добро пожаловать в PaintStock Bot!</b>
+
+Простой и удобный учет порошковой краски и лаков.
+
+<b>Возможности:</b>
+• Учет по кодам (RAL, цифровые, буквенные)
+• 5 видов эффектов
+• Учет веса в кг
+• Поиск и статистика
+
+Выберите действие:
+""".strip()
+
+# Команда /start
+@handlers.message(commands=['start'])
+def send_welcome(message):
+    sender.send_message(
+        message.chat.id, 
+        WELCOME_TEXT,
+        parse_mode='HTML',
+        reply_markup=create_main_keyboard()
+    )
+    logger.info(f"👤 Пользователь {message.chat.id} запустил бота")
+
+# Команда /check_cache - сверка кэша остатков с базой
+MISMATCH_LINE = Template("• {code} ({effect}): кэш {cached}, база {actual}\n")
+
+@handlers.message(commands=['check_cache'])
+def check_cache(message):
+    try:
+        warehouse = warehouses.active(message.chat.id)
+        mismatches = warehouse.stock.diff(warehouse.backend)
+        if not mismatches:
+            count, _ = warehouse.stock.totals()
+            sender.send_message(message.chat.id, f"✅ Кэш совпадает с базой ({count} позиций)")
+            return
+        
+        response = f"⚠️ <b>Расхождений: {len(mismatches)}</b>\n\n"
+        for color_code, effect, cached, actual in mismatches[:20]:
+            response += MISMATCH_LINE.render(code=color_code, effect=effect, cached=cached, actual=actual)
+        sender.send_html(message.chat.id, response)
+        
+        warehouse.stock.load(warehouse.backend)
+        warehouse.pages.clear()
+        sender.send_message(message.chat.id, "🔄 Кэш перезагружен из базы")
+        logger.warning(f"⚠️ Кэш расходился с базой: {len(mismatches)} позиций")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в check_cache: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при сверке")
+
+# Команда /import - приход из CSV/XLSX файла
+@handlers.message(commands=['import'])
+def start_import(message):
+    sender.send_message(
+        message.chat.id,
+        "📥 <b>Пришлите CSV или XLSX с приходом</b>\n\n"
+        "Колонки: <code>код; эффект; количество</code>, заголовок можно оставить.\n"
+        "Количество прибавляется к остатку, каждая строка попадает в историю операций.",
+        parse_mode='HTML'
+    )
+    set_state(message.chat.id, {'step': 'waiting_import'})
+
+# Команда /export - выгрузка остатков или журнала операций файлом
+EXPORT_HELP = (
+    "📤 <b>Выгрузка</b>\n\n"
+    "<code>/export paints</code> - текущие остатки\n"
+    "<code>/export transactions 2024-01-01 2024-03-31</code> - операции за период\n\n"
+    "Даты необязательны (ГГГГ-ММ-ДД, включительно), формат - <code>csv</code> (по умолчанию) "
+    "или <code>json</code>. Файл сжат gzip."
+)
+
+@handlers.message(commands=['export'])
+def export_data(message):
+    user_id = message.chat.id
+    try:
+        args = message.text.split()[1:]
+        if not args:
+            sender.send_message(user_id, EXPORT_HELP, parse_mode='HTML')
+            return
+        try:
+            request = ExportRequest.parse(args)
+        except ValueError as e:
+            sender.send_message(user_id, f"❌ {html.escape(str(e))}\n\n{EXPORT_HELP}", parse_mode='HTML')
+            return
+        
+        db = ledger_db(user_id)
+        if db is None:
+            return
+        spool, count = export(db, request)
+        size = spool_size(spool)
+        if size > MAX_DOCUMENT_SIZE:
+            spool.close()
+            sender.send_message(user_id, "❌ Файл больше 50 МБ - выберите период короче")
+            return
+        
+        future = sender.call(user_id, 'send_document', user_id, spool,
+                             visible_file_name=request.filename, caption=f"📤 Строк: {count}")
+        # Файл нужен до конца отправки
+        future.add_done_callback(lambda _: spool.close())
+        logger.info(f"📤 Выгрузка для {user_id}: {request.filename}, {count} строк")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в export_data: {e}")
+        sender.send_message(user_id, "❌ Ошибка при выгрузке")
+
+# Команда /rebuild_stats - сверка агрегатов статистики с журналом и пересчет
+@handlers.message(commands=['rebuild_stats'])
+def rebuild_stats(message):
+    try:
+        db = ledger_db(message.chat.id)
+        if db is None:
+            return
+        mismatches = aggregates.verify(db)
+        aggregates.rebuild(db)
+        if not mismatches:
+            sender.send_message(message.chat.id, "✅ Агрегаты совпадали с журналом, пересчитаны заново")
+            return
+        
+        lines = [f"⚠️ <b>Расхождений: {len(mismatches)}</b>\n"]
+        for table, key, have, want in mismatches[:20]:
+            lines.append(f"• {table} {html.escape(' / '.join(map(str, key)))}: было {have}, стало {want}")
+        lines.append("\n🔄 Агрегаты пересчитаны из журнала")
+        sender.send_html(message.chat.id, '\n'.join(lines))
+        logger.warning(f"⚠️ Агрегаты расходились с журналом: {len(mismatches)}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в rebuild_stats: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при пересчете статистики")
+
+# Команды /subscribe [дней], /unsubscribe, /forecast - оповещения о заканчивающейся краске
+FORECAST_LINE = Template("• {code} ({effect}): {quantity} кг, ~{days:.0f} дн. (расход {rate} кг/день)")
+
+def format_forecast(rows):
+    return [FORECAST_LINE.render(code=color_code, effect=effect, quantity=format_kg(quantity), days=days_left,
+                                 rate=format_kg(round(rate)))
+            for color_code, effect, quantity, rate, days_left in rows]
+
+@handlers.message(commands=['subscribe'])
+def subscribe_alerts(message):
+    user_id = message.chat.id
+    try:
+        args = message.text.split()[1:]
+        try:
+            threshold = float(args[0].replace(',', '.')) if args else forecasting.DEFAULT_THRESHOLD_DAYS
+            if threshold <= 0:
+                raise ValueError
+        except ValueError:
+            sender.send_message(user_id, "❌ Формат: /subscribe [дней], например /subscribe 10")
+            return
+        
+        db = ledger_db(user_id)
+        if db is None:
+            return
+        forecasting.subscribe(db, user_id, threshold)
+        response = (f"🔔 <b>Оповещения включены</b>\n\nНапишу, когда краски останется меньше чем на "
+                    f"<b>{threshold:g} дн.</b> по текущему расходу. Отключить: /unsubscribe")
+        already = [row for row in forecasting.at_risk(db, limit=10) if row[4] <= threshold]
+        if already:
+            response += "\n\n<b>Уже ниже порога:</b>\n" + '\n'.join(format_forecast(already))
+        sender.send_html(user_id, response)
+        logger.info(f"🔔 Подписка на оповещения: {user_id}, порог {threshold} дн.")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в subscribe_alerts: {e}")
+        sender.send_message(user_id, "❌ Ошибка при подписке")
+
+@handlers.message(commands=['unsubscribe'])
+def unsubscribe_alerts(message):
+    try:
+        db = ledger_db(message.chat.id)
+        if db is None:
+            return
+        if forecasting.unsubscribe(db, message.chat.id):
+            sender.send_message(message.chat.id, "🔕 Оповещения отключены")
+        else:
+            sender.send_message(message.chat.id, "Подписки не было. Включить: /subscribe [дней]")
+    except Exception as e:
+        logger.error(f"Ошибка в unsubscribe_alerts: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при отписке")
+
+@handlers.message(commands=['forecast'])
+def show_forecast(message):
+    try:
+        db = ledger_db(message.chat.id)
+        if db is None:
+            return
+        rows = forecasting.at_risk(db, limit=15)
+        if not rows:
+            sender.send_message(message.chat.id, "📈 Прогноза пока нет: нужны списания за последние недели")
+            return
+        sender.send_html(message.chat.id, "📈 <b>Раньше всех закончатся:</b>\n\n" + '\n'.join(format_forecast(rows)))
+    except Exception as e:
+        logger.error(f"Ошибка в show_forecast: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при загрузке прогноза")
+
+# Команда /stock_at ГГГГ-ММ-ДД [код] - остатки на конец дня из журнала
+STOCK_LINE = Template("• {code} ({effect}): {quantity} кг")
+
+@handlers.message(commands=['stock_at'])
+def stock_at(message):
+    user_id = message.chat.id
+    try:
+        args = message.text.split(maxsplit=2)[1:]
+        try:
+            day = datetime.strptime(args[0], '%Y-%m-%d').date()
+        except (IndexError, ValueError):
+            sender.send_message(user_id, "📅 Формат: <code>/stock_at 2024-05-01</code> или "
+                                "<code>/stock_at 2024-05-01 3005</code>", parse_mode='HTML')
+            return
+        color_code = args[1].strip() if len(args) > 1 else None
+        
+        db = ledger_db(user_id)
+        if db is None:
+            return
+        rows = [row for row in ledger.stock_as_of(db, f"{day.isoformat()} 23:59:59", color_code) if row[3]]
+        total = sum(row[3] for row in rows)
+        lines = [f"📅 <b>Остатки на конец {day.isoformat()}</b>"
+                 + (f" по коду <b>{html.escape(color_code)}</b>" if color_code else "") + "\n"]
+        for _, code, effect, quantity in sorted(rows, key=lambda row: (row[1], row[2]))[:30]:
+            lines.append(STOCK_LINE.render(code=code, effect=effect, quantity=format_kg(quantity)))
+        if len(rows) > 30:
+            lines.append(f"… и еще {len(rows) - 30}")
+        if not rows:
+            lines.append("📭 Ничего не было на складе")
+        lines.append(f"\n📦 <b>Итого: {format_kg(total)} кг в {len(rows)} позициях</b>")
+        sender.send_html(user_id, '\n'.join(lines))
+        
+    except Exception as e:
+        logger.error(f"Ошибка в stock_at: {e}")
+        sender.send_message(user_id, "❌ Ошибка при расчете остатков")
+
+# Склады: /warehouses - список и переключение, /warehouse_new, /warehouse_join, /transfer
+def create_warehouses_keyboard(chat_id):
+    active = warehouses.active(chat_id)
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(*[InlineKeyboardButton(f"{'✅ ' if warehouse is active else ''}{warehouse.name}",
+                                        callback_data=f"wh:{warehouse.id}")
+                   for warehouse in warehouses.for_chat(chat_id)])
+    return keyboard
+
+def render_warehouses(chat_id):
+    active = warehouses.active(chat_id)
+    lines = ["🏬 <b>Склады:</b>\n"]
+    for warehouse in warehouses.for_chat(chat_id):
+        positions, quantity = warehouse.stock.totals()
+        marker = "✅" if warehouse is active else "•"
+        lines.append(f"{marker} <b>{html.escape(warehouse.name)}</b>: {positions} поз., "
+                     f"{format_kg(quantity or 0)} кг")
+        # Код приглашения видит владелец; у складов, заведенных до кодов, владельца нет
+        if warehouse.invite and warehouse.owner in (chat_id, None):
+            lines.append(f"   🔑 <code>/warehouse_join {html.escape(warehouse.name)} {html.escape(warehouse.invite)}</code>")
+    lines.append("\nКнопкой ниже - переключить склад.\n"
+                 "<code>/warehouse_new ИМЯ</code> - новый склад, <code>/warehouse_join ИМЯ КОД</code> - подключить "
+                 "существующий по коду приглашения от его владельца, "
+                 "<code>/transfer СКЛАД КОД эффект количество</code> - перевод с активного склада")
+    return '\n'.join(lines)
+
+@handlers.message(commands=['warehouses'])
+def show_warehouses(message):
+    try:
+        sender.send_html(message.chat.id, render_warehouses(message.chat.id),
+                         reply_markup=create_warehouses_keyboard(message.chat.id))
+    except Exception as e:
+        logger.error(f"Ошибка в show_warehouses: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при загрузке складов")
+
+@handlers.message(commands=['warehouse_new', 'warehouse_join'])
+def add_warehouse(message):
+    user_id = message.chat.id
+    try:
+        args = message.text.split()[1:]
+        creating = message.text.startswith('/warehouse_new')
+        if not args or len(args) > (1 if creating else 2):
+            sender.send_message(user_id, "🏬 Формат: <code>/warehouse_new Цех2</code> или "
+                                "<code>/warehouse_join Цех2 КОД</code>", parse_mode='HTML')
+            return
+        try:
+            if creating:
+                warehouse = warehouses.create(args[0], owner=user_id)
+                warehouses.bind(user_id, warehouse)
+            else:
+                warehouse = warehouses.join(user_id, args[0], args[1] if len(args) > 1 else None)
+        except ValueError as e:
+            sender.send_message(user_id, f"❌ {html.escape(str(e))}", parse_mode='HTML')
+            return
+        sender.send_html(user_id, f"✅ Активный склад: <b>{html.escape(warehouse.name)}</b>\n\n"
+                         f"{render_warehouses(user_id)}", reply_markup=create_warehouses_keyboard(user_id))
+        logger.info(f"🏬 Чат {user_id} подключен к складу {warehouse.name}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в add_warehouse: {e}")
+        sender.send_message(user_id, "❌ Ошибка при подключении склада")
+
+@handlers.callback_query(func=lambda call: call.data.startswith('wh:'))
+def handle_warehouse_switch(call):
+    try:
+        chat_id = call.message.chat.id
+        warehouse_id = call.data[len('wh:'):]
+        if not warehouse_id.isdigit() or not warehouses.switch(chat_id, int(warehouse_id)):
+            sender.answer_callback_query(call.id, "Склад недоступен")
+            return
+        sender.answer_callback_query(call.id, f"Склад: {warehouses.active(chat_id).name}")
+        sender.edit_html(
+            render_warehouses(chat_id),
+            chat_id=chat_id,
+            message_id=call.message.message_id,
+            reply_markup=create_warehouses_keyboard(chat_id)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в handle_warehouse_switch: {e}")
+
+TRANSFERRED = Template(
+    "🔁 <b>Переведено {amount} кг</b>\n\n"
+    "🎨 Код: <b>{code}</b>\n"
+    "✨ Эффект: <b>{effect}</b>\n"
+    "📤 {source}: <b>{source_quantity} кг</b>\n"
+    "📥 {target}: <b>{target_quantity} кг</b>"
+)
+
+@handlers.message(commands=['transfer'])
+def transfer_paint(message):
+    user_id = message.chat.id
+    try:
+        words = message.text.split()[1:]
+        target = warehouses.by_name(words[0]) if words else None
+        try:
+            color_code, effect, amount = parse_writeoff_words(words[1:])
+        except ParseError as e:
+            sender.send_message(user_id, f"❌ Неверный формат: {e}\n\n"
+                                "<code>/transfer СКЛАД КОД эффект количество</code>", parse_mode='HTML')
+            return
+        source = warehouses.active(user_id)
+        if target is None or target not in warehouses.for_chat(user_id):
+            sender.send_message(user_id, f"❌ Склад «{html.escape(words[0])}» не подключен, см. /warehouses",
+                                parse_mode='HTML')
+            return
+        if target is source:
+            sender.send_message(user_id, "❌ Этот склад сейчас активный - переключитесь на склад-отправитель")
+            return
+        
+        try:
+            source_quantity, source_txn, target_quantity, target_txn = transfer(
+                source, target, color_code, effect, amount)
+        except PaintNotFound:
+            sender.send_message(user_id, f"❌ Краска не найдена на складе «{html.escape(source.name)}»",
+                                parse_mode='HTML')
+            return
+        except InsufficientStock as e:
+            sender.send_message(user_id, f"❌ Недостаточно краски!\n\nДоступно: <b>{format_kg(e.available)} кг</b>",
+                                parse_mode='HTML')
+            return
+        
+        stock_changed(source, color_code, effect, source_quantity, amount, source_txn)
+        stock_changed(target, color_code, effect, target_quantity, amount, target_txn)
+        sender.send_html(
+            user_id,
+            TRANSFERRED.render(amount=format_kg(amount), code=color_code, effect=effect,
+                               source=source.name, source_quantity=format_kg(source_quantity),
+                               target=target.name, target_quantity=format_kg(target_quantity)),
+            reply_markup=create_main_keyboard()
+        )
+        
+    except Exception as e:
+        logger.error(f"Ошибка в transfer_paint: {e}")
+        sender.send_message(user_id, "❌ Ошибка при переводе", reply_markup=create_main_keyboard())
+
+# Обработка главного меню
+@handlers.message(func=lambda message: True, fallback=True)
+def handle_main_menu(message):
+    user_id = message.chat.id
+    text = message.text
+    
+    if text in MENU_BUTTONS:
+        # Кнопка меню прерывает незаконченный диалог
+        clear_state(user_id)
+    
+    if text == '🎨 Добавить краску':
+        add_paint_step1(message)
+    elif text == '📋 Список красок':
+        list_paints(message)
+    elif text == '📤 Списать краску':
+        use_paint(message)
+    elif text == '🔍 Поиск по коду':
+        search_paint(message)
+    elif text == '📊 Статистика':
+        show_stats(message)
+    elif text == 'ℹ️ Помощь':
+        show_help(message)
+    else:
+        state = get_state(user_id)
+        if state and state['step'] in STEP_HANDLERS:
+            # Следующий шаг диалога (состояние хранится в states)
+            STEP_HANDLERS[state['step']](message)
+            return
+        sender.send_message(user_id, "Используйте кнопки меню для навигации 📱", 
+                        reply_markup=create_main_keyboard())
+
+# Добавление краски - Шаг 1
+@metrics.action('add')
+def add_paint_step1(message):
+    user_id = message.chat.id
+    set_state(user_id, {'step': 'waiting_code'})
+    
+    sender.send_message(
+        user_id, 
+        "🎨 <b>Введите код или название краски:</b>\n\nПримеры:\n• 3005\n• прозрачный\n• черный матовый",
+        parse_mode='HTML'
+    )
+
+# Шаг 2: Получение кода
+CHOOSE_EFFECT = Template("🎨 Код: <b>{code}</b>\n\nВыберите эффект:")
+
+@metrics.action('add')
+def add_paint_step2(message):
+    try:
+        user_id = message.chat.id
+        color_code = message.text.strip()
+        
+        if not color_code:
+            sender.send_message(user_id, "❌ Код не может быть пустым!", reply_markup=create_main_keyboard())
+            clear_state(user_id)
+            return
+        
+        set_state(user_id, {
+            'step': 'waiting_effect',
+            'color_code': color_code
+        })
+        
+        keyboard = create_effect_keyboard()
+        sender.send_html(user_id, CHOOSE_EFFECT.render(code=color_code), reply_markup=keyboard)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в add_paint_step2: {e}")
+        sender.send_message(user_id, "❌ Произошла ошибка", reply_markup=create_main_keyboard())
+        clear_state(user_id)
+
+# Обработчик выбора эффекта
+EFFECT_CHOSEN = Template("🎨 Код: <b>{code}</b>\n✅ Эффект: {effect}")
+
+@handlers.callback_query(func=lambda call: call.data.startswith('effect_'))
+def handle_effect_selection(call):
+    try:
+        user_id = call.message.chat.id
+        
+        state = get_state(user_id)
+        if not state or state['step'] != 'waiting_effect':
+            sender.answer_callback_query(call.id, "❌ Сессия устарела")
+            return
+        
+        effect_key = call.data.replace('effect_', '')
+        effect_name = EFFECTS.get(effect_key)
+        
+        if not effect_name:
+            sender.answer_callback_query(call.id, "❌ Неверный эффект")
+            return
+        
+        set_state(user_id, {
+            'step': 'waiting_weight',
+            'color_code': state['color_code'],
+            'effect': effect_name.replace('🟢 ', '').replace('🔵 ', '').replace('🟣 ', '').replace('🟠 ', '').replace('⚪ ', '')
+        })
+        
+        # Ответ на нажатие уходит параллельно с правкой и подсказкой
+        sender.answer_callback_query(call.id, f"Выбран: {effect_name}")
+        
+        sender.edit_html(
+            EFFECT_CHOSEN.render(code=state['color_code'], effect=effect_name),
+            chat_id=user_id,
+            message_id=call.message.message_id
+        )
+        
+        sender.send_message(user_id, "⚖️ <b>Введите вес в кг:</b>\n\nПример: 5, 10.5, 2,75", 
+                            parse_mode='HTML')
+        
+    except Exception as e:
+        logger.error(f"Ошибка в handle_effect_selection: {e}")
+        sender.answer_callback_query(call.id, "❌ Ошибка")
+
+# Шаг 3: Получение веса
+PAINT_ADDED = Template(
+    "✅ Краска <b>{action}!</b>\n\n"
+    "{warehouse}"
+    "🎨 Код: <b>{code}</b>\n"
+    "✨ Эффект: <b>{effect}</b>\n"
+    "📦 Вес: <b>{weight} кг</b>\n"
+    "📊 Теперь: <b>{quantity} кг</b>"
+)
+
+@metrics.action('add')
+def add_paint_step3(message):
+    user_id = message.chat.id
+    try:
+        state = get_state(user_id)
+        if not state or state['step'] != 'waiting_weight':
+            sender.send_message(user_id, "❌ Сессия устарела", reply_markup=create_main_keyboard())
+            return
+        
+        weight = to_grams(message.text)
+        color_code = state['color_code']
+        effect = state['effect']
+        
+        if weight <= 0:
+            sender.send_message(user_id, "❌ Вес должен быть положительным!", reply_markup=create_main_keyboard())
+            return
+        
+        warehouse = warehouses.active(user_id)
+        new_quantity, txn_id, is_new = warehouse.backend.add(color_code, effect, weight)
+        action_text = "добавлена" if is_new else "обновлена"
+        
+        stock_changed(warehouse, color_code, effect, new_quantity, weight, txn_id)
+        
+        sender.send_html(
+            user_id,
+            PAINT_ADDED.render(action=action_text, warehouse=warehouse_line(user_id, warehouse), code=color_code,
+                               effect=effect, weight=format_kg(weight), quantity=format_kg(new_quantity)),
+            reply_markup=create_main_keyboard()
+        )
+        
+        logger.info(f"➕ Добавлена краска: {color_code} ({effect}) - {format_kg(weight)}кг")
+        
+    except ValueError:
+        sender.send_message(user_id, "❌ Неверный формат веса!", reply_markup=create_main_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка в add_paint_step3: {e}")
+        sender.send_message(user_id, "❌ Ошибка при сохранении", reply_markup=create_main_keyboard())
+    finally:
+        clear_state(user_id)
+
+# Список всех красок
+@metrics.action('list')
+def list_paints(message):
+    try:
+        page = warehouses.active(message.chat.id).pages.get()
+        
+        if not page:
+            sender.send_message(message.chat.id, "📭 <b>Склад пуст</b>\n\nДобавьте первую краску!",
+                           parse_mode='HTML', reply_markup=create_main_keyboard())
+            return
+        
+        sender.send_html(message.chat.id, page.text, reply_markup=page.keyboard or create_main_keyboard())
+        
+    except Exception as e:
+        logger.error(f"Ошибка в list_paints: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при загрузке списка", reply_markup=create_main_keyboard())
+
+# Листание списка кнопками ◀️ / ▶️
+@handlers.callback_query(func=lambda call: call.data.startswith('list:'))
+def handle_list_page(call):
+    try:
+        # list:<склад>:<курсор>; кнопки до появления складов - list:<курсор>
+        warehouse_id, _, cursor = call.data[len('list:'):].partition(':')
+        if warehouse_id.isdigit():
+            warehouse = warehouses.get(int(warehouse_id))
+        else:
+            warehouse, cursor = warehouses.default, call.data[len('list:'):]
+        # id склада пришел из callback_data - листать можно только склады своего чата
+        if warehouse is not None and not warehouses.member(call.message.chat.id, warehouse.id):
+            warehouse = None
+        page = warehouse.pages.get(cursor) if warehouse else None
+        sender.answer_callback_query(call.id)
+        if not page:
+            return
+        sender.edit_html(
+            page.text,
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=page.keyboard
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в handle_list_page: {e}")
+        sender.answer_callback_query(call.id, "❌ Ошибка")
+
+# Поиск краски
+@metrics.action('search')
+def search_paint(message):
+    sender.send_message(message.chat.id, "🔍 <b>Введите код для поиска:</b>", parse_mode='HTML')
+    set_state(message.chat.id, {'step': 'waiting_search'})
+
+@metrics.action('search')
+def process_search(message):
+    clear_state(message.chat.id)
+    try:
+        query = message.text.strip()
+        candidates = index.search(query, limit=8)
+        exact = [code for code, score in candidates if score == EXACT_SCORE]
+        
+        if len(exact) == 1:
+            send_code_stock(message.chat.id, exact[0])
+            return
+        
+        if not candidates:
+            sender.send_message(message.chat.id, f"❌ Код '<b>{html.escape(query)}</b>' не найден", 
+                           parse_mode='HTML', reply_markup=create_main_keyboard())
+            return
+        
+        # Несколько похожих кодов - предлагаем выбрать кнопкой
+        keyboard = InlineKeyboardMarkup(row_width=2)
+        keyboard.add(*[InlineKeyboardButton(code, callback_data=find_button_data(code))
+                       for code, _ in candidates])
+        sender.send_message(message.chat.id, f"🔍 <b>Похожие коды по запросу '{html.escape(query)}':</b>",
+                            parse_mode='HTML', reply_markup=keyboard)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в process_search: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при поиске", reply_markup=create_main_keyboard())
+
+# Выбор кода из найденных кандидатов. В кнопке сам код (find:=<код>), а
+# если он не помещается в 64 байта callback_data - его хэш (find:#<хэш>):
+# кнопка значит одно и то же после перезапуска и на любой реплике
+MAX_CALLBACK_DATA = 64
+
+def find_button_data(color_code):
+    data = f"find:={color_code}"
+    if len(data.encode('utf-8')) <= MAX_CALLBACK_DATA:
+        return data
+    return f"find:#{code_digest(color_code)}"
+
+def resolve_find_button(data):
+    """Код из callback_data кнопки или None, если кнопка устарела"""
+    kind, value = data[len('find:'):len('find:') + 1], data[len('find:') + 1:]
+    if kind == '=':
+        return value
+    if kind == '#':
+        return index.by_digest(value)
+    # find:<номер> - кнопки старого формата, номер в другом процессе значил другой код
+    return None
+
+@handlers.callback_query(func=lambda call: call.data.startswith('find:'))
+def handle_search_choice(call):
+    try:
+        color_code = resolve_find_button(call.data)
+        if color_code is None:
+            sender.answer_callback_query(call.id, "❌ Код устарел")
+            return
+        sender.answer_callback_query(call.id)
+        send_code_stock(call.message.chat.id, color_code)
+    except Exception as e:
+        logger.error(f"Ошибка в handle_search_choice: {e}")
+        sender.answer_callback_query(call.id, "❌ Ошибка")
+
+def send_code_stock(chat_id, color_code):
+    warehouse = warehouses.active(chat_id)
+    paints = warehouse.stock.by_code(color_code)
+    # Остальные склады чата - из их кэшей в памяти, без запросов в базу
+    others = [(other, sum(quantity for _, quantity in other.stock.by_code(color_code)))
+              for other in warehouses.for_chat(chat_id) if other is not warehouse]
+    others = [(other, total) for other, total in others if total]
+    if not paints and not others:
+        sender.send_message(chat_id, f"❌ Код '<b>{html.escape(color_code)}</b>' не найден", 
+                            parse_mode='HTML', reply_markup=create_main_keyboard())
+        return
+    
+    lines = [f"🔍 <b>Найдено по коду '{html.escape(color_code)}':</b>\n"]
+    total = 0
+    for effect, quantity in paints:
+        lines.append(f"• {html.escape(effect)}: {format_kg(quantity)} кг")
+        total += quantity
+    
+    if paints:
+        lines.append(f"\n📦 <b>Итого: {format_kg(total)} кг</b>")
+    else:
+        lines.append(f"📭 На складе «{html.escape(warehouse.name)}» нет")
+    if others:
+        lines.append("\n🏬 <b>На других складах:</b>")
+        lines += [f"• {html.escape(other.name)}: {format_kg(quantity)} кг" for other, quantity in others]
+    sender.send_html(chat_id, '\n'.join(lines), reply_markup=create_main_keyboard())
+
+# Списание краски
+@metrics.action('use')
+def use_paint(message):
+    sender.send_message(
+        message.chat.id, 
+        "📤 <b>Введите данные для списания:</b>\n\nФормат: <code>КОД эффект количество</code>\n\nПример:\n<code>3005 глянец 1.5</code>\n<code>прозрачный лак 2.0</code>\n\n"
+        "Можно несколько строк в одном сообщении или CSV-файл (код; эффект; количество)",
+        parse_mode='HTML'
+    )
+    set_state(message.chat.id, {'step': 'waiting_use'})
+
+WRITTEN_OFF = Template(
+    "✅ <b>Списано {amount} кг</b>\n\n"
+    "{warehouse}"
+    "🎨 Код: <b>{code}</b>\n"
+    "✨ Эффект: <b>{effect}</b>\n"
+    "📊 Остаток: <b>{quantity} кг</b>"
+)
+
+@metrics.action('use')
+def process_use_paint(message):
+    clear_state(message.chat.id)
+    try:
+        if len(message.text.strip().splitlines()) > 1:
+            # Несколько строк - пакетное списание одной транзакцией
+            apply_write_off_batch(message.chat.id, iter_text_lines(message.text))
+            return
+        
+        try:
+            color_code, effect, amount = parse_writeoff_words(message.text.split())
+        except ParseError as e:
+            sender.send_message(message.chat.id, f"❌ Неверный формат: {e}", reply_markup=create_main_keyboard())
+            return
+        
+        try:
+            warehouse = warehouses.active(message.chat.id)
+            new_quantity, txn_id = warehouse.backend.write_off(color_code, effect, amount)
+        except PaintNotFound:
+            sender.send_message(message.chat.id, "❌ Краска не найдена", reply_markup=create_main_keyboard())
+            return
+        except InsufficientStock as e:
+            sender.send_message(message.chat.id, 
+                           f"❌ Недостаточно краски!\n\nДоступно: <b>{format_kg(e.available)} кг</b>",
+                           parse_mode='HTML', reply_markup=create_main_keyboard())
+            return
+        
+        stock_changed(warehouse, color_code, effect, new_quantity, amount, txn_id)
+        
+        sender.send_html(
+            message.chat.id,
+            WRITTEN_OFF.render(amount=format_kg(amount), warehouse=warehouse_line(message.chat.id, warehouse),
+                               code=color_code, effect=effect, quantity=format_kg(new_quantity)),
+            reply_markup=create_main_keyboard()
+        )
+        
+        logger.info(f"➖ Списана краска: {color_code} ({effect}) - {format_kg(amount)}кг")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в process_use_paint: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при списании", reply_markup=create_main_keyboard())
+
+BATCH_LINE = Template("• {code} ({effect}): -{amount} кг, остаток {quantity} кг")
+
+def apply_write_off_batch(chat_id, items):
+    """Списывает разобранные строки одной транзакцией и отвечает одной сводкой"""
+    warehouse = warehouses.active(chat_id)
+    try:
+        results = warehouse.backend.write_off_batch(items)
+    except (ParseError, WriteOffError) as e:
+        problems = e.problems if isinstance(e, WriteOffError) else [str(e)]
+        lines = ["❌ <b>Ничего не списано</b>\n"]
+        lines += [f"• {html.escape(problem)}" for problem in problems[:20]]
+        if len(problems) > 20:
+            lines.append(f"… и еще {len(problems) - 20}")
+        sender.send_html(chat_id, '\n'.join(lines), reply_markup=create_main_keyboard())
+        return
+    
+    total = 0
+    lines = []
+    for color_code, effect, amount, new_quantity, txn_id in results:
+        stock_changed(warehouse, color_code, effect, new_quantity, amount, txn_id)
+        total += amount
+        if len(lines) < 30:
+            lines.append(BATCH_LINE.render(code=color_code, effect=effect, amount=format_kg(amount),
+                                           quantity=format_kg(new_quantity)))
+    if len(results) > 30:
+        lines.append(f"… и еще {len(results) - 30}")
+    sender.send_html(
+        chat_id,
+        f"✅ <b>Списано позиций: {len(results)}, всего {format_kg(total)} кг</b>\n\n" + '\n'.join(lines),
+        reply_markup=create_main_keyboard()
+    )
+
+# CSV-файл для списания (после кнопки «Списать» или с подписью /writeoff)
+MAX_WRITEOFF_FILE_SIZE = 1024 * 1024
+# Файл прихода (после /import или с подписью /import); 20 МБ - предел getFile Bot API
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
+def import_document(message):
+    """Потоковый импорт файла: пачки в отдельных транзакциях, прогресс в одном сообщении"""
+    user_id = message.chat.id
+    document = message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        sender.send_message(user_id, "❌ Файл слишком большой (до 20 МБ)", reply_markup=create_main_keyboard())
+        return
+    
+    warehouse = warehouses.active(user_id)
+    status = sender.send_message(user_id, "📥 Загружаю файл...").result(timeout=60)
+    progress = Progress(sender, user_id, status.message_id)
+    errors = ImportErrors()
+    new_codes = 0
+    
+    def on_chunk(done, changed, version):
+        nonlocal new_codes
+        for color_code, effect, quantity in changed:
+            warehouse.stock.update(color_code, effect, quantity, version)
+            if warehouse.forecaster:
+                warehouse.forecaster.touch(color_code, effect)
+            if index.code_id(color_code) is None:
+                index.add(color_code)
+                new_codes += 1
+        progress.update(f"📥 Загружено строк: <b>{done}</b>...")
+    
+    try:
+        with download_file(bot, document.file_id, MAX_IMPORT_FILE_SIZE) as spool:
+            done = import_stock(warehouse.backend, iter_file_rows(spool, document.file_name, errors), on_chunk=on_chunk)
+    except ImportError:
+        progress.update("❌ XLSX не поддерживается на этом сервере (нет openpyxl), пришлите CSV", force=True)
+        return
+    finally:
+        # Даже если файл оборвался посередине, загруженные пачки уже в базе
+        warehouse.pages.clear()
+        for other in warehouses.all():
+            if other is warehouse or new_codes:
+                other.inline.invalidate(None, new_code=True)
+    
+    lines = [f"✅ <b>Импорт завершен</b>\n\nЗагружено строк: <b>{done}</b>, новых кодов: <b>{new_codes}</b>"]
+    if errors:
+        lines.append(f"\n⚠️ Пропущено строк с ошибками: <b>{len(errors)}</b>")
+        lines += [f"• {html.escape(str(error))}" for error in errors.items]
+        if len(errors) > len(errors.items):
+            lines.append(f"… и еще {len(errors) - len(errors.items)}")
+    progress.update('\n'.join(lines), force=True)
+    logger.info(f"📥 Импорт от {user_id}: {done} строк, ошибок {len(errors)}")
+
+@handlers.message(content_types=['document'])
+def handle_document(message):
+    user_id = message.chat.id
+    state = get_state(user_id)
+    caption = (message.caption or '').strip()
+    try:
+        if caption.startswith('/import') or (state and state['step'] == 'waiting_import'):
+            clear_state(user_id)
+            import_document(message)
+            return
+        if caption.startswith('/writeoff') or (state and state['step'] == 'waiting_use'):
+            clear_state(user_id)
+            if message.document.file_size and message.document.file_size > MAX_WRITEOFF_FILE_SIZE:
+                sender.send_message(user_id, "❌ Файл слишком большой", reply_markup=create_main_keyboard())
+                return
+            data = bot.download_file(bot.get_file(message.document.file_id).file_path)
+            apply_write_off_batch(user_id, iter_csv_rows(io.BytesIO(data)))
+            return
+        sender.send_message(user_id, "📎 Чтобы списать по файлу, нажмите «📤 Списать краску» "
+                            "и пришлите CSV или добавьте подпись /writeoff.\n"
+                            "Приход из CSV/XLSX - команда /import или подпись /import",
+                            reply_markup=create_main_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка в handle_document: {e}")
+        sender.send_message(user_id, "❌ Ошибка при обработке файла", reply_markup=create_main_keyboard())
+
+# Статистика: все экраны читают только агрегаты и кэш остатков
+STATS_VIEWS = {
+    'summary': '📊 Сводка',
+    'days': '📅 По дням',
+    'weeks': '🗓 По неделям',
+    'top': '🏆 Топ расхода',
+    'all': '🏬 Все склады',
+}
+
+def build_stats_keyboard(current, several):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(*[InlineKeyboardButton(title, callback_data=f"stats:{view}")
+                   for view, title in STATS_VIEWS.items()
+                   if view != current and (view != 'all' or several)])
+    return keyboard
+
+# Все варианты клавиатуры статистики: (текущий экран, складов несколько)
+STATS_KEYBOARDS = {(view, several): freeze(build_stats_keyboard(view, several))
+                   for view in STATS_VIEWS for several in (False, True)}
+
+def create_stats_keyboard(chat_id, current):
+    # Сводка по всем складам - только для чатов, у которых складов несколько
+    return STATS_KEYBOARDS[current, len(warehouses.for_chat(chat_id)) > 1]
+
+def render_all_warehouses(chat_id):
+    """Сводка по складам чата: кэши остатков и небольшие таблицы агрегатов каждого склада"""
+    today = aggregates.since(1)
+    lines = ["🏬 <b>Все склады:</b>\n"]
+    effects = {}
+    total_positions = total_quantity = total_week = 0
+    for warehouse in warehouses.for_chat(chat_id):
+        positions, quantity = warehouse.stock.totals()
+        week = warehouse.backend.daily(7)
+        used_week = sum(row[2] for row in week)
+        used_today = sum(used for day, _, used, _ in week if day == today)
+        lines.append(f"• <b>{html.escape(warehouse.name)}</b>: {positions} поз., {format_kg(quantity or 0)} кг, "
+                     f"расход сегодня {format_kg(used_today)} кг, за 7 дней {format_kg(used_week)} кг")
+        total_positions += positions
+        total_quantity += quantity or 0
+        total_week += used_week
+        for effect, count, amount in warehouse.backend.effect_breakdown():
+            count_sum, amount_sum = effects.get(effect, (0, 0))
+            effects[effect] = (count_sum + count, amount_sum + amount)
+    
+    lines.append(f"\n📦 <b>Итого: {total_positions} поз., {format_kg(total_quantity)} кг</b>, "
+                 f"расход за 7 дней: <b>{format_kg(total_week)} кг</b>")
+    if effects:
+        lines.append("\n<b>По эффектам:</b>")
+        lines += [f"• {html.escape(effect)}: {count} поз., {format_kg(amount)} кг"
+                  for effect, (count, amount) in sorted(effects.items(), key=lambda item: -item[1][1])]
+    return '\n'.join(lines)
+
+def render_stats(chat_id, view):
+    if view == 'all':
+        return render_all_warehouses(chat_id)
+    
+    warehouse = warehouses.active(chat_id)
+    if view == 'days':
+        rows = warehouse.backend.daily(14)
+        lines = ["📅 <b>Движение за 14 дней:</b>\n"]
+        lines += [f"• {day}: +{format_kg(added)} / -{format_kg(used)} кг ({operations} оп.)"
+                  for day, added, used, operations in rows]
+        return '\n'.join(lines if rows else lines + ["📝 Операций не было"])
+    
+    if view == 'weeks':
+        rows = warehouse.backend.weekly(8)
+        lines = ["🗓 <b>Движение по неделям:</b>\n"]
+        lines += [f"• с {first_day}: +{format_kg(added)} / -{format_kg(used)} кг ({operations} оп.)"
+                  for _, first_day, added, used, operations in rows]
+        return '\n'.join(lines if rows else lines + ["📝 Операций не было"])
+    
+    if view == 'top':
+        rows = warehouse.backend.top_consumers(30, 10)
+        lines = ["🏆 <b>Наибольший расход за 30 дней:</b>\n"]
+        lines += [f"{place}. {html.escape(color_code)}: {format_kg(used)} кг"
+                  for place, (color_code, used) in enumerate(rows, start=1)]
+        return '\n'.join(lines if rows else lines + ["📝 Списаний не было"])
+    
+    total_paints, total_quantity = warehouse.stock.totals()
+    week = warehouse.backend.daily(7)
+    today = aggregates.since(1)
+    used_today = sum(used for day, _, used, _ in week if day == today)
+    
+    response = "📊 <b>Статистика склада:</b>\n\n"
+    response += warehouse_line(chat_id, warehouse)
+    response += f"• 🎨 Всего позиций: <b>{total_paints}</b>\n"
+    response += f"• ⚖️ Общий вес: <b>{format_kg(total_quantity or 0)} кг</b>\n"
+    response += f"• 📤 Расход сегодня: <b>{format_kg(used_today)} кг</b>, "
+    response += f"за 7 дней: <b>{format_kg(sum(row[2] for row in week))} кг</b>\n\n"
+    
+    effects = warehouse.backend.effect_breakdown()
+    if effects:
+        response += "<b>По эффектам:</b>\n"
+        for effect, positions, quantity in effects:
+            response += f"• {html.escape(effect)}: {positions} поз., {format_kg(quantity)} кг\n"
+        response += "\n"
+    
+    recent_transactions = warehouse.stock.recent()
+    if recent_transactions:
+        response += "<b>Последние операции:</b>\n"
+        for color_code, effect, amount, date in recent_transactions:
+            response += STOCK_LINE.render(code=color_code, effect=effect, quantity=format_kg(amount)) + "\n"
+    else:
+        response += "📝 Операций пока нет"
+    return response
+
+@metrics.action('stats')
+def show_stats(message):
+    try:
+        sender.send_html(message.chat.id, render_stats(message.chat.id, 'summary'),
+                         reply_markup=create_stats_keyboard(message.chat.id, 'summary'))
+        
+    except Exception as e:
+        logger.error(f"Ошибка в show_stats: {e}")
+        sender.send_message(message.chat.id, "❌ Ошибка при загрузке статистики", reply_markup=create_main_keyboard())
+
+# Переключение экранов статистики
+@handlers.callback_query(func=lambda call: call.data.startswith('stats:'))
+def handle_stats_view(call):
+    try:
+        view = call.data[len('stats:'):]
+        sender.answer_callback_query(call.id)
+        if view not in STATS_VIEWS:
+            return
+        sender.edit_html(
+            render_stats(call.message.chat.id, view),
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=create_stats_keyboard(call.message.chat.id, view)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в handle_stats_view: {e}")
+        sender.answer_callback_query(call.id, "❌ Ошибка")
+
+# Inline-режим: остатки по коду прямо из строки ввода любого чата
+@handlers.inline(func=lambda query: True)
+def handle_inline_query(query):
+    try:
+        # cache_time - сколько секунд Telegram может отдавать этот ответ сам;
+        # ответ зависит от активного склада пользователя, поэтому кэш личный
+        sender.call(None, 'answer_inline_query', query.id, warehouses.active(query.from_user.id).inline.results(query.query),
+                    cache_time=INLINE_CACHE_TIME, is_personal=True)
+    except Exception as e:
+        logger.error(f"Ошибка в handle_inline_query: {e}")
+
+# Помощь
+HELP_TEXT = """
+🎨 <b>PaintStock Bot - помощь</b>
+
+<b>Возможности:</b>
+• Учет краски по любым кодам
+• 5 видов эффектов
+• Учет веса в кг
+• Поиск и статистика
+
+<b>Доступные эффекты:</b>
+• 🟢 Матовый
+• 🔵 Глянец  
+• 🟣 Муар
+• 🟠 Шагрень
+• ⚪ Лак
+
+<b>Использование:</b>
+1. 🎨 Добавить краску - ввести код, выбрать эффект, ввести вес
+2. 📋 Список - посмотреть весь склад
+3. 📤 Списать - указать код, эффект и количество
+4. 🔍 Поиск - найти краску по коду
+5. 📊 Статистика - общая информация
+6. /import - приход из CSV/XLSX файла (код; эффект; количество)
+7. /export - выгрузка остатков и журнала операций
+8. /forecast - прогноз, /subscribe [дней] - оповещения о заканчивающейся краске
+9. /stock_at ГГГГ-ММ-ДД [код] - остатки на прошедшую дату
+10. /warehouses - склады, /transfer СКЛАД КОД эффект количество - перевод между складами
+
+<b>Примеры кодов:</b>
+• 3005 (RAL)
+• прозрачный
+• черный матовый
+• металлик серебро
+""".strip()
+
+@metrics.action('help')
+def show_help(message):
+    sender.send_message(message.chat.id, HELP_TEXT, parse_mode='HTML', reply_markup=create_main_keyboard())
+
+# Шаги диалогов: состояние -> обработчик следующего сообщения
+STEP_HANDLERS = {
+    'waiting_code': add_paint_step2,
+    'waiting_weight': add_paint_step3,
+    'waiting_search': process_search,
+    'waiting_use': process_use_paint,
+}
+
+# Запуск бота
+def start_polling():
+    while True:
+        try:
+            bot.polling(none_stop=True, interval=1, timeout=30)
+        except Exception as e:
+            logger.error(f"❌ Ошибка polling: {e}")
+            logger.info("🔄 Перезапуск через 15 секунд...")
+            time.sleep(15)
+
+def serve_metrics():
+    return 200, metrics.CONTENT_TYPE, metrics.render().encode('utf-8')
+
+def run(server=None):
+    """Прогрев и запуск бота; server - уже отвечающий на health check BotServer"""
+    if server is None:
+        server = BotServer()
+        server.start_in_thread()
+    init_db()
+    install_handlers(bot, load_handlers(HANDLER_MODULES))
+    configure_transport(pool_size=int(os.environ.get('SEND_WORKERS', 8)) + 2)
+    # Обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+    dispatcher = UpdateDispatcher(
+        bot,
+        workers=int(os.environ.get('WORKERS', 8)),
+        max_pending=int(os.environ.get('MAX_PENDING_UPDATES', 1000)),
+        max_per_chat=int(os.environ.get('MAX_CHAT_QUEUE', 20)),
+    ).install()
+    if metrics.ENABLED:
+        metrics.gauge('paintstock_update_queue_depth', 'Обновления в очереди диспетчера',
+                      lambda: dispatcher.executor.pending)
+        metrics.gauge('paintstock_send_queue_depth', 'Запросы в очереди отправки',
+                      lambda: sender.executor.pending)
+        metrics.gauge('paintstock_conversation_states', 'Незаконченные диалоги (состояния пользователей)',
+                      lambda: len(states))
+        metrics.gauge('paintstock_stock_positions', 'Позиции в кэше остатков всех складов',
+                      lambda: sum(warehouse.stock.totals()[0] for warehouse in warehouses.all()))
+        server.route('/metrics', serve_metrics)
+    if os.environ.get('BOT_MODE', '').lower() == 'replicas':
+        run_replicas(server, dispatcher)
+        return
+    warehouses.start()
+    logger.info("✅ Бот запущен и готов к работе!")
+    
+    # BOT_MODE=webhook - обновления приходят на тот же порт, что и health check
+    run_bot(bot, health_text="🎨 Paint Stock Bot is running!", polling=start_polling, server=server)
+
+def sync_replica():
+    """Склады, привязки и остатки, измененные другими репликами"""
+    for warehouse in warehouses.refresh():
+        for color_code, _, _ in warehouse.stock.items():
+            index.add(color_code)
+    warehouses.sync(stock_synced)
+
+def lead_replica(leading):
+    """Прогноз расхода и снимки остатков идут только у лидера - оповещения не дублируются"""
+    if leading:
+        warehouses.start()
+    else:
+        warehouses.stop()
+
+def run_replicas(server, dispatcher):
+    """BOT_MODE=replicas: несколько процессов на одной базе, обновления забирает лидер (см. replicas)"""
+    if isinstance(states, MemoryStateStore):
+        logger.warning("⚠️ STATE_STORE=memory: диалог прервется, если чат переедет на другую реплику")
+    replica = replicas.Replica(
+        bot, db,
+        url=os.environ.get('REPLICA_URL') or f'http://127.0.0.1:{server.port}',
+        secret=os.environ.get('REPLICA_SECRET') or replicas.default_secret(TOKEN),
+        id=os.environ.get('REPLICA_ID') or None,
+        lease_ttl=float(os.environ.get('REPLICA_LEASE_TTL', 15)),
+        heartbeat=float(os.environ.get('REPLICA_HEARTBEAT', 1)),
+        poll_timeout=int(os.environ.get('REPLICA_POLL_TIMEOUT', 5)),
+        on_leader=lead_replica,
+        sync=sync_replica,
+        offer=dispatcher.offer,
+    )
+    server.route_post(replicas.FORWARD_PATH, replica.handle_forwarded)
+    if metrics.ENABLED:
+        metrics.gauge('paintstock_replica_leader', 'Эта реплика - лидер (забирает обновления)',
+                      lambda: int(replica.leading))
+    server.attach(bot, health_text="🎨 Paint Stock Bot is running!")
+    logger.info("✅ Бот запущен и готов к работе!")
+
+    def drain(timeout):
+        deadline = time.monotonic() + timeout
+        return (dispatcher.executor.wait_idle(timeout)
+                and sender.executor.wait_idle(max(0.0, deadline - time.monotonic())))
+
+    replicas.run_until_signal(replica, drain, timeout=float(os.environ.get('REPLICA_DRAIN_TIMEOUT', 30)))
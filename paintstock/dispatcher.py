@@ -0,0 +1,170 @@
+import threading
+import logging
+from collections import deque
+from queue import Queue
+
+import telebot
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedExecutor:
+    """Пул потоков, в котором задачи с одинаковым ключом выполняются по порядку.
+
+    Задачи разных ключей выполняются параллельно. Общее число ожидающих
+    задач ограничено max_pending: submit блокируется, пока очередь не
+    освободится (обратное давление на источник). Очередь одного ключа
+    ограничена max_per_key - лишние задачи отбрасываются.
+    """
+
+    def __init__(self, workers=4, max_pending=1000, max_per_key=50, name='worker'):
+        self.workers = workers
+        self.max_per_key = max_per_key
+        self.name = name
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queues = {}      # ключ -> deque задач
+        self._ready = Queue()  # ключи, готовые к выполнению
+        self._threads = []
+        self._pending = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return self
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"🧵 Запущено потоков {self.name}: {self.workers}")
+        return self
+
+    def stop(self, timeout=None):
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    @property
+    def pending(self):
+        """Сколько задач ждет выполнения"""
+        return self._pending
+
+    def wait_idle(self, timeout=None):
+        """Ждет, пока не будут выполнены все поставленные задачи"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def reserve(self, count):
+        """Занимает count мест в очереди без ожидания: все или ничего.
+
+        Занятые места расходуются submit(..., reserved=True)
+        """
+        taken = 0
+        while taken < count and self._slots.acquire(blocking=False):
+            taken += 1
+        if taken == count:
+            return True
+        for _ in range(taken):
+            self._slots.release()
+        return False
+
+    def submit(self, key, func, *args, timeout=None, reserved=False, **kwargs):
+        """Ставит задачу в очередь ключа. False - задача отброшена"""
+        if key is None:
+            key = object()  # без ключа - без упорядочивания
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None and len(queue) >= self.max_per_key:
+                logger.warning(f"⚠️ Очередь {key} переполнена, задача отброшена")
+                if reserved:
+                    self._slots.release()
+                return False
+        if not reserved and not self._slots.acquire(timeout=timeout):
+            logger.warning(f"⚠️ Очередь {self.name} заполнена, задача отброшена")
+            return False
+        with self._lock:
+            self._pending += 1
+            queue = self._queues.get(key)
+            if queue is None:
+                # Ключ свободен - ставим его в очередь на выполнение
+                self._queues[key] = deque([(func, args, kwargs)])
+                self._ready.put(key)
+            else:
+                queue.append((func, args, kwargs))
+        return True
+
+    def _run(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                func, args, kwargs = self._queues[key].popleft()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"❌ Ошибка в задаче {self.name}: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if self._queues[key]:
+                        # Одна задача за подход: остальные ключи не голодают
+                        self._ready.put(key)
+                    else:
+                        del self._queues[key]
+                    if not self._pending:
+                        self._idle.notify_all()
+                self._slots.release()
+
+
+def update_chat_id(update):
+    """chat_id, к которому относится обновление (None - порядок не важен)"""
+    message = (update.message or update.edited_message
+               or update.channel_post or update.edited_channel_post)
+    if message is not None:
+        return message.chat.id
+    if update.callback_query is not None:
+        call = update.callback_query
+        return call.message.chat.id if call.message else call.from_user.id
+    for query in (update.inline_query, update.chosen_inline_result,
+                  update.shipping_query, update.pre_checkout_query):
+        if query is not None:
+            return query.from_user.id
+    return None
+
+
+class UpdateDispatcher:
+    """Раздает обновления Telegram по пулу потоков с порядком внутри чата"""
+
+    def __init__(self, bot, workers=4, max_pending=1000, max_per_chat=50):
+        self.bot = bot
+        self.executor = KeyedExecutor(workers, max_pending, max_per_chat, name='updates')
+
+    def install(self):
+        """Перехватывает process_new_updates бота (polling и webhook)"""
+        # Обработчики выполняются прямо в потоках диспетчера
+        self.bot.threaded = False
+        self.bot.process_new_updates = self.process_new_updates
+        self.executor.start()
+        return self
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Смещение getUpdates двигаем сразу, не дожидаясь обработки
+            if update.update_id > self.bot.last_update_id:
+                self.bot.last_update_id = update.update_id
+            self.executor.submit(update_chat_id(update), self._handle, update)
+
+    def offer(self, updates):
+        """Ставит пачку в очередь без ожидания. False - места нет, ничего не поставлено"""
+        if not self.executor.reserve(len(updates)):
+            return False
+        for update in updates:
+            self.executor.submit(update_chat_id(update), self._handle, update, reserved=True)
+        return True
+
+    def _handle(self, update):
+        telebot.TeleBot.process_new_updates(self.bot, [update])
@@ -0,0 +1,159 @@
+import io
+import csv
+import gzip
+import json
+import logging
+import tempfile
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Выгрузка до этого размера собирается в памяти, больше - во временном файле
+SPOOL_SIZE = 1024 * 1024
+# Строк на одно чтение из курсора
+FETCH_SIZE = 1000
+# Предел sendDocument Bot API
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+# Количества хранятся в граммах, в выгрузку идут кг: x / 1000.0 - ближайший
+# к x/1000 double, его запись - ровно исходные знаки (4700 -> 4.7)
+EXPORT_PAINTS_SQL = '''
+    SELECT color_code, effect, quantity / 1000.0, last_updated
+    FROM paint_stock
+    ORDER BY color_code, effect
+'''
+EXPORT_TRANSACTIONS_SQL = '''
+    SELECT t.id, t.date, t.type, p.color_code, p.effect, t.amount / 1000.0
+    FROM transactions t
+    LEFT JOIN paints p ON p.id = t.paint_id
+    WHERE t.date >= ? AND t.date < ?
+    ORDER BY t.date, t.id
+'''
+
+EXPORTS = {
+    'paints': (EXPORT_PAINTS_SQL, ('color_code', 'effect', 'quantity', 'last_updated')),
+    'transactions': (EXPORT_TRANSACTIONS_SQL, ('id', 'date', 'type', 'color_code', 'effect', 'amount')),
+}
+FORMATS = ('csv', 'json')
+
+
+class ExportRequest:
+    """Разобранная команда /export [paints|transactions] [с] [по] [csv|json]"""
+
+    def __init__(self, kind='transactions', date_from=None, date_to=None, fmt='csv'):
+        self.kind = kind
+        self.date_from = date_from
+        self.date_to = date_to
+        self.fmt = fmt
+
+    @classmethod
+    def parse(cls, args):
+        """Аргументы в любом порядке; даты - ГГГГ-ММ-ДД, первая - начало периода"""
+        request = cls()
+        dates = []
+        for arg in args:
+            word = arg.lower()
+            if word in EXPORTS:
+                request.kind = word
+            elif word in FORMATS:
+                request.fmt = word
+            else:
+                try:
+                    dates.append(date.fromisoformat(word))
+                except ValueError:
+                    raise ValueError(f'непонятный аргумент "{arg}"')
+        if len(dates) > 2:
+            raise ValueError('нужно не больше двух дат')
+        if dates:
+            request.date_from = dates[0]
+            request.date_to = dates[1] if len(dates) == 2 else None
+        if request.date_to == date.max:
+            # Следующего дня после 9999-12-31 нет: такой конец - без ограничения
+            request.date_to = None
+        if request.date_from and request.date_to and request.date_from > request.date_to:
+            raise ValueError('начало периода позже конца')
+        return request
+
+    def params(self):
+        if self.kind != 'transactions':
+            return ()
+        # date хранится как 'ГГГГ-ММ-ДД ЧЧ:ММ:СС', конец периода включительно.
+        # Границы - тоже полные даты: '9999' колонка TIMESTAMP превратила бы в число
+        start = (self.date_from or date.min).isoformat()
+        end = (self.date_to + timedelta(days=1)).isoformat() if self.date_to else date.max.isoformat()
+        return start, end
+
+    @property
+    def filename(self):
+        parts = [self.kind]
+        if self.date_from:
+            parts.append(self.date_from.isoformat())
+        if self.date_to:
+            parts.append(self.date_to.isoformat())
+        return f"{'_'.join(parts)}.{self.fmt}.gz"
+
+
+def iter_rows(db, sql, params=()):
+    """Строки запроса порциями из курсора, без fetchall"""
+    cursor = db.connection().execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def write_csv(stream, columns, rows):
+    writer = csv.writer(stream, delimiter=';')
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_json(stream, columns, rows):
+    """JSON-массив объектов, записываемый по одной строке"""
+    stream.write('[')
+    count = 0
+    for row in rows:
+        stream.write(',\n' if count else '\n')
+        stream.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        count += 1
+    stream.write('\n]\n')
+    return count
+
+
+def export(db, request):
+    """Выгрузка в gzip-файл: возвращает (SpooledTemporaryFile в начале, число строк).
+
+    Строки идут из курсора прямо в gzip, так что память не зависит от
+    размера журнала. Файл закрывает вызывающий.
+    """
+    sql, columns = EXPORTS[request.kind]
+    writer = write_json if request.fmt == 'json' else write_csv
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        with gzip.GzipFile(filename=request.filename[:-3], mode='wb', fileobj=spool) as archive:
+            text = io.TextIOWrapper(archive, encoding='utf-8', newline='')
+            count = writer(text, columns, iter_rows(db, sql, request.params()))
+            text.flush()
+            text.detach()
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    logger.info(f"📤 Выгрузка {request.filename}: {count} строк, {spool_size(spool)} байт")
+    return spool, count
+
+
+def spool_size(spool):
+    position = spool.tell()
+    spool.seek(0, io.SEEK_END)
+    size = spool.tell()
+    spool.seek(position)
+    return size
@@ -0,0 +1,234 @@
+import time
+import html
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from .inventory import lookup
+from .grams import format_kg
+
+logger = logging.getLogger(__name__)
+
+# Окна для скорости расхода, дней: берем большую из двух средних,
+# чтобы свежий всплеск расхода не терялся в длинном окне
+WINDOW_DAYS = 28
+SHORT_WINDOW_DAYS = 7
+# Порог по умолчанию для подписки: предупреждать за столько дней до нуля
+DEFAULT_THRESHOLD_DAYS = 7
+# Как часто пересчитывать затронутые позиции и как часто - все (окно сдвигается со временем)
+DEFAULT_INTERVAL = 300
+FULL_RECOMPUTE_INTERVAL = 24 * 3600
+# id краски на один запрос (лимит переменных SQLite - 999)
+CHUNK = 400
+MAX_ALERT_LINES = 30
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS alert_subscriptions (
+        chat_id INTEGER PRIMARY KEY,
+        threshold_days REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS forecasts (
+        paint_id INTEGER PRIMARY KEY,
+        rate REAL NOT NULL,
+        days_left REAL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_forecasts_days_left ON forecasts (days_left)',
+    # Окно расхода по списку красок, а не по всем краскам за период
+    'CREATE INDEX IF NOT EXISTS idx_daily_consumption_paint ON daily_consumption (paint_id, day)',
+]
+
+AT_RISK_SQL = '''
+    SELECT p.color_code, p.effect, p.quantity, f.rate, f.days_left
+    FROM forecasts f
+    JOIN paint_stock p ON p.id = f.paint_id
+    WHERE f.days_left IS NOT NULL
+    ORDER BY f.days_left
+    LIMIT ?
+'''
+
+
+def _numpy():
+    import numpy  # тяжелый импорт - только в потоке прогноза
+    return numpy
+
+
+def subscribe(db, chat_id, threshold_days=DEFAULT_THRESHOLD_DAYS):
+    db.execute('INSERT OR REPLACE INTO alert_subscriptions (chat_id, threshold_days) VALUES (?, ?)',
+               (chat_id, threshold_days))
+
+
+def unsubscribe(db, chat_id):
+    """True, если подписка была"""
+    return db.execute('DELETE FROM alert_subscriptions WHERE chat_id = ?', (chat_id,)).rowcount > 0
+
+
+def at_risk(db, limit=10):
+    """Позиции, которые закончатся раньше всех: [(код, эффект, остаток г, расход г/день, дней)]"""
+    return db.fetchall(AT_RISK_SQL, (limit,))
+
+
+class Forecaster:
+    """Прогноз расхода и оповещения о заканчивающейся краске.
+
+    Фоновый поток раз в interval секунд пересчитывает только позиции,
+    отмеченные touch() после прошлого прогона (раз в сутки - все, потому что
+    окно сдвигается и без новых операций). Скорость расхода считается по
+    агрегату daily_consumption матрицей NumPy [позиции x дни окна].
+    Подписчик получает сообщение, когда прогноз позиции опускается ниже
+    его порога; notify(chat_id, text) отправляет текст в HTML.
+    """
+
+    def __init__(self, db, notify, interval=DEFAULT_INTERVAL, full_interval=FULL_RECOMPUTE_INTERVAL):
+        self.db = db
+        self.notify = notify
+        self.interval = interval
+        self.full_interval = full_interval
+        self._dirty = set()
+        self._full = True      # первый прогон после старта - по всем позициям
+        self._last_full = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def touch(self, color_code, effect):
+        with self._lock:
+            self._dirty.add((color_code, effect))
+
+    def touch_all(self):
+        with self._lock:
+            self._full = True
+
+    def start(self):
+        try:
+            _numpy()
+        except ImportError:
+            logger.warning("⚠️ NumPy не установлен - прогноз расхода отключен")
+            return False
+        # Новое событие на каждый запуск: поток прошлого запуска, если он еще
+        # спит, выйдет по своему (см. Warehouses.stop - реплика перестала быть лидером)
+        self._stop = threading.Event()
+        self.touch_all()
+        self._thread = threading.Thread(target=self._loop, args=(self._stop,), name='forecast', daemon=True)
+        self._thread.start()
+        logger.info(f"📈 Прогноз расхода: пересчет каждые {self.interval} с")
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, stop):
+        while not stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка прогноза: {e}")
+            stop.wait(self.interval)
+
+    def run_once(self):
+        """Один прогон: пересчет затронутых позиций и рассылка. Возвращает число пересчитанных"""
+        if time.time() - self._last_full >= self.full_interval:
+            self.touch_all()
+        with self._lock:
+            full, keys = self._full, self._dirty
+            self._full, self._dirty = False, set()
+        if full:
+            self._last_full = time.time()
+            paints = self.db.fetchall('SELECT id, color_code, effect, quantity FROM paint_stock')
+        else:
+            paints = self._resolve(keys)
+
+        subscribers = self.db.fetchall('SELECT chat_id, threshold_days FROM alert_subscriptions')
+        alerts = {}
+        for start in range(0, len(paints), CHUNK):
+            chunk = paints[start:start + CHUNK]
+            for chat_id, line in self._update(chunk, subscribers):
+                alerts.setdefault(chat_id, []).append(line)
+        for chat_id, lines in alerts.items():
+            self._send(chat_id, lines)
+        if paints:
+            logger.info(f"📈 Прогноз пересчитан: {len(paints)} позиций, оповещений {len(alerts)}")
+        return len(paints)
+
+    def _resolve(self, keys):
+        if not keys:
+            return []
+        found = lookup(self.db.connection(), list(keys))
+        return [(paint_id, key[0], key[1], quantity) for key, (paint_id, quantity) in found.items()]
+
+    def rates(self, paint_ids, today=None):
+        """Средний расход в граммах в день по каждой краске (массив в порядке paint_ids)"""
+        np = _numpy()
+        today = today or datetime.utcnow().date()
+        first = today - timedelta(days=WINDOW_DAYS - 1)
+        placeholders = ', '.join(['?'] * len(paint_ids))
+        rows = self.db.fetchall(
+            f'SELECT paint_id, day, amount FROM daily_consumption WHERE day >= ? AND paint_id IN ({placeholders})',
+            [first.isoformat()] + list(paint_ids))
+        position = {paint_id: i for i, paint_id in enumerate(paint_ids)}
+        matrix = np.zeros((len(paint_ids), WINDOW_DAYS))
+        if rows:
+            first_ordinal = first.toordinal()
+            index = np.array([position[row[0]] for row in rows])
+            offsets = np.array([datetime.strptime(row[1], '%Y-%m-%d').toordinal() - first_ordinal
+                                for row in rows])
+            amounts = np.array([row[2] for row in rows], dtype=float)
+            valid = (offsets >= 0) & (offsets < WINDOW_DAYS)
+            np.add.at(matrix, (index[valid], offsets[valid]), amounts[valid])
+        long_rate = matrix.sum(axis=1) / WINDOW_DAYS
+        short_rate = matrix[:, -SHORT_WINDOW_DAYS:].sum(axis=1) / SHORT_WINDOW_DAYS
+        return np.maximum(long_rate, short_rate)
+
+    def _update(self, paints, subscribers):
+        """Пересчитывает прогноз пачки и возвращает [(chat_id, строка оповещения)]"""
+        np = _numpy()
+        paint_ids = [row[0] for row in paints]
+        rates = self.rates(paint_ids)
+        quantities = np.array([max(row[3], 0) for row in paints], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            days_left = np.where(rates > 0, quantities / rates, np.inf)
+        days_left[quantities <= 0] = 0
+
+        placeholders = ', '.join(['?'] * len(paint_ids))
+        previous = dict(self.db.fetchall(
+            f'SELECT paint_id, days_left FROM forecasts WHERE paint_id IN ({placeholders})', paint_ids))
+        alerts = []
+        records = []
+        for (paint_id, color_code, effect, quantity), rate, days in zip(paints, rates.tolist(), days_left.tolist()):
+            days = None if days == float('inf') else days
+            records.append((paint_id, rate, days))
+            before = previous.get(paint_id)
+            before = float('inf') if before is None else before
+            current = float('inf') if days is None else days
+            for chat_id, threshold in subscribers:
+                # Только пересечение порога вниз: повторно не оповещаем, пока не пополнят
+                if current <= threshold < before:
+                    alerts.append((chat_id, self._alert_line(color_code, effect, quantity, rate, days)))
+        with self.db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO forecasts (paint_id, rate, days_left) VALUES (?, ?, ?)
+                ON CONFLICT (paint_id) DO UPDATE
+                SET rate = excluded.rate, days_left = excluded.days_left, updated_at = CURRENT_TIMESTAMP
+            ''', records)
+        return alerts
+
+    @staticmethod
+    def _alert_line(color_code, effect, quantity, rate, days):
+        if days == 0:
+            return f"• {html.escape(color_code)} ({effect}): закончилась"
+        return (f"• {html.escape(color_code)} ({effect}): {format_kg(quantity)} кг, "
+                f"~{days:.0f} дн. (расход {format_kg(round(rate))} кг/день)")
+
+    def _send(self, chat_id, lines):
+        text = "⚠️ <b>Скоро закончится:</b>\n\n" + '\n'.join(lines[:MAX_ALERT_LINES])
+        if len(lines) > MAX_ALERT_LINES:
+            text += f"\n… и еще {len(lines) - MAX_ALERT_LINES}"
+        try:
+            self.notify(chat_id, text)
+        except Exception as e:
+            logger.error(f"❌ Оповещение для {chat_id} не отправлено: {e}")
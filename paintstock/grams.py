@@ -0,0 +1,79 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+# Количества хранятся целыми граммами: суммы точные, без хвостов вроде 4.699999999999999
+GRAMS_PER_KG = 1000
+
+
+def to_grams(value):
+    """Количество в кг (строка с точкой или запятой, число из XLSX) -> целые граммы.
+
+    ValueError, если это не число или точность мельче грамма.
+    """
+    if isinstance(value, int):
+        return value * GRAMS_PER_KG
+    # str(float) - кратчайшая запись, так что 4.7 из XLSX остается ровно 4.7
+    text = str(value).strip().replace(',', '.')
+    try:
+        kg = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f'не число: "{value}"')
+    if not kg.is_finite():
+        raise ValueError(f'не число: "{value}"')
+    grams = kg * GRAMS_PER_KG
+    if grams != grams.to_integral_value():
+        raise ValueError('точность - до грамма (0,001 кг)')
+    return int(grams)
+
+
+def format_kg(grams):
+    """Граммы -> кг для ответа: 4700 -> '4.7', 5000 -> '5', -250 -> '-0.25'"""
+    sign = '-' if grams < 0 else ''
+    kg, rest = divmod(abs(int(grams)), GRAMS_PER_KG)
+    if not rest:
+        return f"{sign}{kg}"
+    return f"{sign}{kg}.{rest:03d}".rstrip('0')
+
+
+def retype_to_grams(conn, columns):
+    """Шаг миграции: колонки REAL с кг -> INTEGER с граммами.
+
+    columns - {таблица: (колонка, ...)}. Тип колонки ALTER TABLE не меняет,
+    поэтому таблица пересобирается по своему же CREATE из sqlite_master с
+    переносом индексов. Представления и триггеры на время пересборки
+    удаляются (иначе RENAME проверяет их на несуществующие таблицы) и
+    создаются заново тем же текстом - арифметика в них от типа не зависит.
+    """
+    dependents = conn.execute('''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('view', 'trigger') AND sql IS NOT NULL
+        ORDER BY type = 'trigger'
+    ''').fetchall()
+    for type, name, _ in dependents:
+        conn.execute(f'DROP {type.upper()} IF EXISTS "{name}"')
+    for table, names in columns.items():
+        _retype_table(conn, table, names)
+    for _, _, sql in dependents:
+        conn.execute(sql)
+
+
+def _retype_table(conn, table, names):
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    indexes = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))]
+    for name in names:
+        sql, count = re.subn(rf'(\b{name}\s+)REAL\b', r'\1INTEGER', sql, flags=re.IGNORECASE)
+        if not count:
+            raise ValueError(f'{table}.{name}: колонка не REAL')
+    new_table = f'{table}_grams'
+    sql = re.sub(rf'^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?"?{table}"?', f'CREATE TABLE {new_table}',
+                 sql, count=1, flags=re.IGNORECASE)
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+    values = [f'CAST(ROUND({column} * {GRAMS_PER_KG}) AS INTEGER)' if column in names else column
+              for column in columns]
+    conn.execute(sql)
+    conn.execute(f'INSERT INTO {new_table} ({", ".join(columns)}) SELECT {", ".join(values)} FROM "{table}"')
+    conn.execute(f'DROP TABLE "{table}"')
+    conn.execute(f'ALTER TABLE {new_table} RENAME TO "{table}"')
+    for index in indexes:
+        conn.execute(index)
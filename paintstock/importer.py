@@ -0,0 +1,134 @@
+import time
+import logging
+import tempfile
+
+from telebot import apihelper
+
+from .parsing import iter_csv_rows, iter_xlsx_rows
+from .inventory import lookup
+
+logger = logging.getLogger(__name__)
+
+# Строк на одну транзакцию: больше - быстрее, но дольше держится блокировка записи
+CHUNK_SIZE = 2000
+# Файл до этого размера держим в памяти, больше - во временном файле на диске
+SPOOL_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK = 64 * 1024
+# Сколько ошибочных строк запоминаем для отчета (остальные только считаем)
+MAX_REPORTED_ERRORS = 20
+
+class ImportErrors:
+    """Ошибочные строки: первые MAX_REPORTED_ERRORS и общее число"""
+
+    def __init__(self, limit=MAX_REPORTED_ERRORS):
+        self.limit = limit
+        self.items = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, error):
+        self.count += 1
+        if len(self.items) < self.limit:
+            self.items.append(error)
+
+
+def download_file(bot, file_id, max_size):
+    """Скачивает файл из Telegram потоком во временный файл (без чтения целиком).
+
+    Возвращает SpooledTemporaryFile, перемотанный в начало, или бросает
+    ValueError, если файл больше max_size.
+    """
+    file_path = bot.get_file(file_id).file_path
+    url_template = apihelper.FILE_URL or 'https://api.telegram.org/file/bot{0}/{1}'
+    url = url_template.format(bot.token, file_path)
+    session = apihelper.session or apihelper._get_req_session()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with session.get(url, stream=True, timeout=(apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT)) as response:
+        if response.status_code != 200:
+            raise apihelper.ApiHTTPException('Download file', response)
+        size = 0
+        for block in response.iter_content(DOWNLOAD_CHUNK):
+            size += len(block)
+            if size > max_size:
+                spool.close()
+                raise ValueError('файл слишком большой')
+            spool.write(block)
+    spool.seek(0)
+    return spool
+
+
+def iter_file_rows(stream, filename, errors=None):
+    """Строки CSV или XLSX (по расширению имени файла)"""
+    if (filename or '').lower().endswith('.xlsx'):
+        return iter_xlsx_rows(stream, errors)
+    return iter_csv_rows(stream, errors=errors)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_chunk(db, chunk):
+    """Пачка в SQLite одной транзакцией: новые краски в справочник и строки transactions для каждой строки файла.
+
+    Возвращает [(color_code, effect, новый остаток)] и версию (max id транзакции).
+    """
+    totals = {}
+    for _, color_code, effect, amount in chunk:
+        key = (color_code, effect)
+        totals[key] = totals.get(key, 0) + amount
+    with db.transaction() as conn:
+        conn.executemany('INSERT OR IGNORE INTO paints (color_code, effect) VALUES (?, ?)', list(totals))
+        found = lookup(conn, list(totals))   # остатки до этой пачки
+        conn.executemany('INSERT INTO transactions (paint_id, type, amount) VALUES (?, ?, ?)',
+                         [(found[(color_code, effect)][0], 'add', amount)
+                          for _, color_code, effect, amount in chunk])
+        version = conn.execute('SELECT MAX(id) FROM transactions').fetchone()[0]
+    return [key + (found[key][1] + totals[key],) for key in totals], version
+
+
+def import_stock(backend, rows, chunk_size=CHUNK_SIZE, on_chunk=None):
+    """Приход из файла: строки (номер, код, эффект, количество) пачками по chunk_size.
+
+    Каждая пачка - отдельная транзакция хранилища (backends.StockBackend), так что в памяти одновременно не
+    больше chunk_size строк, а ошибка на середине файла не откатывает уже
+    загруженное. После каждой пачки вызывается on_chunk(строк всего,
+    [(код, эффект, новый остаток)], версия). Возвращает число загруженных строк.
+    """
+    done = 0
+    for chunk in _chunks(rows, chunk_size):
+        changed, version = backend.import_chunk(chunk)
+        done += len(chunk)
+        if on_chunk:
+            on_chunk(done, changed, version)
+    logger.info(f"📥 Импорт: загружено {done} строк")
+    return done
+
+
+class Progress:
+    """Прогресс в одном сообщении: правка не чаще, чем раз в interval секунд"""
+
+    def __init__(self, sender, chat_id, message_id, interval=2.0):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self._last = 0.0
+        self._text = None
+
+    def update(self, text, force=False):
+        current = time.monotonic()
+        if text == self._text or (not force and current - self._last < self.interval):
+            return
+        self._last = current
+        self._text = text
+        self.sender.edit_html(text, self.chat_id, self.message_id)
@@ -0,0 +1,79 @@
+import html
+import threading
+from collections import OrderedDict
+
+from telebot.types import InlineQueryResultArticle, InputTextMessageContent
+
+from .search_index import normalize, code_digest
+from .grams import format_kg
+
+MAX_RESULTS = 20
+MAX_CACHED_QUERIES = 2048
+
+
+class InlineSearch:
+    """Ответы на inline-запросы (@bot код...) из индекса и кэша остатков.
+
+    Результаты кэшируются по нормализованному запросу, так что набор
+    "3", "30", "300"... по одному разу строит каждый префикс. При изменении
+    остатка сбрасываются только запросы, в ответ на которые попал этот код,
+    при появлении нового кода - все.
+    """
+
+    def __init__(self, index, stock, max_results=MAX_RESULTS):
+        self.index = index
+        self.stock = stock
+        self.max_results = max_results
+        self._cache = OrderedDict()   # запрос -> (результаты, коды)
+        self._lock = threading.Lock()
+        self._version = 0
+
+    def results(self, query):
+        key = normalize(query)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached[0]
+            version = self._version
+        if key:
+            codes = [code for code, _ in self.index.search(query, limit=self.max_results)]
+        else:
+            # Пустой запрос - начало списка склада
+            codes = []
+            for color_code, _, _ in self.stock.items():
+                if not codes or codes[-1] != color_code:
+                    codes.append(color_code)
+                if len(codes) == self.max_results:
+                    break
+        results = [self._article(code) for code in codes]
+        with self._lock:
+            if version == self._version:
+                self._cache[key] = (results, set(codes))
+                if len(self._cache) > MAX_CACHED_QUERIES:
+                    self._cache.popitem(last=False)
+        return results
+
+    def invalidate(self, color_code, new_code=False):
+        with self._lock:
+            self._version += 1
+            if new_code:
+                self._cache.clear()
+                return
+            stale = [key for key, (_, codes) in self._cache.items() if color_code in codes]
+            for key in stale:
+                del self._cache[key]
+
+    def _article(self, color_code):
+        paints = self.stock.by_code(color_code)
+        total = sum(quantity for _, quantity in paints)
+        description = ', '.join(f"{effect}: {format_kg(quantity)} кг" for effect, quantity in paints)
+        lines = [f"🎨 <b>{html.escape(color_code)}</b>"]
+        lines += [f"• {html.escape(effect)}: {format_kg(quantity)} кг" for effect, quantity in paints]
+        lines.append(f"📦 <b>Итого: {format_kg(total)} кг</b>")
+        return InlineQueryResultArticle(
+            id=code_digest(color_code),
+            title=f"{color_code} — {format_kg(total)} кг",
+            description=description or 'нет на складе',
+            input_message_content=InputTextMessageContent('\n'.join(lines), parse_mode='HTML'),
+        )
@@ -0,0 +1,128 @@
+import logging
+
+from .ledger import append
+from .grams import format_kg
+
+logger = logging.getLogger(__name__)
+
+# Сколько пар (код, эффект) проверяем одним запросом (лимит переменных SQLite - 999)
+LOOKUP_CHUNK = 400
+
+
+# Списание одной строкой журнала при условии, что остатка хватает: проверка и
+# запись - одна инструкция, между ними не может вклиниться другое списание
+CONDITIONAL_WRITE_OFF_SQL = '''
+    INSERT INTO transactions (paint_id, type, amount)
+    SELECT id, ?, ? FROM paint_stock
+    WHERE color_code = ? AND effect = ? AND quantity >= ?
+'''
+
+
+class WriteOffError(Exception):
+    """Пакетное списание отклонено целиком; problems - список причин"""
+
+    def __init__(self, problems):
+        super().__init__('; '.join(problems))
+        self.problems = problems
+
+
+class PaintNotFound(WriteOffError):
+    def __init__(self, color_code, effect):
+        super().__init__([f"{color_code} ({effect}) не найдена"])
+
+
+class InsufficientStock(WriteOffError):
+    """Остатка не хватает; available - сколько есть сейчас"""
+
+    def __init__(self, color_code, effect, available):
+        super().__init__([f"{color_code} ({effect}): доступно {format_kg(available)} кг"])
+        self.available = available
+
+
+def lookup(conn, keys):
+    """{(color_code, effect): (id, quantity)} для списка ключей"""
+    found = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        values = ', '.join(['(?, ?)'] * len(chunk))
+        params = [value for key in chunk for value in key]
+        # CROSS JOIN фиксирует порядок: по каждой паре - поиск по уникальному
+        # индексу (с IN (VALUES ...) SQLite сканирует всю таблицу)
+        rows = conn.execute(f'''
+            SELECT p.id, p.color_code, p.effect, p.quantity
+            FROM (VALUES {values}) AS k
+            CROSS JOIN paint_stock p ON p.color_code = k.column1 AND p.effect = k.column2
+        ''', params)
+        for paint_id, color_code, effect, quantity in rows:
+            found[(color_code, effect)] = (paint_id, quantity)
+    return found
+
+
+def write_off(db, color_code, effect, amount, type='use'):
+    """Атомарное списание одной позиции.
+
+    Возвращает (новый остаток, id транзакции) или бросает PaintNotFound /
+    InsufficientStock. Безопасно при одновременных списаниях одной краски
+    из разных потоков и процессов. type - тип строки журнала ('transfer_out'
+    для отправки на другой склад).
+    """
+    with db.transaction() as conn:
+        cursor = conn.execute(CONDITIONAL_WRITE_OFF_SQL, (type, amount, color_code, effect, amount))
+        row = conn.execute('SELECT quantity FROM paint_stock WHERE color_code = ? AND effect = ?',
+                           (color_code, effect)).fetchone()
+        if cursor.rowcount == 0:
+            if row is None:
+                raise PaintNotFound(color_code, effect)
+            raise InsufficientStock(color_code, effect, row[0])
+        return row[0], cursor.lastrowid
+
+
+def group_items(items):
+    """(номер строки, код, эффект, количество) -> ({ключ: всего}, {ключ: [номера строк]})"""
+    totals = {}
+    lines = {}
+    for line, color_code, effect, amount in items:
+        key = (color_code, effect)
+        totals[key] = totals.get(key, 0) + amount
+        lines.setdefault(key, []).append(line)
+    if not totals:
+        raise WriteOffError(['нет строк для списания'])
+    return totals, lines
+
+
+def batch_problems(totals, lines, found):
+    """Причины отказа пакета; found - {ключ: (id, остаток)} найденных позиций"""
+    problems = []
+    for key, total in totals.items():
+        where = ', '.join(map(str, lines[key]))
+        if key not in found:
+            problems.append(f"строка {where}: {key[0]} ({key[1]}) не найдена")
+        elif found[key][1] < total:
+            problems.append(f"строка {where}: {key[0]} ({key[1]}) - нужно {format_kg(total)} кг, "
+                            f"доступно {format_kg(found[key][1])} кг")
+    return problems
+
+
+def write_off_batch(db, items):
+    """Списывает несколько позиций одной транзакцией: все или ничего.
+
+    items - итерируемое (номер строки, код, эффект, количество); одна краска
+    может встречаться в нескольких строках. Возвращает список
+    (color_code, effect, списано, новый остаток, id транзакции) или бросает
+    WriteOffError со всеми найденными проблемами.
+    """
+    totals, lines = group_items(items)
+    keys = list(totals)
+    with db.transaction() as conn:
+        found = lookup(conn, keys)
+        problems = batch_problems(totals, lines, found)
+        if problems:
+            raise WriteOffError(problems)
+
+        results = []
+        for key in keys:
+            paint_id, quantity = found[key]
+            txn_id = append(conn, paint_id, 'use', totals[key])
+            results.append((key[0], key[1], totals[key], quantity - totals[key], txn_id))
+    logger.info(f"➖ Пакетное списание: {len(results)} позиций")
+    return results
@@ -0,0 +1,236 @@
+import threading
+import logging
+
+from . import aggregates
+from .grams import GRAMS_PER_KG, retype_to_grams
+
+logger = logging.getLogger(__name__)
+
+# Как часто снимать снимки остатков позиций, по которым были операции
+DEFAULT_SNAPSHOT_INTERVAL = 3600
+
+# Знаковое изменение остатка по строке журнала: списание и отправка на
+# другой склад уменьшают остаток, приход и получение со склада - увеличивают
+DELTA = "CASE WHEN type IN ('use', 'transfer_out') THEN -amount ELSE amount END"
+NEW_DELTA = "CASE WHEN NEW.type IN ('use', 'transfer_out') THEN -NEW.amount ELSE NEW.amount END"
+
+# Текущий остаток = последний снимок + операции после него.
+# Индексы: stock_snapshots (paint_id, txn_id) и transactions (paint_id) - на
+# каждую краску два поиска по индексу и короткий хвост журнала
+STOCK_VIEW = f'''
+    CREATE VIEW IF NOT EXISTS paint_stock AS
+    SELECT p.id, p.color_code, p.effect,
+           COALESCE((SELECT s.quantity FROM stock_snapshots s
+                     WHERE s.paint_id = p.id ORDER BY s.txn_id DESC LIMIT 1), 0)
+           + COALESCE((SELECT SUM({DELTA}) FROM transactions t
+                       WHERE t.paint_id = p.id
+                         AND t.id > COALESCE((SELECT MAX(s.txn_id) FROM stock_snapshots s
+                                              WHERE s.paint_id = p.id), 0)), 0) AS quantity,
+           (SELECT t.date FROM transactions t WHERE t.paint_id = p.id ORDER BY t.id DESC LIMIT 1) AS last_updated
+    FROM paints p
+'''
+
+# Агрегаты остатков теперь меняются записью в журнал, а не UPDATE paints
+TOTALS_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS paints_totals_insert AFTER INSERT ON paints
+    BEGIN
+        INSERT INTO effect_totals (effect, positions, quantity) VALUES (NEW.effect, 1, 0)
+        ON CONFLICT (effect) DO UPDATE SET positions = positions + 1;
+        INSERT INTO code_totals (color_code, positions, quantity) VALUES (NEW.color_code, 1, 0)
+        ON CONFLICT (color_code) DO UPDATE SET positions = positions + 1;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS transactions_totals_insert AFTER INSERT ON transactions
+    BEGIN
+        UPDATE effect_totals SET quantity = quantity + {NEW_DELTA}
+        WHERE effect = (SELECT effect FROM paints WHERE id = NEW.paint_id);
+        UPDATE code_totals SET quantity = quantity + {NEW_DELTA}
+        WHERE color_code = (SELECT color_code FROM paints WHERE id = NEW.paint_id);
+    END
+    ''',
+]
+
+# Снимок всех позиций, по которым были операции после txn_id = ?:
+# остаток на момент последней из них (taken_at - время этой операции)
+SNAPSHOT_SQL = '''
+    INSERT OR IGNORE INTO stock_snapshots (paint_id, txn_id, quantity, taken_at)
+    SELECT s.id, t.last_id, s.quantity, (SELECT date FROM transactions WHERE id = t.last_id)
+    FROM (SELECT paint_id, MAX(id) AS last_id FROM transactions WHERE id > ? GROUP BY paint_id) t
+    JOIN paint_stock s ON s.id = t.paint_id
+'''
+
+# Остатки на момент времени: ближайший снимок не позже момента + операции до
+# момента; если снимков до момента нет (история до перехода на журнал) -
+# самый ранний снимок минус операции между моментом и им
+AS_OF_SQL = f'''
+    SELECT id, color_code, effect,
+           CASE WHEN base_txn IS NOT NULL THEN
+               (SELECT quantity FROM stock_snapshots WHERE paint_id = x.id AND txn_id = x.base_txn)
+               + COALESCE((SELECT SUM({DELTA}) FROM transactions t
+                           WHERE t.paint_id = x.id AND t.id > x.base_txn AND t.date <= :moment), 0)
+           WHEN first_txn IS NOT NULL THEN
+               (SELECT quantity FROM stock_snapshots WHERE paint_id = x.id AND txn_id = x.first_txn)
+               - COALESCE((SELECT SUM({DELTA}) FROM transactions t
+                           WHERE t.paint_id = x.id AND t.id <= x.first_txn AND t.date > :moment), 0)
+           ELSE
+               COALESCE((SELECT SUM({DELTA}) FROM transactions t
+                         WHERE t.paint_id = x.id AND t.date <= :moment), 0)
+           END AS quantity
+    FROM (
+        SELECT p.id, p.color_code, p.effect,
+               (SELECT s.txn_id FROM stock_snapshots s WHERE s.paint_id = p.id AND s.taken_at <= :moment
+                ORDER BY s.taken_at DESC, s.txn_id DESC LIMIT 1) AS base_txn,
+               (SELECT MIN(s.txn_id) FROM stock_snapshots s WHERE s.paint_id = p.id) AS first_txn
+        FROM paints p {{where}}
+    ) x
+'''
+AS_OF_ALL_SQL = AS_OF_SQL.format(where='')
+AS_OF_CODE_SQL = AS_OF_SQL.format(where='WHERE p.color_code = :color_code')
+
+
+def migrate_to_ledger(conn):
+    """Шаг миграции: paints становится справочником, остаток - журнал со снимками.
+
+    Текущие остатки из paints.quantity записываются базовыми снимками на
+    последнюю операцию журнала, после чего колонка quantity удаляется
+    (пересборкой таблицы - DROP COLUMN есть не во всех версиях SQLite).
+    """
+    conn.execute('''
+        CREATE TABLE stock_snapshots (
+            paint_id INTEGER NOT NULL,
+            txn_id INTEGER NOT NULL,
+            quantity REAL NOT NULL,
+            taken_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (paint_id, txn_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX idx_stock_snapshots_taken ON stock_snapshots (paint_id, taken_at)')
+    conn.execute('''
+        INSERT INTO stock_snapshots (paint_id, txn_id, quantity, taken_at)
+        SELECT id,
+               (SELECT COALESCE(MAX(id), 0) FROM transactions),
+               quantity,
+               COALESCE((SELECT MAX(date) FROM transactions), CURRENT_TIMESTAMP)
+        FROM paints
+    ''')
+
+    conn.execute('''
+        CREATE TABLE paints_catalog (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            color_code TEXT NOT NULL,
+            effect TEXT NOT NULL,
+            unit TEXT DEFAULT 'kg',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO paints_catalog (id, color_code, effect, unit, created_at)
+        SELECT id, color_code, effect, unit, last_updated FROM paints
+    ''')
+    conn.execute('DROP TABLE paints')  # вместе с триггерами агрегатов на paints
+    conn.execute('ALTER TABLE paints_catalog RENAME TO paints')
+    conn.execute('CREATE UNIQUE INDEX idx_paints_code_effect ON paints (color_code, effect)')
+    # (paint_id, rowid): хвост журнала после снимка - поиск по диапазону id
+    conn.execute('CREATE INDEX idx_transactions_paint ON transactions (paint_id)')
+    conn.execute(STOCK_VIEW)
+    for sql in TOTALS_TRIGGERS:
+        conn.execute(sql)
+    for sql in aggregates.REBUILD_SQL:
+        conn.execute(sql)
+
+
+def recreate_stock_view(conn):
+    """Шаг миграции: представление остатков и триггер итогов с текущим DELTA"""
+    conn.execute('DROP VIEW IF EXISTS paint_stock')
+    conn.execute('DROP TRIGGER IF EXISTS transactions_totals_insert')
+    conn.execute(STOCK_VIEW)
+    for sql in TOTALS_TRIGGERS:
+        conn.execute(sql)
+
+
+# Колонки с количеством в кг, которые становятся целыми граммами
+GRAM_COLUMNS = {
+    'transactions': ('amount',),
+    'stock_snapshots': ('quantity',),
+    'effect_totals': ('quantity',),
+    'code_totals': ('quantity',),
+    'daily_totals': ('added', 'used'),
+    'daily_consumption': ('amount',),
+}
+
+
+def migrate_to_grams(conn):
+    """Шаг миграции: журнал, снимки и агрегаты хранят целые граммы вместо REAL кг.
+
+    Агрегаты после перевода пересчитываются из журнала, чтобы в них не
+    осталось накопленной погрешности сумм REAL.
+    """
+    retype_to_grams(conn, GRAM_COLUMNS)
+    conn.execute(f'UPDATE forecasts SET rate = rate * {GRAMS_PER_KG}')  # кг/день -> г/день
+    for sql in aggregates.REBUILD_SQL:
+        conn.execute(sql)
+
+
+def ensure_paint(conn, color_code, effect):
+    """id краски в справочнике (создается при первом приходе), True если новая"""
+    row = conn.execute('SELECT id FROM paints WHERE color_code = ? AND effect = ?',
+                       (color_code, effect)).fetchone()
+    if row:
+        return row[0], False
+    cursor = conn.execute('INSERT INTO paints (color_code, effect) VALUES (?, ?)', (color_code, effect))
+    return cursor.lastrowid, True
+
+
+def balance(conn, paint_id):
+    """Текущий остаток краски: снимок + хвост журнала"""
+    row = conn.execute('SELECT quantity FROM paint_stock WHERE id = ?', (paint_id,)).fetchone()
+    return row[0] if row else None
+
+
+def append(conn, paint_id, type, amount):
+    """Запись операции в журнал - единственный способ изменить остаток. Возвращает id"""
+    return conn.execute('INSERT INTO transactions (paint_id, type, amount) VALUES (?, ?, ?)',
+                        (paint_id, type, amount)).lastrowid
+
+
+def stock_as_of(db, moment, color_code=None):
+    """Остатки на момент 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' (UTC): [(id, код, эффект, количество)]"""
+    if color_code is None:
+        return db.fetchall(AS_OF_ALL_SQL, {'moment': moment})
+    return db.fetchall(AS_OF_CODE_SQL, {'moment': moment, 'color_code': color_code})
+
+
+def take_snapshots(db):
+    """Снимки по позициям, которые менялись после прошлого снимка. Возвращает их число"""
+    with db.transaction() as conn:
+        watermark = conn.execute('SELECT COALESCE(MAX(txn_id), 0) FROM stock_snapshots').fetchone()[0]
+        count = conn.execute(SNAPSHOT_SQL, (watermark,)).rowcount
+    if count:
+        logger.info(f"📸 Снимки остатков: {count} позиций")
+    return count
+
+
+class Snapshotter:
+    """Фоновый поток: раз в interval секунд снимает снимки измененных позиций,
+    чтобы хвост журнала, который проигрывается для остатка, оставался коротким"""
+
+    def __init__(self, db, interval=DEFAULT_SNAPSHOT_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop = threading.Event()
+        threading.Thread(target=self._loop, args=(self._stop,), name='snapshots', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                take_snapshots(self.db)
+            except Exception as e:
+                logger.error(f"❌ Ошибка снимка остатков: {e}")
@@ -0,0 +1,65 @@
+import os
+import logging
+
+from .storage import get_pool, migrate
+from .grams import retype_to_grams
+from . import ledger
+
+logger = logging.getLogger(__name__)
+
+# Эффекта в простой схеме не было - краски переносятся с этим
+DEFAULT_EFFECT = 'Матовый'
+# Цвет, который простой бот подставлял, когда его не указали
+NO_COLOR = 'Не указан'
+
+# Схема paints.db простого бота (name/color вместо color_code/effect)
+SIMPLE_MIGRATIONS = [
+    # 1: исходная таблица
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS paints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            quantity REAL NOT NULL,
+            color TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # 2: количество - целые граммы вместо REAL кг
+    lambda conn: retype_to_grams(conn, {'paints': ('quantity',)}),
+]
+
+
+def simple_code(name, color):
+    """Код краски в основной схеме: название и, если был указан, цвет"""
+    if color and color != NO_COLOR:
+        return f"{name} {color}"
+    return name
+
+
+def import_simple_db(db, path, effect=DEFAULT_EFFECT):
+    """Переносит склад простого бота (paints.db) в основную базу одной транзакцией.
+
+    Каждая краска попадает в справочник под кодом simple_code(), а ее
+    количество - приходом в журнал с датой создания записи. После переноса
+    файл переименовывается в <path>.imported, чтобы не перенести его второй
+    раз. Возвращает число перенесенных красок.
+    """
+    source = get_pool(path)
+    migrate(source, SIMPLE_MIGRATIONS)  # старые файлы еще в REAL кг
+    rows = source.fetchall('SELECT name, color, quantity, created_at FROM paints ORDER BY id')
+    source.close_all()
+
+    with db.transaction() as conn:
+        for name, color, quantity, created_at in rows:
+            paint_id, _ = ledger.ensure_paint(conn, simple_code(name, color), effect)
+            if quantity > 0:
+                conn.execute("INSERT INTO transactions (paint_id, type, amount, date) VALUES (?, 'add', ?, ?)",
+                             (paint_id, quantity, created_at))
+    os.replace(path, path + '.imported')
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    logger.info(f"📦 Перенесено из {path}: {len(rows)} красок (эффект {effect})")
+    return len(rows)
@@ -0,0 +1,221 @@
+import os
+import time
+import bisect
+import threading
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Метрики в текстовом формате Prometheus (GET /metrics на порту бота).
+# METRICS=off выключает сбор: декораторы возвращают функцию как есть,
+# соединения SQLite создаются без обертки - накладных расходов нет
+ENABLED = os.environ.get('METRICS', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Гистограмма с метками: observe(секунды, *значения меток)"""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # значения меток -> [счетчики корзин..., +Inf], сумма
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f'{self.name}{_labels(self.labels, key)} {value}' for key, value in values]
+        return lines
+
+
+class Gauge:
+    """Значение, которое читается в момент запроса /metrics: func() -> число"""
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.error(f"❌ Метрика {self.name} не прочитана: {e}")
+            return []
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {value}']
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        """Регистрирует метрику; повторная регистрация имени заменяет прежнюю"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+UPDATE_SECONDS = REGISTRY.add(Histogram(
+    'paintstock_update_seconds', 'Время обработчика обновления Telegram', ('handler',)))
+UPDATE_ERRORS = REGISTRY.add(Counter(
+    'paintstock_update_errors_total', 'Исключения, вышедшие из обработчиков', ('handler',)))
+ACTION_SECONDS = REGISTRY.add(Histogram(
+    'paintstock_action_seconds', 'Время действия меню (add, list, use, search, stats)', ('action',)))
+DB_SECONDS = REGISTRY.add(Histogram(
+    'paintstock_db_statement_seconds', 'Время выполнения SQL по первому слову запроса', ('statement',)))
+DB_TRANSACTION_SECONDS = REGISTRY.add(Histogram(
+    'paintstock_db_transaction_seconds', 'Время транзакции SQLite вместе с ожиданием блокировки', ('mode',)))
+UPDATE_DB_SECONDS = REGISTRY.add(Histogram(
+    'paintstock_update_db_seconds', 'Время SQL внутри обработчика обновления', ('handler',)))
+ACTION_DB_SECONDS = REGISTRY.add(Histogram(
+    'paintstock_action_db_seconds', 'Время SQL внутри действия меню', ('action',)))
+TELEGRAM_SECONDS = REGISTRY.add(Histogram(
+    'paintstock_telegram_seconds', 'Время вызова Telegram Bot API', ('method',)))
+TELEGRAM_ERRORS = REGISTRY.add(Counter(
+    'paintstock_telegram_errors_total', 'Ошибки вызовов Telegram Bot API', ('method', 'code')))
+REPLICA_UPDATES = REGISTRY.add(Counter(
+    'paintstock_replica_updates_total',
+    'Обновления в режиме реплик: local, forwarded, fallback (владелец недоступен), '
+    'unconfirmed (ответ владельца потерян), received, overloaded (очередь полна, 503), duplicate',
+    ('route',)))
+
+
+def gauge(name, help, func):
+    if ENABLED:
+        REGISTRY.add(Gauge(name, help, func))
+
+
+# Время SQL, накопленное потоком: обработчик берет разницу до и после вызова
+_local = threading.local()
+
+
+def db_seconds():
+    """Сколько секунд текущий поток провел в SQL с начала работы"""
+    return getattr(_local, 'db_seconds', 0.0)
+
+
+def observe_statement(seconds, sql):
+    DB_SECONDS.observe(seconds, statement_kind(sql))
+    _local.db_seconds = db_seconds() + seconds
+
+
+def _instrument(func, seconds, db, errors, *label_values):
+    """Обертка: время вызова, время SQL внутри него и (если errors) вышедшие исключения"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        db_started = db_seconds()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if errors is not None:
+                errors.inc(*label_values)
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started, *label_values)
+            if db is not None:
+                db.observe(db_seconds() - db_started, *label_values)
+    return wrapper
+
+
+def timed(histogram, *label_values):
+    """Декоратор: время вызова в histogram с метками label_values"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        return _instrument(func, histogram, None, None, *label_values)
+    return decorator
+
+
+def action(name):
+    """Действие меню: @metrics.action('add') - время действия и время SQL в нем"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        return _instrument(func, ACTION_SECONDS, ACTION_DB_SECONDS, None, name)
+    return decorator
+
+
+def instrument_handler(func):
+    """Обертка обработчика обновлений: время, время SQL и вышедшие исключения по имени функции"""
+    if not ENABLED:
+        return func
+    return _instrument(func, UPDATE_SECONDS, UPDATE_DB_SECONDS, UPDATE_ERRORS, func.__name__)
+
+
+def statement_kind(sql):
+    """'  SELECT ...' -> 'SELECT' (метка без самого запроса - их слишком много)"""
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ''
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,131 @@
+import csv
+import io
+
+from .grams import to_grams
+
+# Эффекты в том виде, в каком их сохраняет мастер добавления
+EFFECT_NAMES = {
+    'матовый': 'Матовый',
+    'глянец': 'Глянец',
+    'муар': 'Муар',
+    'шагрень': 'Шагрень',
+    'лак': 'Лак',
+}
+
+
+class ParseError(ValueError):
+    """Строка не разобрана; line - номер строки (с 1)"""
+
+    def __init__(self, line, message):
+        super().__init__(f"строка {line}: {message}")
+        self.line = line
+
+
+def parse_amount(text):
+    """Количество в кг (точка или запятая) -> целые граммы"""
+    amount = to_grams(text)
+    if amount <= 0:
+        raise ValueError('количество должно быть положительным')
+    return amount
+
+
+def parse_writeoff_words(words, line=1):
+    """[код..., эффект, количество] -> (color_code, effect, amount)"""
+    if len(words) < 3:
+        raise ParseError(line, 'нужно "КОД эффект количество"')
+    for i, word in enumerate(words[:-1]):
+        effect = EFFECT_NAMES.get(word.lower())
+        if effect:
+            break
+    else:
+        raise ParseError(line, 'не найден эффект')
+    color_code = ' '.join(words[:i])
+    if not color_code:
+        raise ParseError(line, 'не указан код')
+    try:
+        amount = parse_amount(words[-1])
+    except ValueError:
+        raise ParseError(line, f'неверное количество "{words[-1]}"')
+    return color_code, effect, amount
+
+
+def iter_text_lines(text):
+    """Строки сообщения "КОД эффект количество" -> (номер, код, эффект, количество)"""
+    for line, row in enumerate(io.StringIO(text), start=1):
+        words = row.split()
+        if words:
+            yield (line,) + parse_writeoff_words(words, line)
+
+
+def parse_cells(cells, line):
+    """Ячейки таблицы [код, эффект, количество] -> (color_code, effect, amount)"""
+    if len(cells) < 3:
+        raise ParseError(line, 'нужно 3 колонки: код, эффект, количество')
+    effect = EFFECT_NAMES.get(cells[1].lower())
+    if not effect:
+        raise ParseError(line, f'неизвестный эффект "{cells[1]}"')
+    try:
+        amount = parse_amount(cells[2])
+    except ValueError:
+        raise ParseError(line, f'неверное количество "{cells[2]}"')
+    if not cells[0]:
+        raise ParseError(line, 'не указан код')
+    return cells[0], effect, amount
+
+
+def iter_table_rows(rows, errors=None):
+    """Строки таблицы -> (номер, код, эффект, количество).
+
+    Пустые строки и заголовок (первая строка без числа в конце) пропускаются.
+    Если передан список errors, ошибочные строки складываются в него и
+    пропускаются, иначе первая же ошибка прерывает разбор.
+    """
+    for line, row in enumerate(rows, start=1):
+        cells = ['' if cell is None else str(cell).strip() for cell in row]
+        if not any(cells):
+            continue
+        if line == 1 and not _is_number(cells[-1]):
+            continue  # заголовок
+        try:
+            yield (line,) + parse_cells(cells, line)
+        except ParseError as e:
+            if errors is None:
+                raise
+            errors.append(e)
+
+
+def iter_csv_rows(stream, encoding='utf-8-sig', errors=None):
+    """CSV-файл (код; эффект; количество) построчно, без чтения целиком.
+
+    stream - бинарный файловый объект. Разделитель ';' или ',' определяется
+    по первой строке.
+    """
+    text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    first = text.readline()
+    delimiter = ';' if first.count(';') >= first.count(',') else ','
+    yield from iter_table_rows(csv.reader(_chain(first, text), delimiter=delimiter), errors)
+
+
+def iter_xlsx_rows(stream, errors=None):
+    """Первый лист XLSX построчно (openpyxl в режиме read_only)"""
+    import openpyxl  # тяжелый импорт - только когда пришел XLSX
+
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        yield from iter_table_rows(rows, errors)
+    finally:
+        workbook.close()
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def _is_number(text):
+    try:
+        float(str(text).replace(',', '.'))
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,58 @@
+import importlib
+import logging
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HandlerRegistry:
+    """Обработчики модуля, собранные декораторами при импорте.
+
+    К боту они подключаются не при импорте, а в install_handlers - так
+    модуль с обработчиками можно импортировать без бота и собирать бота
+    из нескольких модулей. fallback=True - обработчик «всего остального»:
+    он подключается после обычных обработчиков всех модулей.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def _add(self, kind, filters, fallback):
+        def decorator(func):
+            self.entries.append((kind, filters, fallback, func))
+            return func
+        return decorator
+
+    def message(self, fallback=False, **filters):
+        return self._add('message', filters, fallback)
+
+    def callback_query(self, fallback=False, **filters):
+        return self._add('callback_query', filters, fallback)
+
+    def inline(self, fallback=False, **filters):
+        return self._add('inline', filters, fallback)
+
+
+def load_handlers(names):
+    """Модули обработчиков по именам: 'paintstock.app,mybot.extra' -> [HandlerRegistry]"""
+    registries = []
+    for name in names:
+        module = importlib.import_module(name.strip())
+        registries.append(module.handlers)
+    return registries
+
+
+def install_handlers(bot, registries):
+    """Подключает обработчики к боту: сначала обычные всех модулей по порядку, потом fallback.
+
+    telebot вызывает первый подошедший обработчик, поэтому порядок важен.
+    Каждый обработчик оборачивается метриками времени и ошибок (при METRICS=on).
+    Возвращает число подключенных обработчиков.
+    """
+    entries = [entry for registry in registries for entry in registry.entries]
+    ordered = [entry for entry in entries if not entry[2]] + [entry for entry in entries if entry[2]]
+    for kind, filters, _, func in ordered:
+        getattr(bot, f'register_{kind}_handler')(metrics.instrument_handler(func), **filters)
+    logger.info(f"🧩 Подключено обработчиков: {len(ordered)}")
+    return len(ordered)
@@ -0,0 +1,142 @@
+import re
+import html
+import string
+
+from telebot.types import JsonSerializable
+
+# Лимиты Telegram на одно сообщение: 4096 символов текста после разбора
+# разметки (считаются в UTF-16, как и смещения сущностей) и около 100 сущностей
+MAX_MESSAGE_LENGTH = 4096
+MAX_ENTITIES = 100
+
+# Куски HTML, между которыми можно резать: теги, мнемоники, слова с пробелами
+TOKEN_RE = re.compile(r'<[^>]*>|&#?\w+;|[^<&\s]+\s*|\s+|&')
+TAG_RE = re.compile(r'<(/?)([a-zA-Z][\w-]*)[^>]*>')
+
+
+class FrozenMarkup(JsonSerializable):
+    """Клавиатура, сериализованная один раз: to_json() отдает готовую строку"""
+
+    def __init__(self, markup):
+        self.json = markup.to_json()
+
+    def to_json(self):
+        return self.json
+
+
+def freeze(markup):
+    return FrozenMarkup(markup) if markup is not None else None
+
+
+class Markup(str):
+    """Уже готовый HTML: Template подставляет его без экранирования"""
+
+
+class Template:
+    """Шаблон HTML-ответа в синтаксисе str.format.
+
+    Текст разбирается один раз при создании, в render() подстановки
+    экранируются (кроме Markup) - код краски или имя склада из ввода
+    пользователя не сломает разметку
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._parts = list(string.Formatter().parse(text))
+
+    def render(self, **values):
+        out = []
+        for literal, field, spec, conversion in self._parts:
+            out.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if isinstance(value, Markup):
+                out.append(value)
+            else:
+                out.append(html.escape(format(value, spec) if spec else str(value)))
+        return ''.join(out)
+
+
+def utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def visible_length(text):
+    """Длина HTML-текста так, как ее считает Telegram: без тегов, мнемоники - один символ"""
+    if '<' in text:
+        text = TAG_RE.sub('', text)
+    if '&' in text:
+        text = html.unescape(text)
+    return utf16_length(text)
+
+
+def _entities(text):
+    """Число открывающих тегов; '<' вне тегов в корректном HTML экранирован"""
+    return text.count('<') - text.count('</')
+
+
+def _pieces(text, limit):
+    """(кусок, видимая длина): строки с переводом строки, слишком длинная
+    строка - по словам, длинное слово - по символам"""
+    for line in text.splitlines(keepends=True):
+        units = visible_length(line)
+        if units <= limit:
+            yield line, units
+            continue
+        for token in TOKEN_RE.findall(line):
+            if token.startswith('<'):
+                yield token, 0
+            elif utf16_length(token) <= limit:
+                yield token, visible_length(token)
+            else:
+                # В UTF-16 символ занимает не больше двух единиц
+                step = limit // 2
+                for start in range(0, len(token), step):
+                    yield token[start:start + step], visible_length(token[start:start + step])
+
+
+def _track(piece, stack):
+    """Обновляет стек открытых тегов: [(открывающий тег, имя)]"""
+    for match in TAG_RE.finditer(piece):
+        closing, name = match.group(1), match.group(2).lower()
+        if not closing:
+            stack.append((match.group(0), name))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][1] == name:
+                del stack[i:]
+                break
+
+
+def _closed(parts, stack):
+    return ''.join(parts) + ''.join(f'</{name}>' for _, name in reversed(stack))
+
+
+def split_html(text, limit=MAX_MESSAGE_LENGTH, max_entities=MAX_ENTITIES):
+    """Делит HTML-ответ на сообщения в пределах лимитов Telegram.
+
+    Режет по строкам, строку длиннее лимита - по словам. Теги, открытые
+    на границе, закрываются в конце части и открываются заново в следующей.
+    Короткий текст возвращается как есть, без разбора
+    """
+    if (len(text) * 2 <= limit or utf16_length(text) <= limit) and text.count('<') <= max_entities:
+        return [text]
+    chunks = []
+    parts, units, entities, stack = [], 0, 0, []
+    for piece, piece_units in _pieces(text, limit):
+        piece_entities = _entities(piece)
+        if units and (units + piece_units > limit or entities + piece_entities > max_entities):
+            chunks.append(_closed(parts, stack))
+            parts = [tag for tag, _ in stack]
+            units, entities = 0, len(stack)
+        parts.append(piece)
+        units += piece_units
+        entities += piece_entities
+        # Строка со сбалансированными тегами стек не меняет
+        if piece_entities != piece.count('</'):
+            _track(piece, stack)
+    chunks.append(_closed(parts, stack))
+    # Пустое сообщение Telegram не примет, края он все равно обрезает
+    chunks = [chunk.strip() for chunk in chunks if html.unescape(TAG_RE.sub('', chunk)).strip()]
+    return chunks or [text]
@@ -0,0 +1,420 @@
+"""Несколько реплик бота на одной общей базе (BOT_MODE=replicas).
+
+getUpdates может вызывать только один процесс - второй получает 409
+Conflict. Поэтому обновления забирает лидер: реплика, которая держит
+аренду в таблице leader_lease основной базы (DB_PATH). Лидер продлевает
+аренду после каждого getUpdates и записывает в нее смещение - новый лидер
+продолжит с того же места. Остальные реплики раз в REPLICA_HEARTBEAT
+секунд отмечаются в таблице replicas и пробуют взять просроченную аренду.
+
+Каждое обновление обрабатывает реплика-владелец чата: наибольший хэш
+(chat_id, id реплики) среди живых реплик (rendezvous hashing - когда
+реплика уходит или приходит, переезжают только ее чаты). Лидер отправляет
+пачку обновлений владельцу POST на /replica/updates, тот ставит их в
+очередь своего диспетчера; если очередь полна, владелец сразу отвечает 503,
+не запоминая пачку. Сам лидер обрабатывает пачку, только если она
+точно не дошла: к владельцу не удалось подключиться или он отказал (4xx,
+503). Если запрос ушел, а ответ потерян, пачка повторяется тому же
+владельцу - он отбросит повтор по update_id; не удалось и это - пачка
+считается потерянной, но не обрабатывается дважды. Повтор обновления
+(новый лидер перечитал пачку, которую старый уже раздал) тоже
+отбрасывается по update_id.
+
+SIGTERM - плавная остановка для выката без простоя: реплика помечает себя
+draining (лидер перестает слать ей новые чаты), лидер дописывает смещение
+и отпускает аренду, очередь обновлений и исходящих сообщений дорабатывается.
+Если лидер упал, аренду через REPLICA_LEASE_TTL секунд берет другая
+реплика; обновления, которые упавший процесс уже взял в свою очередь,
+теряются, как и при падении одиночного бота.
+
+Аренда и список реплик - в SQLite-файле, поэтому реплики работают на
+одной машине (или с общим томом) и сравнивают время по одним часам.
+"""
+import os
+import json
+import time
+import hmac
+import zlib
+import socket
+import select
+import signal
+import hashlib
+import threading
+import logging
+import http.client
+import urllib.parse
+from collections import deque
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Куда лидер отправляет обновления чужих чатов
+FORWARD_PATH = '/replica/updates'
+FORWARD_TIMEOUT = 10
+LEASE_NAME = 'polling'
+# Сколько последних update_id помнит реплика, чтобы не обработать повтор
+SEEN_SIZE = 10000
+# Ответы, которые реплика дает, не трогая пачку: ее можно обработать у себя
+REJECTED_STATUSES = (400, 403, 404, 405, 413, 503)
+# Пауза лидера перед новой попыткой поставить свою пачку в полную очередь
+QUEUE_RETRY = 0.05
+
+# Шаг миграции: аренда лидера и живые реплики (в основной базе)
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS leader_lease (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL DEFAULT '',
+        expires_at REAL NOT NULL DEFAULT 0,
+        update_offset INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    f"INSERT OR IGNORE INTO leader_lease (name) VALUES ('{LEASE_NAME}')",
+    '''
+    CREATE TABLE IF NOT EXISTS replicas (
+        id TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        seen_at REAL NOT NULL,
+        draining INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+]
+
+
+class Lease:
+    """Аренда в строке leader_lease: у кого она и до какого времени, плюс смещение getUpdates.
+
+    Взять можно только просроченную или свою аренду - UPDATE с этим условием
+    атомарен, поэтому одновременно ее держит не больше одной реплики.
+    """
+
+    def __init__(self, db, holder, ttl, name=LEASE_NAME):
+        self.db = db
+        self.holder = holder
+        self.ttl = ttl
+        self.name = name
+
+    def _update(self, sql, params):
+        with self.db.transaction() as conn:
+            return conn.execute(sql, params).rowcount == 1
+
+    def acquire(self):
+        now = time.time()
+        return self._update('''
+            UPDATE leader_lease SET holder = ?, expires_at = ?
+            WHERE name = ? AND (holder = ? OR expires_at < ?)
+        ''', (self.holder, now + self.ttl, self.name, self.holder, now))
+
+    def renew(self, offset):
+        """Продлевает аренду и сохраняет смещение. False - аренду уже взял другой"""
+        return self._update('''
+            UPDATE leader_lease SET expires_at = ?, update_offset = ?
+            WHERE name = ? AND holder = ?
+        ''', (time.time() + self.ttl, offset, self.name, self.holder))
+
+    def release(self, offset):
+        """Сохраняет смещение и отпускает аренду - следующий лидер не ждет ее срока"""
+        return self._update('''
+            UPDATE leader_lease SET expires_at = 0, update_offset = ?
+            WHERE name = ? AND holder = ?
+        ''', (offset, self.name, self.holder))
+
+    def offset(self):
+        row = self.db.fetchone('SELECT update_offset FROM leader_lease WHERE name = ?', (self.name,))
+        return row[0] if row else 0
+
+
+def owner(members, key):
+    """id реплики, которая обрабатывает ключ (chat_id): наибольший хэш пары"""
+    return max(members, key=lambda member: zlib.crc32(f'{member}:{key}'.encode('utf-8')))
+
+
+def _closed_by_peer(conn):
+    """Простаивающее keep-alive соединение читаемо, только если другая сторона его закрыла"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def default_secret(token):
+    """Общий секрет реплик, если REPLICA_SECRET не задан: все реплики знают токен бота"""
+    return hashlib.sha256(f'replica:{token}'.encode('utf-8')).hexdigest()
+
+
+class Replica:
+    """Эта реплика: отметки в replicas, борьба за аренду, раздача и прием обновлений.
+
+    on_leader(True/False) вызывается, когда реплика становится лидером и
+    перестает им быть (фоновые задачи, которые должны идти в одном
+    экземпляре). sync() вызывается на каждом шаге отметки - догнать кэши
+    по записям других реплик.
+    """
+
+    def __init__(self, bot, db, url, secret, id=None, lease_ttl=15, heartbeat=1, poll_timeout=5,
+                 on_leader=None, sync=None, offer=None):
+        from telebot import apihelper, types
+        from .dispatcher import update_chat_id
+
+        self._apihelper, self._types, self._chat_id = apihelper, types, update_chat_id
+        self.bot = bot
+        self.db = db
+        self.url = url.rstrip('/')
+        self.secret = secret
+        self.id = id or f'{socket.gethostname()}-{os.getpid()}'
+        self.heartbeat = heartbeat
+        # Реплика считается ушедшей, если не отмечалась столько секунд
+        self.ttl = heartbeat * 5
+        self.lease = Lease(db, self.id, lease_ttl)
+        # Длинный опрос короче аренды: лидер продлевает ее после каждого getUpdates
+        self.poll_timeout = max(1, min(poll_timeout, int(lease_ttl // 3)))
+        self.on_leader = on_leader
+        self.sync = sync
+        # Очередь обработки без ожидания: offer(updates) -> False, если места нет
+        self.offer = offer or self._process
+        self.leading = False
+        self.draining = False
+        self._stopping = threading.Event()
+        self._leader = None
+        self._connections = {}   # url -> HTTPConnection (только поток лидера)
+        self._seen = deque(maxlen=SEEN_SIZE)
+        self._seen_ids = set()
+        self._seen_lock = threading.Lock()
+
+    def start(self):
+        self._beat()
+        threading.Thread(target=self._loop, name='replica', daemon=True).start()
+        logger.info(f"🧬 Реплика {self.id} ({self.url}), аренда {self.lease.ttl} с")
+        return self
+
+    def stop(self, drain=None, timeout=30):
+        """Плавная остановка: новые чаты уходят другим, аренда отпускается, очередь дорабатывается.
+
+        drain(timeout) ждет, пока не будет обработано все, что уже принято.
+        """
+        self.draining = True
+        self._beat()
+        self._stopping.set()
+        leader = self._leader
+        if leader is not None:
+            leader.join(self.poll_timeout + 10)
+        if drain is not None and not drain(timeout):
+            logger.warning(f"⚠️ Реплика {self.id}: очередь не разобрана за {timeout} с")
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM replicas WHERE id = ?', (self.id,))
+        logger.info(f"👋 Реплика {self.id} остановлена")
+
+    def _beat(self):
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO replicas (id, url, seen_at, draining) VALUES (?, ?, ?, ?)',
+                         (self.id, self.url, now, int(self.draining)))
+            # Строки реплик, упавших без остановки
+            conn.execute('DELETE FROM replicas WHERE seen_at < ?', (now - self.ttl * 10,))
+
+    def _loop(self):
+        while not self._stopping.wait(self.heartbeat):
+            try:
+                self._beat()
+                if self.sync is not None:
+                    self.sync()
+                if not self.leading and self.lease.acquire():
+                    self.leading = True
+                    self._leader = threading.Thread(target=self._lead, name='replica-leader', daemon=True)
+                    self._leader.start()
+            except Exception as e:
+                logger.error(f"❌ Ошибка реплики {self.id}: {e}")
+
+    def members(self):
+        """[(id, url)] живых реплик, которые принимают новые чаты"""
+        rows = self.db.fetchall('SELECT id, url FROM replicas WHERE seen_at > ? AND draining = 0 ORDER BY id',
+                                (time.time() - self.ttl,))
+        if not self.draining and all(member != self.id for member, _ in rows):
+            rows.append((self.id, self.url))
+        return rows
+
+    # Лидер
+
+    def _lead(self):
+        logger.info(f"👑 Реплика {self.id} - лидер, забирает обновления")
+        self._notify(True)
+        offset = self.lease.offset()
+        try:
+            # getUpdates не работает, пока у бота установлен webhook
+            self.bot.remove_webhook()
+        except Exception as e:
+            logger.info(f"ℹ️ Webhook clear: {e}")
+        try:
+            while not self._stopping.is_set():
+                if not self.lease.renew(offset):
+                    logger.warning(f"⚠️ Реплика {self.id}: аренду взяла другая реплика")
+                    break
+                try:
+                    updates = self._apihelper.get_updates(self.bot.token, offset, None, self.poll_timeout + 5,
+                                                          None, self.poll_timeout)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка getUpdates: {e}")
+                    self._stopping.wait(1)
+                    continue
+                if updates:
+                    self.distribute(updates)
+                    offset = updates[-1]['update_id'] + 1
+            else:
+                # Остановка, а не потеря аренды: смещение - следующему лидеру
+                self.lease.release(offset)
+        except Exception as e:
+            logger.error(f"❌ Ошибка лидера {self.id}: {e}")
+        finally:
+            self.leading = False
+            self._notify(False)
+
+    def _notify(self, leading):
+        if self.on_leader is None:
+            return
+        try:
+            self.on_leader(leading)
+        except Exception as e:
+            logger.error(f"❌ Ошибка on_leader: {e}")
+
+    def distribute(self, updates):
+        """Раздает пачку getUpdates владельцам чатов; порядок внутри чата сохраняется"""
+        members = self.members()
+        urls = dict(members)
+        batches = {}
+        for data in updates:
+            update = self._types.Update.de_json(data)
+            chat_id = self._chat_id(update)
+            member = owner(urls, chat_id) if chat_id is not None and urls else self.id
+            batches.setdefault(member, []).append((data, update))
+        for member, batch in batches.items():
+            if member == self.id:
+                route = 'local'
+            else:
+                delivered = self._forward(urls[member], [data for data, _ in batch])
+                if delivered is None:
+                    # Пачка могла дойти: обработать ее здесь - значит, возможно, дважды
+                    logger.error(f"❌ Реплика {member} не подтвердила {len(batch)} обновлений, "
+                                 f"у себя не обрабатываем")
+                    self._count('unconfirmed', len(batch))
+                    continue
+                if delivered:
+                    self._count('forwarded', len(batch))
+                    continue
+                route = 'fallback'
+            self._count(route, len(batch))
+            updates = [update for _, update in batch]
+            # Свою часть пачки лидер ждет место в очереди: getUpdates подождет
+            while not self.receive(updates):
+                time.sleep(QUEUE_RETRY)
+
+    def _forward(self, url, batch):
+        """Отправляет пачку владельцу чатов.
+
+        True - принята; False - точно не обработана (не подключились или
+        отказ), лидер может обработать ее сам; None - неизвестно: запрос
+        ушел, а ответа нет.
+        """
+        body = json.dumps(batch, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'X-Replica-Secret': self.secret}
+        sent = False
+        conn = self._connections.pop(url, None)
+        if conn is not None and _closed_by_peer(conn):
+            # Реплика перезапустилась или упала, пока соединение простаивало - ничего не отправлено
+            conn.close()
+            conn = None
+        # Вторая попытка - на новом соединении, если ответ на первую потерялся
+        for attempt in range(2):
+            if conn is None:
+                address = urllib.parse.urlsplit(url)
+                conn = http.client.HTTPConnection(address.hostname, address.port or 80, timeout=FORWARD_TIMEOUT)
+                try:
+                    conn.connect()
+                except OSError as e:
+                    conn.close()
+                    if sent:
+                        return None
+                    logger.warning(f"⚠️ Реплика {url} недоступна: {e}")
+                    return False
+            try:
+                # С этого места владелец может получить пачку
+                sent = True
+                conn.request('POST', FORWARD_PATH, body, headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                conn = None
+                logger.warning(f"⚠️ Реплика {url}: нет ответа на пачку ({e})")
+                continue
+            self._connections[url] = conn
+            if response.status == 200:
+                return True
+            logger.warning(f"⚠️ Реплика {url} ответила {response.status}")
+            return False if response.status in REJECTED_STATUSES else None
+        return None
+
+    # Прием
+
+    def handle_forwarded(self, headers, body):
+        """POST /replica/updates: пачка обновлений от лидера"""
+        if not hmac.compare_digest(headers.get('x-replica-secret', ''), self.secret):
+            return 403, 'text/plain', b'Forbidden'
+        try:
+            updates = [self._types.Update.de_json(data) for data in json.loads(body.decode('utf-8'))]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"⚠️ Некорректная пачка от лидера: {e}")
+            return 400, 'text/plain', b'Bad Request'
+        if not self.receive(updates):
+            # Очередь полна: пачка не принята и не запомнена - лидер обработает ее сам
+            self._count('overloaded', len(updates))
+            return 503, 'text/plain', b'Service Unavailable'
+        self._count('received', len(updates))
+        return 200, 'text/plain', b'OK'
+
+    def receive(self, updates):
+        """Ставит обновления в очередь диспетчера без ожидания, пропуская уже принятые.
+
+        False - в очереди нет места: ничего не поставлено и не запомнено
+        """
+        with self._seen_lock:
+            fresh, ids = [], set()
+            for update in updates:
+                if update.update_id not in self._seen_ids and update.update_id not in ids:
+                    ids.add(update.update_id)
+                    fresh.append(update)
+            # Проверка и постановка - под одной блокировкой: offer не ждет
+            if fresh and not self.offer(fresh):
+                return False
+            for update in fresh:
+                if len(self._seen) == self._seen.maxlen:
+                    self._seen_ids.discard(self._seen[0])
+                self._seen.append(update.update_id)
+                self._seen_ids.add(update.update_id)
+        if len(fresh) < len(updates):
+            self._count('duplicate', len(updates) - len(fresh))
+        return True
+
+    def _process(self, updates):
+        """offer без диспетчера: process_new_updates бота"""
+        self.bot.process_new_updates(updates)
+        return True
+
+    @staticmethod
+    def _count(route, amount):
+        if metrics.ENABLED:
+            metrics.REPLICA_UPDATES.inc(route, amount=amount)
+
+
+def run_until_signal(replica, drain=None, timeout=30):
+    """Запускает реплику и работает до SIGTERM/SIGINT, затем останавливает ее плавно"""
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    replica.start()
+    stop.wait()
+    logger.info(f"🛑 Реплика {replica.id}: сигнал остановки")
+    replica.stop(drain, timeout)
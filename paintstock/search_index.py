@@ -0,0 +1,143 @@
+import re
+import hashlib
+import threading
+from collections import Counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Латинские буквы, похожие на кириллические: "С" и "C", "Р" и "P" и т.п.
+LOOKALIKES = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'o': 'о', 'p': 'р', 't': 'т', 'x': 'х', 'y': 'у', 'ё': 'е',
+})
+SPACES = re.compile(r'[\s_\-.,/]+')
+RAL_PREFIX = re.compile(r'^(ral|рал)\s*')
+
+EXACT_SCORE = 2.0
+MIN_SIMILARITY = 0.3
+# Триграммы, встречающиеся чаще, не порождают кандидатов (как стоп-слова)
+MAX_POSTING = 500
+
+
+def normalize(text):
+    """Ключ поиска: нижний регистр, без префикса RAL, пробелов и двойников букв"""
+    text = text.strip().lower()
+    text = RAL_PREFIX.sub('', text)
+    text = SPACES.sub('', text)
+    return text.translate(LOOKALIKES)
+
+
+def code_digest(code):
+    """Устойчивый короткий id кода для callback_data: одинаков после перезапуска и на всех репликах"""
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()[:24]
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrieNode:
+    __slots__ = ('children', 'codes')
+
+    def __init__(self):
+        self.children = {}
+        self.codes = set()  # коды, ключ которых проходит через этот узел
+
+
+class SearchIndex:
+    """Индекс кодов краски: префиксное дерево и триграммы.
+
+    Точное и префиксное совпадение ищется по дереву, опечатки и частичные
+    совпадения - по триграммам (сходство Жаккара). Индекс строится при
+    старте и пополняется при добавлении новых кодов.
+    """
+
+    def __init__(self, max_prefix_codes=50):
+        self._lock = threading.Lock()
+        self._root = TrieNode()
+        self._trigrams = {}   # триграмма -> множество кодов
+        self._keys = {}       # код -> нормализованный ключ
+        self._exact = {}      # нормализованный ключ -> множество кодов
+        self._grams = {}      # код -> множество его триграмм
+        self._ids = {}        # код -> порядковый номер (только в этом процессе)
+        self._digests = {}    # code_digest(код) -> код
+        self.max_prefix_codes = max_prefix_codes
+
+    def __len__(self):
+        return len(self._keys)
+
+    def build(self, codes):
+        for code in codes:
+            self.add(code)
+        logger.info(f"🔎 Поисковый индекс: {len(self._keys)} кодов")
+
+    def add(self, code):
+        key = normalize(code)
+        if not key:
+            return
+        with self._lock:
+            if code in self._keys:
+                return
+            self._keys[code] = key
+            self._exact.setdefault(key, set()).add(code)
+            self._ids[code] = len(self._ids)
+            self._digests[code_digest(code)] = code
+            node = self._root
+            for char in key:
+                node = node.children.setdefault(char, TrieNode())
+                # В узлах храним ограниченное число кодов: для префиксов
+                # вроде "3" достаточно первых кандидатов
+                if len(node.codes) < self.max_prefix_codes:
+                    node.codes.add(code)
+            grams = frozenset(trigrams(key))
+            self._grams[code] = grams
+            for gram in grams:
+                self._trigrams.setdefault(gram, set()).add(code)
+
+    def code_id(self, code):
+        """Номер кода в индексе (None - кода нет). Номер зависит от порядка
+        добавления - в callback_data и другие процессы не передается"""
+        return self._ids.get(code)
+
+    def by_digest(self, digest):
+        """Код по code_digest (None, если такого нет)"""
+        with self._lock:
+            code = self._digests.get(digest)
+        # Проверка на случай совпадения усеченного хэша
+        return code if code is not None and code_digest(code) == digest else None
+
+    def search(self, query, limit=10):
+        """Кандидаты [(код, оценка)] по убыванию оценки"""
+        key = normalize(query)
+        if not key:
+            return []
+        with self._lock:
+            scores = {code: EXACT_SCORE for code in self._exact.get(key, ())}
+            node = self._root
+            for char in key:
+                node = node.children.get(char)
+                if node is None:
+                    break
+            else:
+                for code in node.codes:
+                    # Короткие коды с тем же префиксом выше длинных
+                    if code not in scores:
+                        scores[code] = 1.0 + len(key) / len(self._keys[code])
+            if not scores:
+                # Нечеткий поиск только если нет точных и префиксных совпадений
+                query_grams = trigrams(key)
+                counts = Counter()
+                for gram in query_grams:
+                    postings = self._trigrams.get(gram)
+                    if postings and len(postings) <= MAX_POSTING:
+                        counts.update(postings)
+                # Точное сходство считаем только для лучших по числу общих триграмм
+                for code, _ in counts.most_common(limit * 5):
+                    common = len(query_grams & self._grams[code])
+                    similarity = common / (len(query_grams) + len(self._grams[code]) - common)
+                    if similarity >= MIN_SIMILARITY:
+                        scores[code] = similarity
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
@@ -0,0 +1,178 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+from .dispatcher import KeyedExecutor
+from .render import split_html
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в личный
+# чат (с небольшими всплесками) и 20 в минуту в группу
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 5
+MAX_CHAT_BUCKETS = 10000
+# SEND_RATE_LIMITS=off - без ограничителей, для нагрузочного теста на заглушке API
+RATE_LIMITS = os.environ.get('SEND_RATE_LIMITS', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, запас не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Забирает токен и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+def configure_transport(pool_size=16):
+    """Общая keep-alive сессия HTTP для всех потоков и адрес API из окружения.
+
+    TELEGRAM_API_URL позволяет направить бота на локальную заглушку API,
+    например http://127.0.0.1:8081/bot{0}/{1}, TELEGRAM_FILE_URL - то же
+    для скачивания файлов (http://127.0.0.1:8081/file/bot{0}/{1})
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    apihelper.session = session
+    apihelper.SESSION_TIME_TO_LIVE = None
+    api_url = os.environ.get('TELEGRAM_API_URL')
+    if api_url:
+        apihelper.API_URL = api_url
+        logger.info(f"🔧 Telegram API: {api_url}")
+    file_url = os.environ.get('TELEGRAM_FILE_URL')
+    if file_url:
+        apihelper.FILE_URL = file_url
+
+
+class Sender:
+    """Очередь исходящих запросов к Telegram.
+
+    Запросы в один чат уходят по порядку, в разные чаты - параллельно.
+    Частота ограничена общим и початовыми token bucket, на 429 запрос
+    повторяется после retry_after. Методы возвращают Future.
+    """
+
+    def __init__(self, bot, workers=8, max_pending=5000, max_retries=3):
+        self.bot = bot
+        self.max_retries = max_retries
+        self.executor = KeyedExecutor(workers, max_pending, max_per_key=100, name='sender')
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chat_buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id):
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if int(chat_id) < 0:
+                    bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+                else:
+                    bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+                self._chat_buckets[chat_id] = bucket
+                if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                    self._chat_buckets.popitem(last=False)
+            else:
+                self._chat_buckets.move_to_end(chat_id)
+            return bucket
+
+    def call(self, key, method, *args, **kwargs):
+        """Ставит вызов bot.<method> в очередь. key (chat_id) задает порядок и лимит чата"""
+        future = Future()
+        self.executor.start()
+        if not self.executor.submit(key, self._run, future, key, method, args, kwargs):
+            future.set_exception(RuntimeError('Очередь отправки переполнена'))
+        return future
+
+    def _run(self, future, chat_id, method, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        for attempt in range(self.max_retries + 1):
+            if RATE_LIMITS:
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).acquire()
+                self.global_bucket.acquire()
+            started = time.perf_counter()
+            try:
+                result = getattr(self.bot, method)(*args, **kwargs)
+                if metrics.ENABLED:
+                    metrics.TELEGRAM_SECONDS.observe(time.perf_counter() - started, method)
+                future.set_result(result)
+                return
+            except apihelper.ApiTelegramException as e:
+                if metrics.ENABLED:
+                    metrics.TELEGRAM_SECONDS.observe(time.perf_counter() - started, method)
+                    metrics.TELEGRAM_ERRORS.inc(method, str(e.error_code))
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after')
+                if e.error_code == 429 and retry_after and attempt < self.max_retries:
+                    logger.warning(f"⏳ 429 на {method} для {chat_id}, ждем {retry_after} с")
+                    time.sleep(retry_after)
+                    continue
+                error = e
+            except Exception as e:
+                if metrics.ENABLED:
+                    metrics.TELEGRAM_SECONDS.observe(time.perf_counter() - started, method)
+                    metrics.TELEGRAM_ERRORS.inc(method, type(e).__name__)
+                error = e
+            logger.error(f"❌ Ошибка {method} для {chat_id}: {error}")
+            future.set_exception(error)
+            return
+
+    def flush(self, timeout=None):
+        """Ждет отправки всего, что уже в очереди"""
+        return self.executor.wait_idle(timeout)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.call(chat_id, 'send_message', chat_id, text, **kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self.call(chat_id, 'edit_message_text', text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+    def send_html(self, chat_id, text, reply_markup=None, **kwargs):
+        """HTML-ответ любой длины: части в пределах лимитов Telegram по порядку, клавиатура - у последней"""
+        chunks = split_html(text)
+        for chunk in chunks[:-1]:
+            self.send_message(chat_id, chunk, parse_mode='HTML', **kwargs)
+        return self.send_message(chat_id, chunks[-1], parse_mode='HTML', reply_markup=reply_markup, **kwargs)
+
+    def edit_html(self, text, chat_id, message_id, reply_markup=None, **kwargs):
+        """Правка HTML-сообщения: первая часть заменяет текст, остальные уходят новыми сообщениями"""
+        chunks = split_html(text)
+        future = self.edit_message_text(chunks[0], chat_id, message_id, parse_mode='HTML',
+                                        reply_markup=reply_markup, **kwargs)
+        for chunk in chunks[1:]:
+            self.send_message(chat_id, chunk, parse_mode='HTML')
+        return future
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        # Ответ на нажатие кнопки не упорядочен с сообщениями чата
+        return self.call(None, 'answer_callback_query', callback_query_id, text, **kwargs)
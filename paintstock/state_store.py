@@ -0,0 +1,133 @@
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30 * 60
+DEFAULT_MAX_SIZE = 10000
+
+
+def pack(state):
+    """Компактная запись: шаг отдельно, остальное - JSON без пробелов"""
+    data = {key: value for key, value in state.items() if key != 'step'}
+    return state['step'], json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data else ''
+
+
+def unpack(step, data):
+    state = json.loads(data) if data else {}
+    state['step'] = step
+    return state
+
+
+class MemoryStateStore:
+    """Состояния диалогов в памяти с TTL и ограничением размера (LRU)"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()   # chat_id -> (step, data, expires_at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, chat_id):
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is None:
+                return None
+            if item[2] <= time.time():
+                del self._items[chat_id]
+                return None
+            return unpack(item[0], item[1])
+
+    def set(self, chat_id, state):
+        step, data = pack(state)
+        with self._lock:
+            self._items[chat_id] = (step, data, time.time() + self.ttl)
+            self._items.move_to_end(chat_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self, chat_id):
+        with self._lock:
+            self._items.pop(chat_id, None)
+
+    def purge(self):
+        """Удаляет просроченные записи, возвращает их число"""
+        now = time.time()
+        with self._lock:
+            expired = [chat_id for chat_id, item in self._items.items() if item[2] <= now]
+            for chat_id in expired:
+                del self._items[chat_id]
+        return len(expired)
+
+
+class SQLiteStateStore:
+    """Состояния диалогов в таблице conversation_states - переживают перезапуск.
+
+    Таблица создается миграцией приложения. Просроченные записи не
+    возвращаются и периодически удаляются; размер ограничен max_size
+    (вытесняются записи с самым ранним сроком).
+    """
+
+    PURGE_EVERY = 200
+
+    def __init__(self, db, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.db.fetchone('SELECT COUNT(*) FROM conversation_states WHERE expires_at > ?',
+                                (time.time(),))[0]
+
+    def get(self, chat_id):
+        row = self.db.fetchone(
+            'SELECT step, data FROM conversation_states WHERE chat_id = ? AND expires_at > ?',
+            (chat_id, time.time()))
+        return unpack(*row) if row else None
+
+    def set(self, chat_id, state):
+        step, data = pack(state)
+        with self.db.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO conversation_states (chat_id, step, data, expires_at) '
+                         'VALUES (?, ?, ?, ?)', (chat_id, step, data, time.time() + self.ttl))
+        # set вызывается из нескольких потоков обработчиков
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self.purge()
+
+    def clear(self, chat_id):
+        # Кнопки меню сбрасывают диалог на каждое нажатие: если его нет,
+        # обходимся чтением, без записи на диск и блокировки
+        if self.db.fetchone('SELECT 1 FROM conversation_states WHERE chat_id = ?', (chat_id,)) is None:
+            return
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM conversation_states WHERE chat_id = ?', (chat_id,))
+
+    def purge(self):
+        with self.db.transaction() as conn:
+            removed = conn.execute('DELETE FROM conversation_states WHERE expires_at <= ?',
+                                   (time.time(),)).rowcount
+            conn.execute('''
+                DELETE FROM conversation_states WHERE chat_id IN (
+                    SELECT chat_id FROM conversation_states
+                    ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_size,))
+        return removed
+
+
+def make_state_store(db, kind='sqlite', ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+    """Хранилище по имени: 'sqlite' (по умолчанию) или 'memory'"""
+    if kind == 'memory':
+        return MemoryStateStore(ttl, max_size)
+    return SQLiteStateStore(db, ttl, max_size)
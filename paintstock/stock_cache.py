@@ -0,0 +1,114 @@
+import bisect
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class StockCache:
+    """Остатки склада в памяти: (color_code, effect) -> количество.
+
+    Загружается один раз при старте и обновляется write-through после каждой
+    записи в базу. Каждое обновление несет версию (id строки transactions),
+    поэтому запоздавшая запись из другого потока не затрет более свежую.
+    """
+
+    # Сколько последних id операций помнит record(): запись, уже попавшая в
+    # «Последние операции», при синхронизации реплик не добавляется второй раз
+    RECORDED_SIZE = 1024
+
+    def __init__(self, recent_size=5):
+        self._lock = threading.Lock()
+        self._items = {}       # (color_code, effect) -> [quantity, version]
+        self._by_code = {}     # color_code -> {effect: quantity}
+        self._keys = []        # отсортированные ключи для списка
+        self._total = 0
+        self._recent = deque(maxlen=recent_size)
+        self._recorded = deque(maxlen=self.RECORDED_SIZE)
+        self._recorded_ids = set()
+        self.loaded = False
+
+    def load(self, backend):
+        """Загружает остатки из хранилища склада (backends.StockBackend). Возвращает версию снимка"""
+        rows, version, recent = backend.snapshot(self._recent.maxlen)
+        with self._lock:
+            self._items = {(code, effect): [quantity, version] for code, effect, quantity in rows}
+            self._by_code = {}
+            for code, effect, quantity in rows:
+                self._by_code.setdefault(code, {})[effect] = quantity
+            self._keys = sorted(self._items)
+            self._total = sum(quantity for _, _, quantity in rows)
+            self._recent.clear()
+            self._recent.extend(reversed(recent))
+            self.loaded = True
+        logger.info(f"📦 Кэш склада загружен: {len(rows)} позиций")
+        return version
+
+    def update(self, color_code, effect, quantity, version):
+        """Новый остаток после записи в базу (version - id транзакции). True - остаток изменился"""
+        key = (color_code, effect)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self._items[key] = [quantity, version]
+                bisect.insort(self._keys, key)
+                self._total += quantity
+            elif version >= item[1]:
+                if quantity == item[0]:
+                    item[1] = version
+                    return False
+                self._total += quantity - item[0]
+                item[0], item[1] = quantity, version
+            else:
+                return False
+            self._by_code.setdefault(color_code, {})[effect] = quantity
+            return True
+
+    def record(self, color_code, effect, amount, date, txn_id=None):
+        """Операция для блока «Последние операции»; операция с уже записанным txn_id пропускается"""
+        with self._lock:
+            if txn_id is not None:
+                if txn_id in self._recorded_ids:
+                    return
+                if len(self._recorded) == self._recorded.maxlen:
+                    self._recorded_ids.discard(self._recorded[0])
+                self._recorded.append(txn_id)
+                self._recorded_ids.add(txn_id)
+            self._recent.append((color_code, effect, amount, date))
+
+    def get(self, color_code, effect):
+        item = self._items.get((color_code, effect))
+        return item[0] if item else None
+
+    def by_code(self, color_code):
+        """[(effect, quantity)] по коду, отсортировано по эффекту"""
+        with self._lock:
+            return sorted(self._by_code.get(color_code, {}).items())
+
+    def items(self):
+        """[(color_code, effect, quantity)] в порядке кода и эффекта"""
+        with self._lock:
+            return [(code, effect, self._items[(code, effect)][0]) for code, effect in self._keys]
+
+    def totals(self):
+        """(число позиций, общий вес)"""
+        with self._lock:
+            return len(self._items), self._total
+
+    def recent(self):
+        """Последние операции, от новых к старым"""
+        with self._lock:
+            return list(reversed(self._recent))
+
+    def diff(self, backend):
+        """Расхождения кэша с базой: [(color_code, effect, в кэше, в базе)]"""
+        rows = backend.stock()
+        actual = {(code, effect): quantity for code, effect, quantity in rows}
+        with self._lock:
+            cached = {key: item[0] for key, item in self._items.items()}
+        mismatches = []
+        for key in sorted(set(actual) | set(cached)):
+            if cached.get(key) != actual.get(key):
+                mismatches.append((key[0], key[1], cached.get(key), actual.get(key)))
+        return mismatches
@@ -0,0 +1,134 @@
+import html
+import threading
+import logging
+from collections import OrderedDict
+
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from .grams import format_kg
+from .render import freeze
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 25
+MAX_CACHED_PAGES = 256
+
+# Keyset-пагинация по уникальному индексу (color_code, effect)
+FIRST_PAGE_SQL = '''
+    SELECT id, color_code, effect, quantity FROM paint_stock
+    ORDER BY color_code, effect LIMIT ?
+'''
+NEXT_PAGE_SQL = '''
+    SELECT id, color_code, effect, quantity FROM paint_stock
+    WHERE (color_code, effect) > (?, ?)
+    ORDER BY color_code, effect LIMIT ?
+'''
+PREV_PAGE_SQL = '''
+    SELECT id, color_code, effect, quantity FROM paint_stock
+    WHERE (color_code, effect) < (?, ?)
+    ORDER BY color_code DESC, effect DESC LIMIT ?
+'''
+
+
+class Page:
+    """Готовая к отправке страница списка"""
+
+    def __init__(self, text, keyboard, low, high):
+        self.text = text
+        self.keyboard = keyboard
+        # Диапазон ключей, от которых зависит страница (None - без границы)
+        self.low = low
+        self.high = high
+
+    def covers(self, key):
+        return (self.low is None or self.low <= key) and (self.high is None or key <= self.high)
+
+
+class StockPages:
+    """Постраничный список склада с кэшем отрисованных страниц.
+
+    Курсор страницы - id граничной строки paints, в callback_data кнопок
+    передается как <prefix>n:<id> (следующая) или <prefix>p:<id> (предыдущая),
+    prefix по умолчанию 'list:'.
+    При изменении остатка сбрасываются только страницы, чей диапазон ключей
+    содержит измененный (color_code, effect).
+    """
+
+    def __init__(self, backend, page_size=PAGE_SIZE, prefix='list:', title='Склад порошковой краски'):
+        self.backend = backend
+        self.page_size = page_size
+        self.prefix = prefix
+        self.title = title
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+
+    def get(self, cursor='f'):
+        """Страница по курсору из callback_data: 'f', 'n:<id>' или 'p:<id>'"""
+        with self._lock:
+            page = self._cache.get(cursor)
+            if page is not None:
+                self._cache.move_to_end(cursor)
+                return page
+            version = self._version
+        page = self._render(cursor)
+        with self._lock:
+            # Если за время чтения что-то изменилось - страницу не кэшируем
+            if page is not None and version == self._version:
+                self._cache[cursor] = page
+                if len(self._cache) > MAX_CACHED_PAGES:
+                    self._cache.popitem(last=False)
+        return page
+
+    def invalidate(self, color_code, effect):
+        key = (color_code, effect)
+        with self._lock:
+            self._version += 1
+            stale = [cursor for cursor, page in self._cache.items() if page.covers(key)]
+            for cursor in stale:
+                del self._cache[cursor]
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._cache.clear()
+
+    def _render(self, cursor):
+        direction, _, paint_id = cursor.partition(':')
+        limit = self.page_size + 1
+        boundary = self.backend.boundary(int(paint_id)) if paint_id else None
+        if direction == 'n' and boundary:
+            rows = self.backend.page(limit, after=boundary)
+            has_prev, has_next = True, len(rows) > self.page_size
+            rows = rows[:self.page_size]
+            low, high = tuple(boundary), (rows[-1][1], rows[-1][2]) if has_next else None
+        elif direction == 'p' and boundary:
+            rows = self.backend.page(limit, before=boundary)
+            has_prev, has_next = len(rows) > self.page_size, True
+            rows = rows[:self.page_size][::-1]
+            low, high = (rows[0][1], rows[0][2]) if has_prev else None, tuple(boundary)
+        else:
+            rows = self.backend.page(limit)
+            has_prev, has_next = False, len(rows) > self.page_size
+            rows = rows[:self.page_size]
+            low, high = None, (rows[-1][1], rows[-1][2]) if has_next else None
+        if not rows:
+            return None
+
+        lines = [f"🎨 <b>{html.escape(self.title)}:</b>\n"]
+        current_code = None
+        for _, color_code, effect, quantity in rows:
+            if color_code != current_code:
+                current_code = color_code
+                lines.append(f"\n🔸 <b>{html.escape(color_code)}:</b>")
+            lines.append(f"   • {html.escape(effect)}: {format_kg(quantity)} кг")
+
+        buttons = []
+        if has_prev:
+            buttons.append(InlineKeyboardButton('◀️ Назад', callback_data=f'{self.prefix}p:{rows[0][0]}'))
+        if has_next:
+            buttons.append(InlineKeyboardButton('Вперед ▶️', callback_data=f'{self.prefix}n:{rows[-1][0]}'))
+        keyboard = InlineKeyboardMarkup(row_width=2)
+        if buttons:
+            keyboard.add(*buttons)
+        return Page('\n'.join(lines), freeze(keyboard) if buttons else None, low, high)
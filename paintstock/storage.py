@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Настройки SQLite, применяемые к каждому соединению пула
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,        # ~16 МБ кэша страниц
+    'mmap_size': 64 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+    'foreign_keys': 'ON',
+}
+
+# Размер кэша подготовленных выражений на соединение
+STATEMENT_CACHE_SIZE = 256
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, которое пишет время каждого запроса в метрики (только при METRICS=on)"""
+
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            metrics.observe_statement(time.perf_counter() - started, sql)
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            metrics.observe_statement(time.perf_counter() - started, sql)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.observe_statement(time.perf_counter() - started, 'COMMIT')
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite: одно соединение на поток"""
+
+    def __init__(self, path, pragmas=None):
+        self.path = path
+        self.pragmas = dict(PRAGMAS, **(pragmas or {}))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Пишущие транзакции потоков одного процесса встают в очередь здесь, а не
+        # в busy-ожидании SQLite: оно не честное, и при многих писателях
+        # отдельный поток может не дождаться блокировки за busy_timeout
+        self._write_lock = threading.Lock()
+        self._connections = []
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,  # транзакциями управляем сами
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=TimedConnection if metrics.ENABLED else sqlite3.Connection,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        with self._lock:
+            self._connections.append(conn)
+        logger.info(f"🔌 Новое соединение с {self.path} ({threading.current_thread().name})")
+        return conn
+
+    def connection(self):
+        """Соединение текущего потока (создается при первом обращении)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def execute(self, sql, params=()):
+        """Выполняет запрос вне явной транзакции (autocommit)"""
+        return self.connection().execute(sql, params)
+
+    def fetchone(self, sql, params=()):
+        return self.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        return self.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Транзакция с автоматическим commit/rollback.
+
+        BEGIN IMMEDIATE сразу берет блокировку на запись, чтобы
+        read-modify-write внутри блока не конфликтовал с другими потоками.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            # Вложенный вызов - работаем в рамках внешней транзакции
+            yield conn
+            return
+        started = time.perf_counter()
+        try:
+            if immediate:
+                with self._write_lock:
+                    yield from self._run(conn, 'BEGIN IMMEDIATE')
+            else:
+                yield from self._run(conn, 'BEGIN')
+        finally:
+            if metrics.ENABLED:
+                metrics.DB_TRANSACTION_SECONDS.observe(time.perf_counter() - started,
+                                                       'immediate' if immediate else 'deferred')
+
+    @staticmethod
+    def _run(conn, begin):
+        conn.execute(begin)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            try:
+                conn.commit()
+            except BaseException:
+                # Например, отложенная проверка внешних ключей - не оставляем транзакцию открытой
+                conn.rollback()
+                raise
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Ошибка закрытия соединения: {e}")
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    """Общий пул для файла базы данных"""
+    path = os.path.abspath(path)
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+def migrate(pool, migrations):
+    """Применяет недостающие миграции схемы.
+
+    migrations - список шагов, версия схемы = номер шага (с 1).
+    Каждый шаг - список SQL-выражений или функция, принимающая соединение.
+    Текущая версия хранится в PRAGMA user_version.
+
+    Внешние ключи на время миграций выключены (так SQLite позволяет
+    пересобирать таблицы), после каждого шага ссылки сверяются
+    PRAGMA foreign_key_check.
+    """
+    conn = pool.connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(migrations):
+        return version
+    conn.execute('PRAGMA foreign_keys = OFF')
+    try:
+        for number, step in enumerate(migrations, start=1):
+            if number <= version:
+                continue
+            with pool.transaction() as conn:
+                if callable(step):
+                    step(conn)
+                else:
+                    for sql in step:
+                        conn.execute(sql)
+                broken = conn.execute('PRAGMA foreign_key_check').fetchall()
+                if broken:
+                    logger.warning(f"⚠️ Схема v{number}: {len(broken)} строк ссылаются на "
+                                   f"несуществующие записи ({broken[0][0]} -> {broken[0][2]})")
+                conn.execute(f'PRAGMA user_version = {number}')
+            logger.info(f"🧱 Схема {pool.path} обновлена до версии {number}")
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {pool.pragmas.get('foreign_keys', 'ON')}")
+    return len(migrations)
+
+
+def explain(pool, sql):
+    """План выполнения запроса (EXPLAIN QUERY PLAN) в виде списка строк"""
+    params = (None,) * sql.count('?')
+    rows = pool.fetchall(f'EXPLAIN QUERY PLAN {sql}', params)
+    return [row[-1] for row in rows]
+
+
+def check_query_plans(pool, queries):
+    """Логирует планы горячих запросов и предупреждает о полных сканах.
+
+    queries - словарь {имя: sql}. Возвращает имена запросов, план которых
+    содержит полный скан таблицы или временное B-дерево для сортировки.
+    """
+    regressions = []
+    for name, sql in queries.items():
+        plan = explain(pool, sql)
+        bad = [step for step in plan
+               if (step.startswith('SCAN ') and ' USING ' not in step)
+               or 'USE TEMP B-TREE' in step]
+        if bad:
+            regressions.append(name)
+            logger.warning(f"⚠️ Запрос {name} без индекса: {'; '.join(plan)}")
+        else:
+            logger.info(f"🔎 План {name}: {'; '.join(plan)}")
+    return regressions
@@ -0,0 +1,419 @@
+import re
+import hmac
+import uuid
+import secrets
+import threading
+import logging
+
+from .stock_cache import StockCache
+from .stock_pages import StockPages
+from .inline_search import InlineSearch
+from .forecasting import Forecaster
+from . import ledger
+
+logger = logging.getLogger(__name__)
+
+# Склад по умолчанию - основная база (DB_PATH); в нем и все, что было до складов
+DEFAULT_WAREHOUSE_ID = 1
+DEFAULT_WAREHOUSE_NAME = 'Основной'
+# Имя склада - одно слово: оно идет первым аргументом /transfer
+NAME_PATTERN = re.compile(r'[\w-]{1,32}')
+
+# Справочник складов и привязки чатов - только в основной базе (DB_PATH)
+REGISTRY_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS warehouses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        path TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chat_warehouses (
+        chat_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL REFERENCES warehouses (id),
+        active INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, warehouse_id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Счетчик изменений справочника и привязок: его ведут триггеры, какой бы
+# путь ни менял таблицы. Реплика перечитывает справочник, только когда
+# счетчик сдвинулся (Warehouses.refresh)
+REGISTRY_VERSION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS registry_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''',
+    'INSERT OR IGNORE INTO registry_version (id, version) VALUES (1, 0)',
+] + [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {table}_version_{event} AFTER {event.upper()} ON {table}
+    BEGIN
+        UPDATE registry_version SET version = version + 1;
+    END
+    '''
+    for table in ('warehouses', 'chat_warehouses') for event in ('insert', 'update', 'delete')
+]
+REGISTRY_VERSION_SQL = 'SELECT version FROM registry_version'
+
+# Журнал переводов - в хранилище каждого склада
+TRANSFERS_SCHEMA = [
+    # Переводы между складами: строка 'out' у отправителя, 'in' у получателя
+    # с одним id. delivered = 0 у 'out' - приход у получателя еще не записан
+    '''
+    CREATE TABLE IF NOT EXISTS transfers (
+        id TEXT PRIMARY KEY,
+        direction TEXT NOT NULL CHECK (direction IN ('out', 'in')),
+        peer INTEGER NOT NULL,
+        color_code TEXT NOT NULL,
+        effect TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        txn_id INTEGER NOT NULL,
+        delivered INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_transfers_pending ON transfers (delivered) WHERE direction = 'out'",
+]
+
+WAREHOUSES_SQL = 'SELECT id, name, path, owner, invite FROM warehouses ORDER BY id'
+
+
+def migrate_warehouse_access(conn):
+    """Шаг миграции: владелец склада и код приглашения для /warehouse_join.
+
+    Складам, заведенным до этого шага, код выдается сразу - владельца у них
+    нет, код видят все уже подключенные чаты
+    """
+    conn.execute('ALTER TABLE warehouses ADD COLUMN owner INTEGER')
+    conn.execute('ALTER TABLE warehouses ADD COLUMN invite TEXT')
+    for (warehouse_id,) in conn.execute('SELECT id FROM warehouses WHERE id != ?',
+                                        (DEFAULT_WAREHOUSE_ID,)).fetchall():
+        conn.execute('UPDATE warehouses SET invite = ? WHERE id = ?', (new_invite(), warehouse_id))
+
+
+def new_invite():
+    return secrets.token_urlsafe(9)
+
+
+def migrate_to_warehouses(conn):
+    """Шаг миграции основной базы: справочник складов и то же, что в файле склада"""
+    for sql in REGISTRY_SCHEMA:
+        conn.execute(sql)
+    conn.execute('INSERT OR IGNORE INTO warehouses (id, name) VALUES (?, ?)',
+                 (DEFAULT_WAREHOUSE_ID, DEFAULT_WAREHOUSE_NAME))
+    migrate_warehouse_file(conn)
+
+
+def migrate_warehouse_file(conn):
+    """Шаг миграции файла склада: переводы (отправка уменьшает остаток - новый DELTA)"""
+    for sql in TRANSFERS_SCHEMA:
+        conn.execute(sql)
+    ledger.recreate_stock_view(conn)
+
+
+class Warehouse:
+    """Склад: свое хранилище (файл SQLite или схема на сервере БД) и свои кэши поверх него.
+
+    Записи разных складов не делят ни файл, ни блокировку на запись.
+    Индекс кодов общий: коды одни и те же на всех складах. db - пул
+    SQLite-журнала; у склада на сервере БД он None, и прогноза расхода
+    и снимков остатков у такого склада нет.
+    """
+
+    def __init__(self, id, name, backend, index, notify, page_size, forecast_interval, snapshot_interval,
+                 owner=None, invite=None):
+        self.id = id
+        self.name = name
+        # Чат, создавший склад, и код, без которого к складу не подключиться
+        # (у склада по умолчанию кода нет - с ним работают все чаты без привязок)
+        self.owner = owner
+        self.invite = invite
+        self.backend = backend
+        self.db = backend.ledger
+        self.stock = StockCache()
+        title = 'Склад порошковой краски' if id == DEFAULT_WAREHOUSE_ID else f'Склад «{name}»'
+        self.pages = StockPages(backend, page_size=page_size, prefix=f'list:{id}:', title=title)
+        self.inline = InlineSearch(index, self.stock)
+        # Последняя операция хранилища, которая уже есть в кэшах (см. Warehouses.sync)
+        self.synced = 0
+        self.forecaster = self.snapshotter = None
+        if self.db is not None:
+            self.forecaster = Forecaster(self.db, notify=lambda chat_id, text: notify(self, chat_id, text),
+                                         interval=forecast_interval)
+            self.snapshotter = ledger.Snapshotter(self.db, interval=snapshot_interval)
+
+    def start(self):
+        if self.db is not None:
+            self.forecaster.start()
+            self.snapshotter.start()
+
+    def stop(self):
+        if self.db is not None:
+            self.forecaster.stop()
+            self.snapshotter.stop()
+
+
+class Warehouses:
+    """Склады и то, к каким складам привязан каждый чат.
+
+    Чат без привязок работает со складом по умолчанию. Привязки и активный
+    склад чата держатся в памяти - обработчику не нужен запрос в базу, чтобы
+    узнать, с каким складом он работает.
+    """
+
+    def __init__(self, db, backend, index, notify, page_size=25, forecast_interval=300,
+                 snapshot_interval=3600):
+        self.db = db            # справочник складов и привязки чатов
+        self.backend = backend  # хранилище склада по умолчанию (STORAGE_DSN)
+        self.index = index
+        self._options = dict(notify=notify, page_size=page_size, forecast_interval=forecast_interval,
+                             snapshot_interval=snapshot_interval)
+        self._warehouses = {}
+        self._version = None  # счетчик registry_version на момент последнего чтения
+        self._chats = {}     # chat_id -> [id складов]
+        self._active = {}    # chat_id -> id активного склада
+        self._lock = threading.Lock()
+        # Склад открывается один раз, даже если его одновременно увидели create и refresh
+        self._opening = threading.Lock()
+        self.started = False
+
+    def load(self):
+        """Открывает склады из справочника (миграции, кэш остатков) и доводит незавершенные переводы"""
+        self._version = self.db.fetchone(REGISTRY_VERSION_SQL)[0]
+        for row in self.db.fetchall(WAREHOUSES_SQL):
+            self._open(*row)
+        chats = self._load_bindings()
+        deliver_pending(self)
+        logger.info(f"🏬 Складов: {len(self._warehouses)}, чатов с привязками: {len(chats)}")
+
+    def _load_bindings(self):
+        chats, active = {}, {}
+        for chat_id, warehouse_id, is_active in self.db.fetchall(
+                'SELECT chat_id, warehouse_id, active FROM chat_warehouses ORDER BY chat_id, warehouse_id'):
+            if warehouse_id in self._warehouses:
+                chats.setdefault(chat_id, []).append(warehouse_id)
+                if is_active:
+                    active[chat_id] = warehouse_id
+        with self._lock:
+            self._chats, self._active = chats, active
+        return chats
+
+    def _open(self, warehouse_id, name, path, owner=None, invite=None):
+        backend = self.backend if path is None else self.backend.sibling(path)
+        backend.init()
+        warehouse = Warehouse(warehouse_id, name, backend, self.index, owner=owner, invite=invite, **self._options)
+        warehouse.synced = warehouse.stock.load(backend)
+        with self._lock:
+            self._warehouses[warehouse_id] = warehouse
+        return warehouse
+
+    def start(self):
+        """Фоновые потоки складов; склады, созданные после старта, запускаются сразу"""
+        for warehouse in self.all():
+            warehouse.start()
+        self.started = True
+
+    def stop(self):
+        self.started = False
+        for warehouse in self.all():
+            warehouse.stop()
+
+    def refresh(self):
+        """Склады и привязки чатов, заведенные другими репликами. Возвращает новые склады.
+
+        Справочник перечитывается, только если сдвинулся счетчик registry_version
+        """
+        # Счетчик - до чтения таблиц: изменение во время чтения даст еще один проход
+        version = self.db.fetchone(REGISTRY_VERSION_SQL)[0]
+        if version == self._version:
+            return []
+        opened = []
+        for row in self.db.fetchall(WAREHOUSES_SQL):
+            with self._opening:
+                if self.get(row[0]) is not None:
+                    continue
+                warehouse = self._open(*row)
+                if self.started:
+                    warehouse.start()
+                opened.append(warehouse)
+        self._load_bindings()
+        self._version = version
+        return opened
+
+    def sync(self, changed):
+        """Догоняет кэши складов по операциям, записанным другими репликами.
+
+        changed(склад, [(txn_id, код, эффект, количество, дата, остаток)])
+        обновляет кэши; свои операции тоже приходят сюда - версии кэша и
+        txn_id в «Последних операциях» не дают применить их дважды.
+        Возвращает число операций.
+        """
+        count = 0
+        for warehouse in self.all():
+            while True:
+                # Хранилище может вернуть и операции до synced (см. PG_CHANGES_OVERLAP)
+                rows = warehouse.backend.changes(warehouse.synced)
+                if rows:
+                    changed(warehouse, rows)
+                fresh = [row for row in rows if row[0] > warehouse.synced]
+                if not fresh:
+                    break
+                warehouse.synced = fresh[-1][0]
+                count += len(fresh)
+        return count
+
+    def all(self):
+        with self._lock:
+            return [self._warehouses[key] for key in sorted(self._warehouses)]
+
+    def get(self, warehouse_id):
+        with self._lock:
+            return self._warehouses.get(warehouse_id)
+
+    def by_name(self, name):
+        name = name.lower()
+        return next((warehouse for warehouse in self.all() if warehouse.name.lower() == name), None)
+
+    @property
+    def default(self):
+        return self.get(DEFAULT_WAREHOUSE_ID)
+
+    def for_chat(self, chat_id):
+        """Склады чата в порядке id (без привязок - склад по умолчанию)"""
+        with self._lock:
+            ids = self._chats.get(chat_id) or [DEFAULT_WAREHOUSE_ID]
+            return [self._warehouses[key] for key in ids]
+
+    def member(self, chat_id, warehouse_id):
+        """Привязан ли чат к складу - проверка для id склада, пришедшего от пользователя"""
+        return any(warehouse.id == warehouse_id for warehouse in self.for_chat(chat_id))
+
+    def active(self, chat_id):
+        """Склад, с которым сейчас работает чат"""
+        with self._lock:
+            warehouse_id = self._active.get(chat_id)
+            if warehouse_id is None:
+                ids = self._chats.get(chat_id)
+                warehouse_id = ids[0] if ids else DEFAULT_WAREHOUSE_ID
+            return self._warehouses[warehouse_id]
+
+    def create(self, name, owner):
+        """Новый склад рядом со складом по умолчанию (файл или схема).
+
+        owner - чат-владелец, ему показывается код приглашения.
+        ValueError - имя не подходит или занято
+        """
+        if not NAME_PATTERN.fullmatch(name):
+            raise ValueError('имя склада - одно слово до 32 символов (буквы, цифры, _ и -)')
+        if self.by_name(name):
+            raise ValueError(f'склад «{name}» уже есть')
+        invite = new_invite()
+        with self.db.transaction() as conn:
+            warehouse_id = conn.execute('INSERT INTO warehouses (name, owner, invite) VALUES (?, ?, ?)',
+                                        (name, owner, invite)).lastrowid
+            path = self.backend.new_path(warehouse_id)
+            conn.execute('UPDATE warehouses SET path = ? WHERE id = ?', (path, warehouse_id))
+        with self._opening:
+            warehouse = self.get(warehouse_id)
+            if warehouse is None:
+                warehouse = self._open(warehouse_id, name, path, owner, invite)
+                if self.started:
+                    warehouse.start()
+        logger.info(f"🏬 Создан склад {name} ({path})")
+        return warehouse
+
+    def join(self, chat_id, name, invite):
+        """Подключает чат к складу по имени и коду приглашения.
+
+        ValueError - склада нет или код не подходит (причина не уточняется,
+        чтобы по ответам нельзя было перебирать имена складов)
+        """
+        warehouse = self.by_name(name)
+        if warehouse is None:
+            raise ValueError('склад не найден или код приглашения не подходит')
+        allowed = warehouse.id == DEFAULT_WAREHOUSE_ID or self.member(chat_id, warehouse.id)
+        if not allowed and warehouse.invite and invite:
+            allowed = hmac.compare_digest(invite.encode(), warehouse.invite.encode())
+        if not allowed:
+            raise ValueError('склад не найден или код приглашения не подходит')
+        self.bind(chat_id, warehouse)
+        return warehouse
+
+    def bind(self, chat_id, warehouse):
+        """Привязывает чат к складу и делает его активным.
+
+        Чат, который до этого работал со складом по умолчанию без привязки,
+        остается привязан и к нему.
+        """
+        with self._lock:
+            ids = list(self._chats.get(chat_id) or [DEFAULT_WAREHOUSE_ID])
+        if warehouse.id not in ids:
+            ids.append(warehouse.id)
+        with self.db.transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO chat_warehouses (chat_id, warehouse_id) VALUES (?, ?)',
+                             [(chat_id, warehouse_id) for warehouse_id in ids])
+            conn.execute('UPDATE chat_warehouses SET active = (warehouse_id = ?) WHERE chat_id = ?',
+                         (warehouse.id, chat_id))
+        with self._lock:
+            self._chats[chat_id] = sorted(ids)
+            self._active[chat_id] = warehouse.id
+
+    def switch(self, chat_id, warehouse_id):
+        """Делает активным один из складов чата. False - чат к нему не привязан"""
+        if not self.member(chat_id, warehouse_id):
+            return False
+        self.bind(chat_id, self.get(warehouse_id))
+        return True
+
+
+def transfer(source, target, color_code, effect, amount):
+    """Перевод краски со склада на склад.
+
+    Отправка и приход - транзакции в разных хранилищах, поэтому перевод
+    записывается как в журнал исходящих: списание 'transfer_out' и строка
+    transfers 'out' - одна транзакция отправителя, приход 'transfer_in' со
+    строкой 'in' того же id - одна транзакция получателя. Если процесс
+    упадет между ними, deliver_pending при старте допишет приход; id
+    перевода не даст записать его дважды.
+
+    Возвращает (остаток у отправителя, id его транзакции, остаток у
+    получателя, id его транзакции) или бросает PaintNotFound /
+    InsufficientStock (ничего не записано).
+    """
+    if source.id == target.id:
+        raise ValueError('склад отправителя и получателя совпадает')
+    transfer_id = uuid.uuid4().hex
+    source_quantity, source_txn = source.backend.send_transfer(transfer_id, target.id, color_code, effect, amount)
+    target_quantity, target_txn = _deliver(source, target, transfer_id, color_code, effect, amount)
+    logger.info(f"🔁 Перевод {color_code} ({effect}) {amount} г: {source.name} -> {target.name}")
+    return source_quantity, source_txn, target_quantity, target_txn
+
+
+def _deliver(source, target, transfer_id, color_code, effect, amount):
+    """Приход перевода у получателя (повторный вызов ничего не меняет) и отметка у отправителя"""
+    quantity, txn_id = target.backend.receive_transfer(transfer_id, source.id, color_code, effect, amount)
+    source.backend.transfer_delivered(transfer_id)
+    return quantity, txn_id
+
+
+def deliver_pending(warehouses):
+    """Дописывает приходы переводов, отправленных до сбоя. Возвращает их число"""
+    delivered = 0
+    for source in warehouses.all():
+        for transfer_id, peer, color_code, effect, amount in source.backend.pending_transfers():
+            target = warehouses.get(peer)
+            if target is None:
+                logger.error(f"❌ Перевод {transfer_id}: склада {peer} нет в справочнике")
+                continue
+            quantity, txn_id = _deliver(source, target, transfer_id, color_code, effect, amount)
+            target.stock.update(color_code, effect, quantity, txn_id)
+            delivered += 1
+    if delivered:
+        logger.warning(f"⚠️ Доставлено переводов, прерванных при сбое: {delivered}")
+    return delivered
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import asyncio
+import hmac
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на входящие запросы
+MAX_BODY_SIZE = 1024 * 1024
+READ_TIMEOUT = 30
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class BotServer:
+    """Единый asyncio HTTP-сервер на $PORT: health checks и webhook Telegram.
+
+    GET / и GET /health отвечают health_text. POST на webhook_path
+    принимает JSON обновления (как его присылает Telegram) и передает его
+    в bot.process_new_updates.
+
+    Сервер можно запустить без бота (bot=None) - до тяжелых импортов и
+    прогрева базы. Пока attach() не вызван, /health отвечает 200 "starting",
+    /ready и webhook - 503 (Telegram повторит доставку). Локально можно
+    проверить так:
+
+        curl -X POST -H 'Content-Type: application/json' \\
+             -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' \\
+             --data @update.json http://localhost:10000/webhook
+    """
+
+    def __init__(self, bot=None, port=None, host='0.0.0.0', webhook_path=None,
+                 secret_token=None, health_text='OK - Paint Bot Running'):
+        self.bot = bot
+        self.host = host
+        self.port = int(port or os.environ.get('PORT', 10000))
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.health_text = health_text
+        self.started = threading.Event()
+        self.thread = None
+        self.routes = {}
+        self.post_routes = {}
+        self.ready = threading.Event()
+        # UPDATE_TRACE=<файл> - запись входящих обновлений для loadtest.py replay
+        self.trace_path = os.environ.get('UPDATE_TRACE') or None
+        self._trace_lock = threading.Lock()
+        if bot is not None:
+            self.ready.set()
+
+    def route(self, path, func):
+        """GET path -> func() в пуле потоков; func возвращает (статус, Content-Type, тело)"""
+        self.routes[path] = func
+
+    def route_post(self, path, func):
+        """POST path -> func(заголовки, тело) в пуле потоков, когда сервис готов; ответ как у route"""
+        self.post_routes[path] = func
+
+    def attach(self, bot, webhook_path=None, secret_token=None, health_text=None):
+        """Подключает бота к уже работающему серверу и помечает сервис готовым"""
+        self.bot = bot
+        self.webhook_path = webhook_path or self.webhook_path
+        self.secret_token = secret_token or self.secret_token
+        self.health_text = health_text or self.health_text
+        self.ready.set()
+
+    async def _dispatch(self, method, path, headers, body):
+        if method in ('GET', 'HEAD') and path in ('/', '/health'):
+            text = self.health_text if self.ready.is_set() else 'starting'
+            return 200, 'text/plain; charset=utf-8', text.encode('utf-8')
+        if method in ('GET', 'HEAD') and path in self.routes:
+            return await self._call(self.routes[path])
+        if method in ('GET', 'HEAD') and path == '/ready':
+            if not self.ready.is_set():
+                return 503, 'text/plain', b'starting'
+            return 200, 'text/plain', b'ready'
+        if path in self.post_routes:
+            if method != 'POST':
+                return 405, 'text/plain', b'POST only'
+            if not self.ready.is_set():
+                return 503, 'text/plain', b'starting'
+            return await self._call(self.post_routes[path], headers, body)
+        if self.webhook_path and path == self.webhook_path:
+            if method != 'POST':
+                return 405, 'text/plain', b'POST only'
+            if not self.ready.is_set():
+                return 503, 'text/plain', b'starting'
+            return await self._handle_update(headers, body)
+        return 404, 'text/plain', b'Not Found'
+
+    async def _handle_update(self, headers, body):
+        from telebot import types  # к этому моменту бот уже загружен
+
+        if self.secret_token:
+            token = headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(token, self.secret_token):
+                return 403, 'text/plain', b'Forbidden'
+        try:
+            data = json.loads(body.decode('utf-8'))
+            update = types.Update.de_json(data)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"⚠️ Некорректное обновление: {e}")
+            return 400, 'text/plain', b'Bad Request'
+        if self.trace_path:
+            await self._call(self._record, data)
+        # Диспетчер может притормозить при переполнении очереди - не блокируем цикл
+        await self._call(self.bot.process_new_updates, [update])
+        return 200, 'text/plain', b'OK'
+
+    def _record(self, data):
+        """Строка трассы: {"t": время получения, "update": обновление как есть}"""
+        line = json.dumps({'t': round(time.time(), 3), 'update': data}, ensure_ascii=False)
+        with self._trace_lock:
+            with open(self.trace_path, 'a', encoding='utf-8') as trace:
+                trace.write(line + '\n')
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, 'text/plain', b'Bad Request', False)
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, 'text/plain', b'Too Large', False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b''
+                path = target.split('?', 1)[0]
+                try:
+                    status, content_type, payload = await self._dispatch(method, path, headers, body)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обработки {method} {path}: {e}")
+                    status, content_type, payload = 500, 'text/plain', b'Internal Error'
+                if method == 'HEAD':
+                    payload = b''
+                await self._respond(writer, status, content_type, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, payload, keep_alive):
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+    async def serve(self):
+        server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        logger.info(f"✅ HTTP сервер запущен на порту {self.port}"
+                    + (f", webhook: {self.webhook_path}" if self.webhook_path else ""))
+        self.started.set()
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    def start_in_thread(self):
+        """Запускает сервер в фоновом потоке"""
+        self.thread = threading.Thread(target=self.serve_forever, name='http-server', daemon=True)
+        self.thread.start()
+        return self.thread
+
+
+def run_bot(bot, health_text='OK - Paint Bot Running', polling=None, server=None):
+    """Запускает бота в режиме из BOT_MODE: webhook или polling (по умолчанию).
+
+    Для webhook нужны WEBHOOK_URL (публичный адрес сервиса) и, желательно,
+    WEBHOOK_SECRET. polling - функция запуска long polling для запасного режима.
+    server - уже запущенный BotServer (быстрый старт), иначе сервер создается здесь.
+    """
+    mode = os.environ.get('BOT_MODE', 'polling').lower()
+    webhook_url = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+    if mode == 'webhook' and not webhook_url:
+        logger.error("❌ BOT_MODE=webhook, но WEBHOOK_URL не задан - используем polling")
+        mode = 'polling'
+
+    if mode == 'webhook':
+        path = os.environ.get('WEBHOOK_PATH', '/webhook')
+        secret = os.environ.get('WEBHOOK_SECRET') or None
+        if server is None:
+            server = BotServer(health_text=health_text)
+            server.start_in_thread()
+        server.started.wait()
+        server.attach(bot, webhook_path=path, secret_token=secret, health_text=health_text)
+        # Регистрируем webhook, когда порт уже слушается
+        bot.set_webhook(url=webhook_url + path, secret_token=secret,
+                        max_connections=int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40)))
+        logger.info(f"🌐 Webhook установлен: {webhook_url}{path}")
+        server.thread.join()
+        return
+
+    if server is None:
+        server = BotServer(health_text=health_text)
+        server.start_in_thread()
+    server.attach(bot, health_text=health_text)
+    try:
+        bot.remove_webhook()
+        logger.info("✅ Webhook cleared")
+    except Exception as e:
+        logger.info(f"ℹ️ Webhook clear: {e}")
+    logger.info("🔄 Запуск polling...")
+    if polling:
+        polling()
+    else:
+        bot.infinity_polling()
@@ -0,0 +1,40 @@
+"""Разбор аргументов /export и границы периода для запроса"""
+from datetime import date
+
+import pytest
+
+from paintstock.exporter import ExportRequest
+
+
+def test_defaults():
+    request = ExportRequest.parse(['transactions'])
+    assert (request.kind, request.fmt, request.date_from, request.date_to) == ('transactions', 'csv', None, None)
+    assert request.params() == (date.min.isoformat(), date.max.isoformat())
+
+
+def test_arguments_in_any_order():
+    request = ExportRequest.parse(['json', '2024-03-01', 'TRANSACTIONS', '2024-03-31'])
+    assert (request.kind, request.fmt) == ('transactions', 'json')
+    assert request.params() == ('2024-03-01', '2024-04-01')
+    assert request.filename == 'transactions_2024-03-01_2024-03-31.json.gz'
+
+
+def test_paints_have_no_period():
+    assert ExportRequest.parse(['paints', 'json']).params() == ()
+
+
+def test_last_representable_day_is_open_ended():
+    request = ExportRequest.parse(['2024-01-01', '9999-12-31'])
+    assert request.date_to is None
+    assert request.params() == ('2024-01-01', date.max.isoformat())
+
+
+@pytest.mark.parametrize('args', [
+    ['вчера'],
+    ['2024-01-01', '2024-02-01', '2024-03-01'],
+    ['2024-02-01', '2024-01-01'],
+    ['2024-02-30'],
+])
+def test_rejected(args):
+    with pytest.raises(ValueError):
+        ExportRequest.parse(args)
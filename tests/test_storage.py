@@ -0,0 +1,234 @@
+"""Проверки хранилища склада: одновременные списания и один набор проверок
+на SQLite и на сервере PostgreSQL.
+
+PostgreSQL - по PAINTSTOCK_TEST_DSN или на встроенном сервере pgserver
+(pip install pgserver psycopg2-binary); без них эти проверки пропускаются.
+Запуск: python -m pytest
+"""
+import os
+import random
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from bench import temp_db
+from paintstock import aggregates, ledger
+from paintstock.backends import SQLiteBackend
+from paintstock.inventory import InsufficientStock, PaintNotFound, WriteOffError, write_off
+
+THREADS = 8
+
+
+def test_concurrent_write_offs(tmp_path):
+    """Много потоков списывают одну краску: остаток сходится до грамма и не уходит в минус"""
+    rows = 4000
+    # Граммы; остатка хватает примерно на треть списаний - проверяется и граница нуля
+    initial = rows * 1000
+    db = temp_db(str(tmp_path), 'stress.sqlite')
+    with db.transaction() as conn:
+        paint_id, _ = ledger.ensure_paint(conn, 'STRESS', 'Глянец')
+        ledger.append(conn, paint_id, 'add', initial)
+
+    written = [[] for _ in range(THREADS)]
+    rejected = [0] * THREADS
+    negative = []
+    barrier = threading.Barrier(THREADS)
+
+    def worker(n):
+        rnd = random.Random(n)
+        barrier.wait()
+        for _ in range(rows // THREADS):
+            amount = rnd.randint(1, 10) * 500
+            try:
+                new_quantity, _ = write_off(db, 'STRESS', 'Глянец', amount)
+            except InsufficientStock:
+                rejected[n] += 1
+                continue
+            written[n].append(amount)
+            if new_quantity < 0:
+                negative.append(new_quantity)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    used = sum(sum(amounts) for amounts in written)
+    final = db.fetchone("SELECT quantity FROM paint_stock WHERE id = ?", (paint_id,))[0]
+    logged = db.fetchone("SELECT COALESCE(SUM(amount), 0) FROM transactions "
+                         "WHERE paint_id = ? AND type = 'use'", (paint_id,))[0]
+    db.close_all()
+    assert sum(rejected), "остатка хватило на все списания - граница нуля не проверена"
+    assert final == initial - used
+    assert logged == used
+    assert final >= 0 and not negative
+
+
+@pytest.fixture(scope='module')
+def postgres_dsn(tmp_path_factory):
+    """Сервер PostgreSQL: PAINTSTOCK_TEST_DSN или pgserver во временном каталоге"""
+    pytest.importorskip('psycopg2')
+    dsn = os.environ.get('PAINTSTOCK_TEST_DSN')
+    if dsn:
+        yield dsn
+        return
+    pgserver = pytest.importorskip('pgserver')
+    try:
+        server = pgserver.get_server(str(tmp_path_factory.mktemp('postgres') / 'pgdata'), cleanup_mode='stop')
+    except Exception as e:
+        pytest.skip(f"pgserver не запустился: {e}")
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        backend = SQLiteBackend(temp_db(str(tmp_path), 'backend.sqlite'), [])
+        # Соседний склад в SQLite - свой файл со своей схемой
+        temp_db(str(tmp_path), backend.new_path(2))
+        yield backend
+        backend.close()
+        return
+    from paintstock.backends import PostgresBackend
+
+    schema = f'test_{os.getpid()}'
+    backend = PostgresBackend(request.getfixturevalue('postgres_dsn'), schema=schema, pool_size=THREADS)
+    yield backend
+    with backend.transaction() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        cursor.execute(f'DROP SCHEMA IF EXISTS {backend.new_path(2)} CASCADE')
+    backend.close()
+
+
+def seed_daily(backend, days):
+    """Итоги прошлых дней [(date, приход)] прямо в daily_totals хранилища"""
+    rows = [(day.isoformat(), added) for day, added in days]
+    if isinstance(backend, SQLiteBackend):
+        with backend.db.transaction() as conn:
+            conn.executemany('INSERT INTO daily_totals (day, added, used, operations) VALUES (?, ?, 0, 1)', rows)
+        return
+    with backend.transaction() as cursor:
+        cursor.executemany('INSERT INTO daily_totals (day, slot, added, used, operations) '
+                           'VALUES (%s, 0, %s, 0, 1)', rows)
+
+
+def test_backend_contract(backend):
+    """Один набор проверок для любого хранилища склада"""
+    backend.init()
+    backend.init()  # повторный запуск не трогает схему
+
+    quantity, first_txn, created = backend.add('3005', 'Матовый', 2500)
+    assert (quantity, created) == (2500, True), "первый приход"
+    quantity, txn_id, created = backend.add('3005', 'Матовый', 500)
+    assert (quantity, created) == (3000, False), "второй приход"
+    assert txn_id > first_txn, "id операций не растут"
+    backend.add('3005', 'Глянец', 1000)
+    assert backend.quantity('3005', 'Матовый') == 3000
+    assert backend.quantity('3005', 'Муар') is None
+    assert backend.search('3005') == [('Глянец', 1000), ('Матовый', 3000)]
+
+    quantity, _ = backend.write_off('3005', 'Матовый', 1200)
+    assert quantity == 1800
+    with pytest.raises(InsufficientStock) as error:
+        backend.write_off('3005', 'Матовый', 5000)
+    assert error.value.available == 1800
+    with pytest.raises(PaintNotFound):
+        backend.write_off('нет такого', 'Матовый', 1)
+    assert backend.quantity('3005', 'Матовый') == 1800, "отказ в списании изменил остаток"
+
+    results = backend.write_off_batch([(1, '3005', 'Матовый', 300), (2, '3005', 'Глянец', 400),
+                                       (3, '3005', 'Матовый', 200)])
+    assert [row[:4] for row in results] == [('3005', 'Матовый', 500, 1300), ('3005', 'Глянец', 400, 600)]
+    with pytest.raises(WriteOffError) as error:
+        backend.write_off_batch([(1, '3005', 'Матовый', 100), (2, '3005', 'Глянец', 10000),
+                                 (3, 'нет такого', 'Лак', 1)])
+    assert len(error.value.problems) == 2, "причины отказа пакета"
+    assert backend.quantity('3005', 'Матовый') == 1300, "отказ пакета изменил остаток"
+
+    codes = ['Ral 9010', 'RAL 9010', 'ral 7016', 'прозрачный 1', 'Черный 2', '100', '20']
+    chunk = [(n, code, 'Шагрень', 100 * n) for n, code in enumerate(codes + codes[:2], start=1)]
+    changed, version = backend.import_chunk(chunk)
+    expected = {(code, 'Шагрень'): 0 for code in codes}
+    for _, code, effect, amount in chunk:
+        expected[(code, effect)] += amount
+    assert {(code, effect): quantity for code, effect, quantity in changed} == expected, "импорт пачки"
+    rows, snapshot_version, recent = backend.snapshot(5)
+    assert version == snapshot_version, "версия пачки - последняя операция"
+    assert sorted(rows) == sorted(backend.stock()), "snapshot и stock расходятся"
+    assert len(recent) == 5 and all(len(row) == 4 for row in recent), "последние операции"
+
+    # Список: порядок ключей как у Python (двоичное сравнение строк), как в кэше остатков
+    keys = sorted((code, effect) for code, effect, _ in backend.stock())
+    first = backend.page(4)
+    assert [row[1:3] for row in first] == keys[:4], "первая страница"
+    after = backend.page(4, after=first[-1][1:3])
+    assert [row[1:3] for row in after] == keys[4:8], "следующая страница"
+    before = backend.page(2, before=after[0][1:3])
+    assert [row[1:3] for row in before] == keys[2:4][::-1], "предыдущая страница"
+    assert tuple(backend.boundary(first[0][0])) == keys[0]
+
+    day = backend.daily(7)
+    assert day and day[0][0] == aggregates.since(1), "агрегат дня"
+    assert day[0][1] == 4000 + sum(amount for *_, amount in chunk) and day[0][2] == 1200 + 900, "агрегат дня"
+    assert backend.weekly(1) and backend.weekly(1)[0][3] == day[0][2], "агрегат недели"
+    assert backend.top_consumers(30, 3)[:1] == [('3005', 2100)], "топ расхода"
+
+    # Неделя на стыке лет - одна строка с одним ключом на обоих хранилищах
+    current = datetime.utcnow().date()
+    new_year = date(current.year, 1, 1)
+    if current - new_year < timedelta(days=14):
+        new_year = date(current.year - 1, 1, 1)
+    seeded = [(new_year + timedelta(days=shift), 100 * (shift + 4)) for shift in range(-3, 4)]
+    seed_daily(backend, seeded)
+    expected_weeks = {}
+    for when, added in seeded:
+        key = aggregates.week_key(when)
+        first_day, total = expected_weeks.get(key, (when.isoformat(), 0))
+        expected_weeks[key] = (first_day, total + added)
+    weeks = {row[0]: (row[1], row[2]) for row in backend.weekly((current - new_year).days // 7 + 3)}
+    assert {key: weeks.get(key) for key in expected_weeks} == expected_weeks, "недели на стыке лет"
+
+    effects = {effect: (positions, quantity) for effect, positions, quantity in backend.effect_breakdown()}
+    assert effects.get('Матовый') == (1, 1300)
+    assert effects.get('Шагрень') == (len(codes), sum(expected.values()))
+
+    # Перевод на соседний склад: приход не задваивается повтором, отправка помечается доставленной
+    other = backend.sibling(backend.new_path(2))
+    other.init()
+    transfer_id = f'check-{os.getpid()}'
+    quantity, _ = backend.send_transfer(transfer_id, 2, '3005', 'Матовый', 300)
+    assert quantity == 1000, "отправка перевода"
+    assert [row[0] for row in backend.pending_transfers()] == [transfer_id], "перевод не в списке ожидающих"
+    received = other.receive_transfer(transfer_id, 1, '3005', 'Матовый', 300)
+    assert other.receive_transfer(transfer_id, 1, '3005', 'Матовый', 300) == received, "повтор прихода"
+    assert other.quantity('3005', 'Матовый') == 300, "приход перевода задвоился или потерялся"
+    backend.transfer_delivered(transfer_id)
+    assert backend.pending_transfers() == [], "доставленный перевод остался ожидающим"
+    assert backend.top_consumers(30, 1) == [('3005', 2100)], "перевод посчитан расходом"
+    other.close()
+
+    # Одновременные списания одной позиции: остаток сходится до грамма и не уходит в минус
+    initial = backend.add('STRESS', 'Глянец', 200 * THREADS * 500)[0]
+    confirmed = [[] for _ in range(THREADS)]
+
+    def worker(n):
+        rnd = random.Random(n)
+        for _ in range(400):
+            amount = rnd.randint(1, 10) * 100
+            try:
+                confirmed[n].append((amount, backend.write_off('STRESS', 'Глянец', amount)[0]))
+            except InsufficientStock:
+                pass
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    used = sum(amount for rows in confirmed for amount, _ in rows)
+    assert backend.quantity('STRESS', 'Глянец') == initial - used, "одновременные списания"
+    assert all(quantity >= 0 for rows in confirmed for _, quantity in rows), "отрицательный остаток"
+    assert backend.daily(1)[0][2] == 1200 + 900 + used, "итог дня после одновременных списаний"